@@ -1,16 +1,180 @@
+import atexit
 import os
 from flask import Flask
+from app.models.database import Database
+from app.utils.gemini_service import ChatService
+from app.utils.response_cache import ResponseCache
+from app.utils.data_analysis_service import DataAnalysisService
+from app.utils.mongo_analysis_service import MongoAnalysisService
+from app.utils.context_builder import ContextBuilder
+from app.utils.usage_stats import UsageStatsService
+from app.utils.turn_writer import TurnWriter
+from app.utils.deletion_jobs import DeletionJobs
+from app.utils.model_warmup import ModelWarmer, parse_hours
+from app.utils.search_index import SearchIndex
+from app.utils.vector_index import QuestionIndex
+from app.utils.batch_chat import BatchChat
+from app.utils.fair_scheduler import FairScheduler
 
 
 def create_app():
+    # Templates and static files live in this package
     app = Flask(__name__)
     
     # Configuration
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key')
     app.config['MONGO_URI'] = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/chatbot_db')
-    app.config['GEMINI_API_KEY'] = os.environ.get('GEMINI_API_KEY', '')
+    app.config['MONGO_MAX_POOL_SIZE'] = int(os.environ.get('MONGO_MAX_POOL_SIZE', '50'))
+    app.config['CONTEXT_MAX_MESSAGES'] = int(os.environ.get('CONTEXT_MAX_MESSAGES', '6'))
+    app.config['CONTEXT_TOKEN_BUDGET'] = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '2000'))
+    app.config['CONTEXT_SUMMARY_TOKEN_BUDGET'] = int(os.environ.get('CONTEXT_SUMMARY_TOKEN_BUDGET', '300'))
+    app.config['RESPONSE_CACHE_ENABLED'] = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    app.config['RESPONSE_CACHE_MAX_BYTES'] = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+    app.config['RESPONSE_CACHE_TTL'] = int(os.environ.get('RESPONSE_CACHE_TTL', '86400'))
+    app.config['RESPONSE_CACHE_PERSISTENT'] = os.environ.get('RESPONSE_CACHE_PERSISTENT', 'false').lower() == 'true'
+    app.config['ANALYTICS_ENGINE'] = os.environ.get('ANALYTICS_ENGINE', 'counters')
+    app.config['WRITE_BEHIND_ENABLED'] = os.environ.get('WRITE_BEHIND_ENABLED', 'true').lower() == 'true'
+    app.config['WRITE_BEHIND_QUEUE_SIZE'] = int(os.environ.get('WRITE_BEHIND_QUEUE_SIZE', '10000'))
+    app.config['DELETE_CHUNK_SIZE'] = int(os.environ.get('DELETE_CHUNK_SIZE', '500'))
+    app.config['WRITE_BEHIND_SPILL_DIR'] = os.environ.get('WRITE_BEHIND_SPILL_DIR', os.path.join(app.instance_path, 'spill'))
+    app.config['OLLAMA_WARMUP_ENABLED'] = os.environ.get('OLLAMA_WARMUP_ENABLED', 'true').lower() == 'true'
+    app.config['OLLAMA_KEEPALIVE_INTERVAL'] = float(os.environ.get('OLLAMA_KEEPALIVE_INTERVAL', '240'))
+    app.config['OLLAMA_KEEPALIVE_HOURS'] = parse_hours(os.environ.get('OLLAMA_KEEPALIVE_HOURS', '8-20'))
+    app.config['SEARCH_INDEX_ENABLED'] = os.environ.get('SEARCH_INDEX_ENABLED', 'true').lower() == 'true'
+    app.config['SEARCH_REFRESH_INTERVAL'] = float(os.environ.get('SEARCH_REFRESH_INTERVAL', '5'))
+    app.config['QUESTION_INDEX_ENABLED'] = os.environ.get('QUESTION_INDEX_ENABLED', 'true').lower() == 'true'
+    app.config['QUESTION_INDEX_DIR'] = os.environ.get('QUESTION_INDEX_DIR', os.path.join(app.instance_path, 'questions'))
+    app.config['QUESTION_INDEX_DIM'] = int(os.environ.get('QUESTION_INDEX_DIM', '256'))
+    app.config['QUESTION_INDEX_REFRESH_INTERVAL'] = float(os.environ.get('QUESTION_INDEX_REFRESH_INTERVAL', '5'))
+    app.config['SIMILAR_CONTEXT_ENABLED'] = os.environ.get('SIMILAR_CONTEXT_ENABLED', 'false').lower() == 'true'
+    app.config['SIMILAR_CONTEXT_MIN_SCORE'] = float(os.environ.get('SIMILAR_CONTEXT_MIN_SCORE', '0.7'))
+    app.config['CHAT_BATCH_CONCURRENCY'] = int(os.environ.get('CHAT_BATCH_CONCURRENCY', '8'))
+    app.config['CHAT_BATCH_MAX_QUESTIONS'] = int(os.environ.get('CHAT_BATCH_MAX_QUESTIONS', '500'))
+    app.config['SCHEDULER_ENABLED'] = os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
+    app.config['SCHEDULER_MAX_CONCURRENCY'] = int(os.environ.get('SCHEDULER_MAX_CONCURRENCY', '8'))
+    app.config['SCHEDULER_MAX_QUEUE'] = int(os.environ.get('SCHEDULER_MAX_QUEUE', '200'))
+    app.config['SCHEDULER_MAX_USER_QUEUE'] = int(os.environ.get('SCHEDULER_MAX_USER_QUEUE', '20'))
+    app.config['SCHEDULER_USER_RATE'] = float(os.environ.get('SCHEDULER_USER_RATE', '0'))
+    app.config['SCHEDULER_USER_BURST'] = float(os.environ.get('SCHEDULER_USER_BURST', '10'))
+    app.config['SCHEDULER_QUEUE_TIMEOUT'] = float(os.environ.get('SCHEDULER_QUEUE_TIMEOUT', '30'))
+    
+    # One pooled MongoDB client shared by all requests and threads.
+    # Indexes are created here, once, instead of on every request.
+    database = Database(app.config['MONGO_URI'], max_pool_size=app.config['MONGO_MAX_POOL_SIZE'])
+    
+    # Cache of answers to repeated standalone questions, optionally shared through MongoDB
+    response_cache = None
+    if app.config['RESPONSE_CACHE_ENABLED']:
+        response_cache = ResponseCache(
+            max_bytes=app.config['RESPONSE_CACHE_MAX_BYTES'],
+            ttl_seconds=app.config['RESPONSE_CACHE_TTL'],
+            collection=database.db['response_cache'] if app.config['RESPONSE_CACHE_PERSISTENT'] else None
+        )
+    
+    # Initialize services
+    try:
+        # Ollama Qwen2.5 as primary with Gemini as fallback
+        chat_service = ChatService(response_cache=response_cache)
+    except Exception as e:
+        print(f"Error initializing Ollama/Gemini service: {e}")
+        raise
+    
+    # Health checks of the Ollama hosts, so requests only go to nodes that are up with the model
+    ollama_hosts = chat_service.ollama_service.hosts
+    if len(ollama_hosts) > 1:
+        ollama_hosts.start()
+        atexit.register(ollama_hosts.stop)
+    
+    # Generations take turns between users for a bounded number of backend slots
+    if app.config['SCHEDULER_ENABLED']:
+        chat_service.scheduler = FairScheduler(
+            max_concurrency=app.config['SCHEDULER_MAX_CONCURRENCY'],
+            max_queue=app.config['SCHEDULER_MAX_QUEUE'],
+            max_user_queue=app.config['SCHEDULER_MAX_USER_QUEUE'],
+            user_rate=app.config['SCHEDULER_USER_RATE'],
+            user_burst=app.config['SCHEDULER_USER_BURST'],
+            queue_timeout=app.config['SCHEDULER_QUEUE_TIMEOUT']
+        )
+    
+    # Load the model before the first chat and keep it loaded during business hours
+    model_warmer = None
+    if app.config['OLLAMA_WARMUP_ENABLED']:
+        model_warmer = ModelWarmer(
+            chat_service.ollama_service,
+            interval=app.config['OLLAMA_KEEPALIVE_INTERVAL'],
+            hours=app.config['OLLAMA_KEEPALIVE_HOURS']
+        )
+        model_warmer.start()
+        atexit.register(model_warmer.stop)
+    
+    data_analysis_service = DataAnalysisService()
+    
+    # Store services in app config for access in routes
+    app.config['GEMINI_SERVICE'] = chat_service  # Keep the config name for compatibility
+    app.config['DATA_ANALYSIS_SERVICE'] = data_analysis_service
+    app.config['DATABASE'] = database
+    app.config['MODEL_WARMER'] = model_warmer
+    app.config['USAGE_STATS'] = UsageStatsService(database)
+    
+    # Chat turns are written by a background queue, spilling to local disk while MongoDB is unavailable
+    turn_writer = TurnWriter(
+        database,
+        app.config['USAGE_STATS'],
+        write_behind=app.config['WRITE_BEHIND_ENABLED'],
+        queue_size=app.config['WRITE_BEHIND_QUEUE_SIZE'],
+        spill_dir=app.config['WRITE_BEHIND_SPILL_DIR'] or None
+    )
+    atexit.register(turn_writer.close)  # flush deferred writes on shutdown
+    app.config['TURN_WRITER'] = turn_writer
+    app.config['MONGO_ANALYSIS_SERVICE'] = MongoAnalysisService(database)
+    app.config['DELETION_JOBS'] = DeletionJobs(
+        database, chunk_size=app.config['DELETE_CHUNK_SIZE'], usage_stats=app.config['USAGE_STATS']
+    )
+    
+    # Batch questions share one bounded pool of workers, so a large batch cannot flood the LLM backend
+    batch_chat = BatchChat(chat_service, turn_writer, max_workers=app.config['CHAT_BATCH_CONCURRENCY'])
+    atexit.register(batch_chat.close)
+    app.config['BATCH_CHAT'] = batch_chat
+    
+    # In-process BM25 index of message contents for /api/history/search, built in the background
+    search_index = None
+    if app.config['SEARCH_INDEX_ENABLED']:
+        search_index = SearchIndex(database, refresh_interval=app.config['SEARCH_REFRESH_INTERVAL'])
+        search_index.start()
+    app.config['SEARCH_INDEX'] = search_index
+    
+    # Embeddings of past questions on memory-mapped files, for similar questions and related context
+    question_index = None
+    if app.config['QUESTION_INDEX_ENABLED']:
+        question_index = QuestionIndex(
+            database,
+            app.config['QUESTION_INDEX_DIR'],
+            dim=app.config['QUESTION_INDEX_DIM'],
+            refresh_interval=app.config['QUESTION_INDEX_REFRESH_INTERVAL']
+        )
+        question_index.start()
+        atexit.register(question_index.stop)
+        if app.config['SIMILAR_CONTEXT_ENABLED']:
+            min_score = app.config['SIMILAR_CONTEXT_MIN_SCORE']
+            chat_service.context_hook = lambda user_input, user_id: question_index.related_context(
+                user_input, user_id, min_score=min_score
+            )
+    app.config['QUESTION_INDEX'] = question_index
+    app.config['CONTEXT_BUILDER'] = ContextBuilder(
+        database,
+        max_messages=app.config['CONTEXT_MAX_MESSAGES'],
+        token_budget=app.config['CONTEXT_TOKEN_BUDGET'],
+        summary_token_budget=app.config['CONTEXT_SUMMARY_TOKEN_BUDGET']
+    )
     
     # Import and register blueprints
+    from app.routes.metrics import bp as metrics_bp, TimedJSONProvider
+    app.json = TimedJSONProvider(app)
+    app.register_blueprint(metrics_bp)
+    
+    from app.routes.health import bp as health_bp
+    app.register_blueprint(health_bp)
+    
     from app.routes.main import bp as main_bp
     app.register_blueprint(main_bp)
     
@@ -20,4 +184,19 @@ def create_app():
     from app.routes.api import bp as api_bp
     app.register_blueprint(api_bp)
     
-    return app
\ No newline at end of file
+    from app.routes.analytics import analytics_bp
+    app.register_blueprint(analytics_bp)
+    
+    from app.commands import register_commands
+    register_commands(app)
+    
+    return app
+
+
+def create_asgi_app():
+    """
+    ASGI entry point, e.g. `uvicorn --factory app:create_asgi_app`.
+    Chat endpoints run on asyncio; all other routes are served by the Flask app.
+    """
+    from app.asgi import AsgiChatApp
+    return AsgiChatApp(create_app())
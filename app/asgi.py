@@ -0,0 +1,181 @@
+import asyncio
+import json
+import os
+import time
+
+from a2wsgi import WSGIMiddleware
+
+from app.routes.api import _prepare_chat, _save_turn, _sse
+from app.utils.async_llm import AsyncChatService
+from app.utils.llm_errors import AllBackendsFailedError, OverloadedError
+from app.utils.metrics import HTTP_REQUEST_SECONDS, JSON_SERIALIZE_SECONDS, current_route
+
+
+class AsgiChatApp:
+    """
+    ASGI front end for the Flask app.
+
+    POST /api/chat and /api/chat/stream are served natively on asyncio, so a
+    pending LLM generation costs a coroutine instead of a worker thread.
+    Every other route is passed through to the Flask WSGI app on a thread
+    pool. Database work stays synchronous and runs in worker threads.
+    """
+
+    def __init__(self, flask_app, async_chat_service=None, wsgi_workers=None):
+        self.flask_app = flask_app
+        self.chat_service = async_chat_service or AsyncChatService(flask_app.config['GEMINI_SERVICE'])
+        if wsgi_workers is None:
+            wsgi_workers = int(os.getenv('ASGI_WSGI_WORKERS', '16'))
+        self.wsgi = WSGIMiddleware(flask_app, workers=wsgi_workers)
+        self.routes = {
+            ('POST', '/api/chat'): self.chat,
+            ('POST', '/api/chat/stream'): self.chat_stream,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] == 'http':
+            handler = self.routes.get((scope['method'], scope['path']))
+            if handler:
+                await self._timed(handler, scope, receive, send)
+                return
+        await self.wsgi(scope, receive, send)
+
+    async def _timed(self, handler, scope, receive, send):
+        """Run a native route with the same request metrics as the Flask routes"""
+        # Each request runs in its own task, so this labels only this request's work
+        current_route.set(scope['path'])
+        started = time.perf_counter()
+
+        async def send_timed(message):
+            if message['type'] == 'http.response.start':
+                HTTP_REQUEST_SECONDS.observe(
+                    time.perf_counter() - started, scope['path'], scope['method'], str(message['status'])
+                )
+            await send(message)
+
+        await handler(scope, receive, send_timed)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.chat_service.close()
+                await asyncio.to_thread(self.flask_app.config['TURN_WRITER'].close)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_json(self, receive):
+        """The parsed request body, or None when it is not valid JSON"""
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        try:
+            return json.loads(body or b'{}')
+        except ValueError:
+            return None
+
+    async def _send_json(self, send, payload, status=200, headers=None):
+        with JSON_SERIALIZE_SECONDS.time(current_route.get()):
+            body = json.dumps(payload).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] +
+                       [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    def _in_app_context(self, func, *args):
+        """Run a synchronous route helper inside the Flask app context"""
+        with self.flask_app.app_context():
+            return func(*args)
+
+    async def _prepare(self, receive, send):
+        """Validate the request and load its context in a worker thread; None if an error was sent"""
+        data = await self._read_json(receive)
+        db = self.flask_app.config['DATABASE']
+        chat_request, error = await asyncio.to_thread(self._in_app_context, _prepare_chat, db, data)
+        if error:
+            response, status, *headers = error
+            await self._send_json(send, response.get_json(), status, *headers)
+            return None
+        return chat_request
+
+    async def _save(self, chat_request, response_text):
+        db = self.flask_app.config['DATABASE']
+        return await asyncio.to_thread(
+            self._in_app_context, _save_turn, db, chat_request['user_id'],
+            chat_request['conversation_id'], chat_request['user_message'], response_text
+        )
+
+    async def chat(self, scope, receive, send):
+        """Async implementation of POST /api/chat"""
+        try:
+            chat_request = await self._prepare(receive, send)
+            if chat_request is None:
+                return
+            response_text = await self.chat_service.get_chat_response(
+                chat_request['user_message'], chat_request['history'],
+                use_cache=chat_request['use_cache'], user_id=chat_request['user_id']
+            )
+            conversation_id = await self._save(chat_request, response_text)
+            await self._send_json(send, {'response': response_text, 'conversation_id': str(conversation_id)})
+        except OverloadedError as e:
+            await self._send_json(send, {'error': 'Too many requests', 'reason': e.reason, 'retry_after': e.retry_after},
+                                  429, {'Retry-After': str(e.retry_after)})
+        except AllBackendsFailedError as e:
+            print(f"No LLM backend available: {str(e)}")
+            await self._send_json(send, {'error': 'LLM service unavailable'}, 503)
+        except Exception as e:
+            print(f"Error in async chat endpoint: {str(e)}")
+            await self._send_json(send, {'error': 'Internal server error'}, 500)
+
+    async def chat_stream(self, scope, receive, send):
+        """Async implementation of POST /api/chat/stream (Server-Sent Events)"""
+        try:
+            chat_request = await self._prepare(receive, send)
+            if chat_request is None:
+                return
+        except Exception as e:
+            print(f"Error in async chat stream endpoint: {str(e)}")
+            await self._send_json(send, {'error': 'Internal server error'}, 500)
+            return
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                        (b'x-accel-buffering', b'no')]
+        })
+
+        async def emit(payload):
+            await send({'type': 'http.response.body', 'body': _sse(payload).encode(), 'more_body': True})
+
+        chunks = []
+        try:
+            async for chunk in self.chat_service.stream_chat_response(
+                    chat_request['user_message'], chat_request['history'],
+                    use_cache=chat_request['use_cache'], user_id=chat_request['user_id']):
+                chunks.append(chunk)
+                await emit({'type': 'token', 'content': chunk})
+
+            response_text = ''.join(chunks)
+            conversation_id = await self._save(chat_request, response_text)
+            await emit({'type': 'done', 'response': response_text, 'conversation_id': str(conversation_id)})
+        except OverloadedError as e:
+            await emit({'type': 'error', 'error': 'Too many requests', 'retry_after': e.retry_after})
+        except AllBackendsFailedError as e:
+            print(f"No LLM backend available: {str(e)}")
+            await emit({'type': 'error', 'error': 'LLM service unavailable'})
+        except Exception as e:
+            print(f"Error while streaming async chat response: {str(e)}")
+            await emit({'type': 'error', 'error': 'Internal server error'})
+        await send({'type': 'http.response.body', 'body': b''})
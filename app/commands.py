@@ -0,0 +1,28 @@
+import click
+from flask import current_app
+
+
+def register_commands(app):
+    """Register maintenance commands, run with `flask --app app <command>`"""
+
+    @app.cli.command('backfill-usage')
+    @click.option('--user-id', default=None, help='Only rebuild counters for this user')
+    def backfill_usage(user_id):
+        """Rebuild the pre-aggregated usage counters from existing conversations and messages"""
+        written = current_app.config['USAGE_STATS'].rebuild(user_id)
+        click.echo(f"Rebuilt {written} daily usage documents")
+
+
+    @app.cli.command('gc-messages')
+    @click.option('--batch-size', default=1000, show_default=True, help='Conversation ids checked per batch')
+    @click.option('--dry-run', is_flag=True, help='Only count orphaned messages')
+    def gc_messages(batch_size, dry_run):
+        """Purge messages whose conversation has been deleted"""
+        def progress(checked, deleted):
+            click.echo(f"Checked {checked} conversations, {'found' if dry_run else 'deleted'} {deleted} orphaned messages")
+
+        result = current_app.config['DELETION_JOBS'].purge_orphaned_messages(batch_size, dry_run, progress)
+        click.echo(
+            f"{'Found' if dry_run else 'Purged'} {result['messages_deleted']} orphaned messages "
+            f"of {result['orphaned_conversations']} deleted conversations"
+        )
@@ -1,13 +1,78 @@
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from bson import ObjectId
+from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
+from app.utils.metrics import MongoCommandTimer
 
 load_dotenv()
 
+# Fields returned by conversation listings; summaries and user_id stay in the database
+CONVERSATION_LIST_FIELDS = ('title', 'created_at', 'updated_at')
+
+
+def _keyset_condition(operator, key):
+    """Filter for messages strictly after ($gt) or before ($lt) a (timestamp, _id) position"""
+    timestamp, message_id = key
+    return {'$or': [
+        {'timestamp': {operator: timestamp}},
+        {'timestamp': timestamp, '_id': {operator: message_id}}
+    ]}
+
+
+def _stamp_saved(messages):
+    """
+    Mark messages with the time they are actually written. Write-behind
+    assigns _ids and timestamps before the insert, possibly long before when
+    they are replayed from the spill log, so indexes that pick up new
+    messages go by saved_at instead.
+    """
+    saved_at = datetime.utcnow()
+    for message in messages:
+        message['saved_at'] = saved_at
+    return messages
+
+
+def saved_time(message):
+    """When a message was written, in epoch seconds; its _id time if it has no saved_at"""
+    saved_at = message.get('saved_at')
+    if saved_at is None:
+        return message['_id'].generation_time.timestamp()
+    return saved_at.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _insert_new(collection, documents):
+    """
+    Insert documents with preassigned _ids, skipping those that already exist,
+    so a batch that is applied twice (after a retry or a replay) is harmless
+    """
+    try:
+        collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        if e.details.get('writeConcernErrors') or any(
+                error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+            raise
+
+
 class Database:
-    def __init__(self, mongo_uri=None):
-        # Connect to MongoDB
-        self.client = MongoClient(mongo_uri or os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+    """
+    Shared MongoDB access layer.
+
+    A single instance is created in create_app() and reused by every request.
+    MongoClient is thread-safe and keeps its own connection pool, so routes
+    must not close it.
+    """
+
+    def __init__(self, mongo_uri=None, max_pool_size=None, create_indexes=True):
+        # Connect to MongoDB with a bounded connection pool; every command is timed for /metrics
+        if max_pool_size is None:
+            max_pool_size = int(os.getenv('MONGO_MAX_POOL_SIZE', '50'))
+        self.client = MongoClient(
+            mongo_uri or os.getenv('MONGO_URI', 'mongodb://localhost:27017/'),
+            maxPoolSize=max_pool_size,
+            event_listeners=[MongoCommandTimer()]
+        )
         self.db = self.client['chatbot_db']
         
         # Collections
@@ -15,22 +80,34 @@ class Database:
         self.conversations = self.db['conversations']
         self.messages = self.db['messages']
         
-        # Create indexes for better performance
-        self._create_indexes()
+        # Create indexes once for the lifetime of the client
+        if create_indexes:
+            try:
+                self._create_indexes()
+            except Exception as e:
+                print(f"Error creating MongoDB indexes: {str(e)}")
     
     def _create_indexes(self):
         """Create indexes for better query performance"""
-        # Index for user_id in conversations
-        self.conversations.create_index([('user_id', 1)])
+        # Compound index for a user's conversations, newest first; also serves user_id lookups
+        self.conversations.create_index([('user_id', 1), ('_id', -1)])
         
-        # Index for conversation_id in messages
-        self.messages.create_index([('conversation_id', 1)])
+        # Compound index so "latest N messages of a conversation" is an index walk;
+        # _id breaks ties between messages saved in the same millisecond.
+        # It also serves plain conversation_id lookups, so no separate index is needed.
+        self.messages.create_index([('conversation_id', 1), ('timestamp', -1), ('_id', -1)])
         
         # Index for timestamp in messages for sorting
         self.messages.create_index([('timestamp', -1)])
         
+        # Index for the search and question indexes picking up newly written messages
+        self.messages.create_index([('saved_at', 1)])
+        
         # Index for conversation title for search
         self.conversations.create_index([('title', 'text')])
+        
+        # One document per user, so user upserts are idempotent
+        self.users.create_index([('user_id', 1)], unique=True)
     
     def get_user(self, user_id):
         """Get user by ID"""
@@ -40,9 +117,37 @@ class Database:
         """Create a new user"""
         return self.users.insert_one(user_data)
     
-    def get_conversations(self, user_id, limit=50):
-        """Get conversations for a user"""
-        return list(self.conversations.find({'user_id': user_id}).sort('_id', -1).limit(limit))
+    def ensure_user(self, user_id, created_at):
+        """Create the user if it does not exist yet, in one idempotent upsert"""
+        return self.users.update_one(
+            {'user_id': user_id},
+            {'$setOnInsert': {'user_id': user_id, 'created_at': created_at}},
+            upsert=True
+        )
+    
+    def get_conversations(self, user_id, limit=50, before=None, fields=None):
+        """
+        Get conversations for a user, newest first. `before` is an ObjectId to
+        continue after (keyset pagination); `fields` limits the returned fields.
+        """
+        query = {'user_id': user_id}
+        if before is not None:
+            query['_id'] = {'$lt': before}
+        projection = {field: 1 for field in fields} if fields is not None else None
+        return list(self.conversations.find(query, projection).sort('_id', -1).limit(limit))
+    
+    def get_conversation_page(self, user_id, limit=50, before=None, fields=CONVERSATION_LIST_FIELDS):
+        """
+        One page of a user's conversation list and the cursor for the next page
+        (None on the last page). Each page is an index range scan on
+        (user_id, _id), so its cost does not grow with the page number.
+        """
+        conversations = self.get_conversations(user_id, limit + 1, before=before, fields=fields)
+        next_cursor = None
+        if len(conversations) > limit:
+            conversations = conversations[:limit]
+            next_cursor = str(conversations[-1]['_id'])
+        return conversations, next_cursor
     
     def get_conversation(self, conversation_id):
         """Get a specific conversation by ID"""
@@ -52,17 +157,109 @@ class Database:
         """Create a new conversation"""
         return self.conversations.insert_one(conversation_data)
     
+    def create_conversations(self, conversations):
+        """Create several conversations in one round trip"""
+        return self.conversations.insert_many(conversations, ordered=True)
+    
+    def save_conversations(self, conversations):
+        """Insert conversations with preassigned _ids; ones already saved are skipped"""
+        _insert_new(self.conversations, conversations)
+    
     def update_conversation(self, conversation_id, update_data):
         """Update a conversation"""
         return self.conversations.update_one({'_id': conversation_id}, {'$set': update_data})
     
+    def delete_conversation(self, conversation_id, user_id):
+        """
+        Delete a user's conversation and its messages; returns
+        (conversations deleted, messages deleted). The conversation goes first so
+        it disappears from listings at once; messages left behind by a failure
+        are orphans that `flask gc-messages` removes.
+        """
+        result = self.conversations.delete_one({'_id': conversation_id, 'user_id': user_id})
+        if not result.deleted_count:
+            return 0, 0
+        return 1, self.messages.delete_many({'conversation_id': conversation_id}).deleted_count
+    
+    def delete_conversations(self, conversation_ids):
+        """Delete conversations and their messages with one delete_many each"""
+        conversations = self.conversations.delete_many({'_id': {'$in': conversation_ids}}).deleted_count
+        messages = self.messages.delete_many({'conversation_id': {'$in': conversation_ids}}).deleted_count
+        return conversations, messages
+    
     def get_messages(self, conversation_id):
         """Get messages for a conversation"""
-        return list(self.messages.find({'conversation_id': conversation_id}).sort('timestamp', 1))
+        return list(self.messages.find({'conversation_id': conversation_id}).sort([('timestamp', 1), ('_id', 1)]))
+    
+    def _message_range(self, conversation_id, after=None, before=None):
+        conditions = [{'conversation_id': conversation_id}]
+        if after is not None:
+            conditions.append(_keyset_condition('$gt', after))
+        if before is not None:
+            conditions.append(_keyset_condition('$lt', before))
+        return conditions[0] if len(conditions) == 1 else {'$and': conditions}
+    
+    def get_recent_messages(self, conversation_id, limit, after=None, before=None):
+        """
+        Get up to `limit` most recent messages of a conversation in chronological order.
+        `after` and `before` are optional (timestamp, _id) keys bounding the range (exclusive).
+        Only the fields needed for prompt context are fetched.
+        """
+        cursor = self.messages.find(
+            self._message_range(conversation_id, after, before),
+            {'role': 1, 'content': 1, 'timestamp': 1}
+        ).sort([('timestamp', -1), ('_id', -1)]).limit(limit)
+        return list(cursor)[::-1]
+    
+    def get_message_window(self, conversation_id, limit, before=None):
+        """
+        The `limit` messages right before the (timestamp, _id) key `before`, or the
+        latest ones, as (cursor yielding them oldest first, whether older messages exist).
+        The oldest message of the window is found first on the index, so the window
+        itself can be streamed in chronological order instead of fetched and reversed.
+        """
+        boundary = list(
+            self.messages.find(self._message_range(conversation_id, before=before), {'timestamp': 1})
+            .sort([('timestamp', -1), ('_id', -1)]).skip(limit).limit(1)
+        )
+        after = (boundary[0]['timestamp'], boundary[0]['_id']) if boundary else None
+        cursor = self.messages.find(
+            self._message_range(conversation_id, after=after, before=before),
+            {'role': 1, 'content': 1, 'timestamp': 1}
+        ).sort([('timestamp', 1), ('_id', 1)])
+        return cursor, bool(boundary)
+    
+    def get_message_key(self, conversation_id, message_id):
+        """(timestamp, _id) key of a message in a conversation, or None"""
+        message = self.messages.find_one({'_id': message_id, 'conversation_id': conversation_id}, {'timestamp': 1})
+        return (message['timestamp'], message['_id']) if message else None
     
     def add_message(self, message_data):
         """Add a message to a conversation"""
-        return self.messages.insert_one(message_data)
+        return self.messages.insert_one(_stamp_saved([message_data])[0])
+    
+    def add_messages(self, messages):
+        """Add several messages in one round trip, keeping their order"""
+        return self.messages.insert_many(_stamp_saved(messages), ordered=True)
+    
+    def save_messages(self, messages):
+        """Insert messages with preassigned _ids; ones already saved are skipped"""
+        _insert_new(self.messages, _stamp_saved(messages))
+    
+    def messages_saved_since(self, since, projection=None):
+        """
+        Messages written at or after `since` (a UTC datetime), in write order.
+        Messages saved before saved_at was recorded are matched by their _id time.
+        """
+        query = {'$or': [
+            {'saved_at': {'$gte': since}},
+            {'saved_at': None, '_id': {'$gte': ObjectId.from_datetime(since)}}
+        ]}
+        return self.messages.find(query, projection).sort([('saved_at', 1), ('_id', 1)])
+    
+    def touch_conversation(self, conversation_id, updated_at):
+        """Move updated_at forward; never back, so out-of-order writes are harmless"""
+        return self.conversations.update_one({'_id': conversation_id}, {'$max': {'updated_at': updated_at}})
     
     def close(self):
         """Close the database connection"""
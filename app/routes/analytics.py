@@ -1,51 +1,62 @@
-from flask import Blueprint, jsonify, current_app
-from bson import ObjectId
-from app.models.database import Database
+from flask import Blueprint, request, jsonify, current_app
+from app.utils.data_analysis_service import ActivityColumns
 
 analytics_bp = Blueprint('analytics', __name__, url_prefix='/api')
 
 
-@analytics_bp.route('/usage', methods=['GET'])
-def get_usage_analytics():
-    """Get usage analytics for the application"""
-    try:
-        user_id = 'default_user'  # In a real app, this would come from auth
-        
-        db = Database()
-        data_analysis_service = current_app.config['DATA_ANALYSIS_SERVICE']
-        
-        # Get all conversations for the user
-        conversations = db.get_conversations(user_id, limit=1000)  # Get more conversations for analytics
-        
-        # Get all messages for the user (this might need to be optimized for large datasets)
+ANALYTICS_ENGINES = ('counters', 'columnar', 'mongo', 'pandas')
+
+
+def _usage_report(engine, user_id):
+    """Build the usage report with the chosen analytics engine"""
+    data_analysis_service = current_app.config['DATA_ANALYSIS_SERVICE']
+    
+    if engine == 'counters':
+        # Counters are maintained as messages are written, so this reads one small document per day
+        days = current_app.config['USAGE_STATS'].get_days(user_id)
+        return data_analysis_service.analyze_usage_counters(days)
+    
+    if engine == 'columnar':
+        # Projected fields straight into NumPy arrays, analyzed without DataFrames
+        columns = ActivityColumns.load(current_app.config['DATABASE'], user_id)
+        return data_analysis_service.analyze_columns(columns)
+    
+    if engine == 'mongo':
+        # Group-by work runs in MongoDB aggregation pipelines; only the results are transferred
+        mongo_analysis_service = current_app.config['MONGO_ANALYSIS_SERVICE']
+        engagement_data = mongo_analysis_service.analyze_user_engagement(user_id)
+        time_series_data = mongo_analysis_service.generate_time_series_analysis(user_id)
+    else:
+        db = current_app.config['DATABASE']
+        # The whole history (limit 0 is no limit), like the other engines; memory grows with it
+        conversations = db.get_conversations(user_id, limit=0)
         all_messages = []
         for conv in conversations:
-            messages = db.get_messages(conv['_id'])
-            for msg in messages:
-                msg['conversation_title'] = conv.get('title', 'Untitled')
-            all_messages.extend(messages)
-        
-        # Perform analytics using our data analysis service
+            all_messages.extend(db.get_messages(conv['_id']))
         engagement_data = data_analysis_service.analyze_user_engagement(conversations, all_messages)
         time_series_data = data_analysis_service.generate_time_series_analysis(conversations)
+    
+    return {
+        'engagement': engagement_data,
+        'time_series': time_series_data,
+        'total_conversations': engagement_data['conversations']['total_conversations'],
+        'total_messages': engagement_data['messages']['total_messages']
+    }
+
+
+@analytics_bp.route('/usage', methods=['GET'])
+def get_usage_analytics():
+    """Get usage analytics for the application"""
+    try:
+        user_id = request.args.get('user_id', 'default_user')  # In a real app, this would come from auth
+        engine = request.args.get('engine', current_app.config['ANALYTICS_ENGINE'])
+        if engine not in ANALYTICS_ENGINES:
+            return jsonify({'error': f"engine must be one of: {', '.join(ANALYTICS_ENGINES)}"}), 400
         
-        # Close the database connection
-        db.close()
-        
-        return jsonify({
-            'engagement': engagement_data,
-            'time_series': time_series_data,
-            'total_conversations': len(conversations),
-            'total_messages': len(all_messages)
-        })
+        return jsonify(_usage_report(engine, user_id))
         
     except Exception as e:
         print(f"Error in analytics endpoint: {str(e)}")
-        # Make sure to close the database connection in case of exception
-        try:
-            db.close()
-        except:
-            pass  # Ignore error if db wasn't initialized
         return jsonify({'error': 'Internal server error'}), 500
 
 
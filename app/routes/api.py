@@ -1,171 +1,440 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from bson import ObjectId
 import json
 from datetime import datetime
-from app.models.database import Database
+from app.models.database import CONVERSATION_LIST_FIELDS
+from app.utils.llm_errors import AllBackendsFailedError, OverloadedError
+from app.utils.metrics import JSON_SERIALIZE_SECONDS, current_route
 
 bp = Blueprint('api', __name__, url_prefix='/api')
 
+MAX_PAGE_SIZE = 200
+MAX_SIMILAR_QUESTIONS = 20
+
+
+def _conversation_title(user_message):
+    """Create a title for a conversation based on the first few words of the user message"""
+    title = user_message.strip()[:50] + "..." if len(user_message) > 50 else user_message.strip()
+    return title or "New Conversation"
+
+
+def _save_turn(db, user_id, conversation_id, user_message, response_text):
+    """
+    Persist one user/assistant exchange. Creates the conversation when
+    conversation_id is None and returns the conversation id.
+    """
+    return current_app.config['TURN_WRITER'].commit_turn(
+        user_id, conversation_id, user_message, response_text,
+        title=_conversation_title(user_message)
+    )
+
+
+def _object_id(value):
+    """An ObjectId from client input, or None when it is not a valid id"""
+    if isinstance(value, ObjectId):
+        return value
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return None
+
+
+def _overloaded(e):
+    """429 response for a generation the scheduler refused"""
+    return (jsonify({'error': 'Too many requests', 'reason': e.reason, 'retry_after': e.retry_after}), 429,
+            {'Retry-After': str(e.retry_after)})
+
+
+def _prepare_chat(db, data):
+    """
+    Validate a chat request and load its context. `data` is the parsed JSON
+    body, or None when the body was not valid JSON.
+    Returns (chat_request, error_response); exactly one of them is None.
+    """
+    if not isinstance(data, dict):
+        return None, (jsonify({'error': 'Request body must be a JSON object'}), 400)
+    
+    user_message = data.get('message', '')
+    user_id = data.get('user_id', 'default_user')
+    conversation_id = data.get('conversation_id')  # Optional, for continuing a conversation
+    use_cache = data.get('cache', True) is not False  # Clients can opt out of the response cache
+    
+    if not user_message:
+        return None, (jsonify({'error': 'Message is required'}), 400)
+    
+    # The user document is upserted when the turn is saved
+    
+    history = None
+    if conversation_id:
+        # Use existing conversation
+        conversation_id = _object_id(conversation_id)
+        if conversation_id is None:
+            return None, (jsonify({'error': 'Invalid conversation'}), 400)
+        # A conversation started moments ago may still be in the write-behind queue
+        conversation = db.get_conversation(conversation_id) or \
+            current_app.config['TURN_WRITER'].pending_conversation(conversation_id)
+        if not conversation or conversation.get('user_id') != user_id:
+            return None, (jsonify({'error': 'Invalid conversation'}), 400)
+        
+        # Recent, token-budgeted history (plus rolling summary) for context
+        history = current_app.config['CONTEXT_BUILDER'].build(conversation)
+    
+    return {
+        'user_message': user_message,
+        'user_id': user_id,
+        'conversation_id': conversation_id,
+        'history': history,
+        'use_cache': use_cache
+    }, None
+
 
 @bp.route('/chat', methods=['POST'])
 def chat():
     """Handle chat messages and get responses from Gemini"""
     try:
-        data = request.get_json()
-        user_message = data.get('message', '')
-        user_id = data.get('user_id', 'default_user')
-        conversation_id = data.get('conversation_id')  # Optional, for continuing a conversation
-        
-        if not user_message:
-            return jsonify({'error': 'Message is required'}), 400
+        # Shared, pooled database client
+        db = current_app.config['DATABASE']
         
-        # Create a database instance for this request
-        db = Database()
+        chat_request, error = _prepare_chat(db, request.get_json(silent=True))
+        if error:
+            return error
+        user_message = chat_request['user_message']
         
-        # Create or get user
-        user = db.get_user(user_id)
-        if not user:
-            db.create_user({
-                'user_id': user_id,
-                'created_at': datetime.utcnow()
-            })
-        
-        # Determine conversation
-        if conversation_id:
-            # Use existing conversation
-            conversation = db.get_conversation(ObjectId(conversation_id))
-            if not conversation or conversation.get('user_id') != user_id:
-                db.close()  # Close the connection before returning
-                return jsonify({'error': 'Invalid conversation'}), 400
-            
-            # Get conversation history for context
-            messages = db.get_messages(ObjectId(conversation_id))
-            chat_service = current_app.config['GEMINI_SERVICE']  # Keeping config name for compatibility
-            response_text = chat_service.chat_with_history(messages, user_message)
+        chat_service = current_app.config['GEMINI_SERVICE']  # Keeping config name for compatibility
+        if chat_request['conversation_id']:
+            response_text = chat_service.chat_with_history(
+                chat_request['history'], user_message, user_id=chat_request['user_id']
+            )
         else:
-            # Create new conversation
-            chat_service = current_app.config['GEMINI_SERVICE']  # Keeping config name for compatibility
-            response_text = chat_service.get_chat_response(user_message)
-            
-            # Create a title for the conversation based on the first few words of user message
-            title = user_message.strip()[:50] + "..." if len(user_message) > 50 else user_message.strip()
-            if not title:
-                title = "New Conversation"
-                
-            conversation_data = {
-                'user_id': user_id,
-                'title': title,
-                'created_at': datetime.utcnow(),
-                'updated_at': datetime.utcnow()
-            }
-            result = db.create_conversation(conversation_data)
-            conversation_id = result.inserted_id
-        
-        # Save user message
-        user_message_data = {
-            'conversation_id': ObjectId(conversation_id),
-            'role': 'user',
-            'content': user_message,
-            'timestamp': datetime.utcnow()
-        }
-        db.add_message(user_message_data)
-        
-        # Save assistant response
-        assistant_message_data = {
-            'conversation_id': ObjectId(conversation_id),
-            'role': 'assistant',
-            'content': response_text,
-            'timestamp': datetime.utcnow()
-        }
-        db.add_message(assistant_message_data)
-        
-        # Update conversation's updated_at field
-        db.update_conversation(ObjectId(conversation_id), {'updated_at': datetime.utcnow()})
+            response_text = chat_service.get_chat_response(
+                user_message, use_cache=chat_request['use_cache'], user_id=chat_request['user_id']
+            )
         
-        # Close the database connection
-        db.close()
+        conversation_id = _save_turn(
+            db, chat_request['user_id'], chat_request['conversation_id'], user_message, response_text
+        )
         
         return jsonify({
             'response': response_text,
             'conversation_id': str(conversation_id)
         })
         
+    except OverloadedError as e:
+        return _overloaded(e)
+    except AllBackendsFailedError as e:
+        print(f"No LLM backend available: {str(e)}")
+        return jsonify({'error': 'LLM service unavailable'}), 503
     except Exception as e:
         print(f"Error in chat endpoint: {str(e)}")
-        # Make sure to close the database connection in case of exception
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+def _sse(payload):
+    """Encode a payload as one Server-Sent Events message"""
+    with JSON_SERIALIZE_SECONDS.time(current_route.get()):
+        return f"data: {json.dumps(payload)}\n\n"
+
+
+@bp.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Streaming variant of /api/chat. Relays generated text as Server-Sent Events:
+    {"type": "token"} events while generating, then one {"type": "done"} event with
+    the cleaned full response. Messages are persisted only after the stream completes.
+    """
+    try:
+        db = current_app.config['DATABASE']
+        
+        chat_request, error = _prepare_chat(db, request.get_json(silent=True))
+        if error:
+            return error
+        
+        chat_service = current_app.config['GEMINI_SERVICE']  # Keeping config name for compatibility
+    except Exception as e:
+        print(f"Error in chat stream endpoint: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+    
+    def generate():
+        chunks = []
         try:
-            db.close()
-        except:
-            pass  # Ignore error if db wasn't initialized
+            stream = chat_service.stream_chat_response(
+                chat_request['user_message'], chat_request['history'],
+                use_cache=chat_request['use_cache'], user_id=chat_request['user_id']
+            )
+            for chunk in stream:
+                chunks.append(chunk)
+                yield _sse({'type': 'token', 'content': chunk})
+            
+            # Chunks arrive already cleaned, so the joined text is the final response
+            response_text = ''.join(chunks)
+            saved_id = _save_turn(
+                db, chat_request['user_id'], chat_request['conversation_id'],
+                chat_request['user_message'], response_text
+            )
+            yield _sse({
+                'type': 'done',
+                'response': response_text,
+                'conversation_id': str(saved_id)
+            })
+        except OverloadedError as e:
+            yield _sse({'type': 'error', 'error': 'Too many requests', 'retry_after': e.retry_after})
+        except AllBackendsFailedError as e:
+            print(f"No LLM backend available: {str(e)}")
+            yield _sse({'type': 'error', 'error': 'LLM service unavailable'})
+        except Exception as e:
+            print(f"Error while streaming chat response: {str(e)}")
+            yield _sse({'type': 'error', 'error': 'Internal server error'})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def _ndjson(payload):
+    """Encode a payload as one line of newline-delimited JSON"""
+    with JSON_SERIALIZE_SECONDS.time(current_route.get()):
+        return json.dumps(payload) + "\n"
+
+
+def _batch_questions(data):
+    """
+    Validate a batch request's questions: strings, or objects with a message and
+    an optional cache flag. Returns (questions, error_response); exactly one is None.
+    """
+    if not isinstance(data, dict):
+        return None, (jsonify({'error': 'Request body must be a JSON object'}), 400)
+    questions = data.get('questions')
+    if not isinstance(questions, list) or not questions:
+        return None, (jsonify({'error': 'questions must be a non-empty list'}), 400)
+    max_questions = current_app.config['CHAT_BATCH_MAX_QUESTIONS']
+    if len(questions) > max_questions:
+        return None, (jsonify({'error': f'At most {max_questions} questions per batch'}), 400)
+    
+    use_cache = data.get('cache', True) is not False
+    parsed = []
+    for index, question in enumerate(questions):
+        if isinstance(question, str):
+            question = {'message': question}
+        message = question.get('message') if isinstance(question, dict) else None
+        if not message or not isinstance(message, str):
+            return None, (jsonify({'error': f'Question {index} has no message'}), 400)
+        parsed.append({
+            'message': message,
+            'use_cache': use_cache and question.get('cache', True) is not False,
+            'title': _conversation_title(message)
+        })
+    return parsed, None
+
+
+@bp.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """
+    Answer a list of standalone questions, each in a new conversation. Results are
+    streamed as newline-delimited JSON in completion order: one {"type": "result"} or
+    {"type": "error"} line per question (with its index in the request), a
+    {"type": "save_error"} line for any group of answers that could not be saved,
+    and a final {"type": "done"} line with the counts.
+    """
+    try:
+        data = request.get_json(silent=True)
+        questions, error = _batch_questions(data)
+        if error:
+            return error
+        user_id = data.get('user_id', 'default_user')
+        
+        batch_chat = current_app.config['BATCH_CHAT']
+    except Exception as e:
+        print(f"Error in chat batch endpoint: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+    
+    def generate():
+        try:
+            for result in batch_chat.run(user_id, questions):
+                yield _ndjson(result)
+        except Exception as e:
+            print(f"Error while streaming batch results: {str(e)}")
+            yield _ndjson({'type': 'error', 'error': 'Internal server error'})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@bp.route('/chat/stats', methods=['GET'])
+def chat_stats():
+    """Response cache, request coalescing and write-behind queue counters"""
+    chat_service = current_app.config['GEMINI_SERVICE']  # Keeping config name for compatibility
+    stats = chat_service.stats()
+    stats['write_behind'] = current_app.config['TURN_WRITER'].stats()
+    stats['batch'] = current_app.config['BATCH_CHAT'].stats()
+    return jsonify(stats)
+
+
+@bp.route('/backends', methods=['GET'])
+def backend_health():
+    """Circuit breaker state of each LLM backend"""
+    chat_service = current_app.config['GEMINI_SERVICE']  # Keeping config name for compatibility
+    return jsonify({'backends': chat_service.backend_health()})
+
+
+@bp.route('/similar_questions', methods=['GET'])
+def similar_questions():
+    """The user's past questions closest to `q` (up to `k`, default 5), with their answers"""
+    try:
+        user_id = request.args.get('user_id', 'default_user')
+        query = request.args.get('q', '').strip()
+        
+        if not query:
+            return jsonify({'error': 'q is required'}), 400
+        try:
+            k = max(1, min(int(request.args.get('k', 5)), MAX_SIMILAR_QUESTIONS))
+        except ValueError:
+            return jsonify({'error': 'k must be an integer'}), 400
+        
+        question_index = current_app.config.get('QUESTION_INDEX')
+        if not question_index:
+            return jsonify({'error': 'Similar questions are disabled'}), 404
+        if not question_index.ready:
+            return jsonify({'error': 'Question index is not loaded yet'}), 503, {'Retry-After': '5'}
+        
+        turns = question_index.similar_turns(query, k=k, user_id=user_id)
+        
+        # Convert ObjectId and datetime values for JSON serialization
+        for turn in turns:
+            for key in ('question_id', 'answer_id', 'conversation_id'):
+                turn[key] = str(turn[key])
+            if isinstance(turn.get('timestamp'), datetime):
+                turn['timestamp'] = turn['timestamp'].isoformat()
+        
+        return jsonify({'results': turns})
+        
+    except Exception as e:
+        print(f"Error in similar_questions: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
 
+def _conversation_page_args(args):
+    """
+    Parse `limit`, `before` and `fields` for a conversation listing.
+    Returns ((limit, before, fields), error_response).
+    """
+    try:
+        limit = int(args.get('limit', 50))
+    except ValueError:
+        return None, (jsonify({'error': 'limit must be an integer'}), 400)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    
+    before = None
+    if args.get('before'):
+        before = _object_id(args['before'])
+        if before is None:
+            return None, (jsonify({'error': 'Invalid cursor'}), 400)
+    
+    fields = CONVERSATION_LIST_FIELDS
+    if args.get('fields'):
+        fields = tuple(field.strip() for field in args['fields'].split(',') if field.strip())
+        unknown = [field for field in fields if field not in CONVERSATION_LIST_FIELDS]
+        if unknown:
+            return None, (jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400)
+    
+    return (limit, before, fields), None
+
+
 @bp.route('/conversations', methods=['GET'])
 def get_conversations():
-    """Get all conversations for a user"""
+    """Get a page of conversations for a user, newest first"""
     try:
         user_id = request.args.get('user_id', 'default_user')
         
-        db = Database()
-        conversations = db.get_conversations(user_id)
+        page_args, error = _conversation_page_args(request.args)
+        if error:
+            return error
+        limit, before, fields = page_args
+        
+        db = current_app.config['DATABASE']
+        conversations, next_cursor = db.get_conversation_page(user_id, limit, before=before, fields=fields)
         
         # Convert ObjectId to string for JSON serialization
         for conv in conversations:
             conv['_id'] = str(conv['_id'])
         
-        # Close the database connection
-        db.close()
-        
-        return jsonify({'conversations': conversations})
+        return jsonify({'conversations': conversations, 'next_cursor': next_cursor})
         
     except Exception as e:
         print(f"Error in get_conversations: {str(e)}")
-        # Make sure to close the database connection in case of exception
-        try:
-            db.close()
-        except:
-            pass  # Ignore error if db wasn't initialized
         return jsonify({'error': 'Internal server error'}), 500
 
 
 @bp.route('/conversation/<conversation_id>', methods=['GET'])
 def get_conversation(conversation_id):
-    """Get a specific conversation with its messages"""
+    """
+    Get a conversation with a window of its messages: the latest `limit`, or the
+    `limit` before the message id given as `before`. `next_cursor` is the id to pass
+    as `before` to load the previous window, or null when there are no older messages.
+    The response is streamed message by message.
+    """
     try:
         user_id = request.args.get('user_id', 'default_user')
         
-        db = Database()
+        try:
+            limit = max(1, min(int(request.args.get('limit', 50)), MAX_PAGE_SIZE))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        
+        db = current_app.config['DATABASE']
         
         # Verify the conversation belongs to the user
-        conversation = db.get_conversation(ObjectId(conversation_id))
+        conversation_id = _object_id(conversation_id)
+        if conversation_id is None:
+            return jsonify({'error': 'Invalid conversation'}), 400
+        # A conversation started moments ago may still be in the write-behind queue
+        conversation = db.get_conversation(conversation_id) or \
+            current_app.config['TURN_WRITER'].pending_conversation(conversation_id)
         if not conversation or conversation.get('user_id') != user_id:
-            db.close()  # Close the connection before returning
             return jsonify({'error': 'Invalid conversation'}), 400
         
-        messages = db.get_messages(ObjectId(conversation_id))
-        
-        # Convert ObjectIds to strings for JSON serialization
-        conversation['_id'] = str(conversation['_id'])
-        for msg in messages:
-            msg['_id'] = str(msg['_id'])
-            msg['conversation_id'] = str(msg['conversation_id'])
+        before = None
+        if request.args.get('before'):
+            # The cursor must be a message of this conversation
+            before_id = _object_id(request.args['before'])
+            if before_id is not None:
+                before = db.get_message_key(conversation['_id'], before_id)
+            if before is None:
+                return jsonify({'error': 'Invalid cursor'}), 400
         
-        # Close the database connection
-        db.close()
-        
-        return jsonify({
-            'conversation': conversation,
-            'messages': messages
-        })
+        messages, has_more = db.get_message_window(conversation['_id'], limit, before=before)
         
     except Exception as e:
         print(f"Error in get_conversation: {str(e)}")
-        # Make sure to close the database connection in case of exception
-        try:
-            db.close()
-        except:
-            pass  # Ignore error if db wasn't initialized
         return jsonify({'error': 'Internal server error'}), 500
+    
+    # Only the fields the client uses; summaries stay in the database
+    conversation_data = {field: conversation.get(field) for field in ('title', 'created_at', 'updated_at')}
+    conversation_data['_id'] = str(conversation['_id'])
+    conversation_data['user_id'] = conversation.get('user_id')
+    
+    def generate():
+        dumps = current_app.json.dumps
+        yield f'{{"conversation": {dumps(conversation_data)}, "messages": ['
+        oldest_id = None
+        try:
+            for i, msg in enumerate(messages):
+                if oldest_id is None:
+                    oldest_id = str(msg['_id'])
+                msg['_id'] = str(msg['_id'])
+                msg['conversation_id'] = conversation_data['_id']
+                yield (', ' if i else '') + dumps(msg)
+        except Exception as e:
+            # Headers are already sent; the client sees a truncated body
+            print(f"Error while streaming conversation {conversation_id}: {str(e)}")
+            raise
+        next_cursor = oldest_id if has_more else None
+        yield f'], "next_cursor": {dumps(next_cursor)}}}'
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 
 @bp.route('/new_conversation', methods=['POST'])
@@ -176,7 +445,7 @@ def new_conversation():
         user_id = data.get('user_id', 'default_user')
         title = data.get('title', 'New Conversation')
         
-        db = Database()
+        db = current_app.config['DATABASE']
         
         conversation_data = {
             'user_id': user_id,
@@ -185,9 +454,7 @@ def new_conversation():
             'updated_at': datetime.utcnow()
         }
         result = db.create_conversation(conversation_data)
-        
-        # Close the database connection
-        db.close()
+        current_app.config['USAGE_STATS'].record(user_id, conversations=[conversation_data['created_at']])
         
         return jsonify({
             'conversation_id': str(result.inserted_id),
@@ -196,9 +463,4 @@ def new_conversation():
         
     except Exception as e:
         print(f"Error in new_conversation: {str(e)}")
-        # Make sure to close the database connection in case of exception
-        try:
-            db.close()
-        except:
-            pass  # Ignore error if db wasn't initialized
         return jsonify({'error': 'Internal server error'}), 500
\ No newline at end of file
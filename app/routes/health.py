@@ -0,0 +1,19 @@
+from flask import Blueprint, current_app, jsonify
+
+bp = Blueprint('health', __name__)
+
+
+@bp.route('/health')
+def health():
+    """Liveness: the process is serving requests"""
+    return jsonify({'status': 'ok'})
+
+
+@bp.route('/health/ready')
+def ready():
+    """Readiness: 200 once the Ollama model is loaded, 503 until then, so only warm instances get traffic"""
+    warmer = current_app.config.get('MODEL_WARMER')
+    if warmer is None:
+        return jsonify({'ready': True, 'warmup': 'disabled'})
+    status = warmer.status()
+    return jsonify(status), 200 if status['ready'] else 503
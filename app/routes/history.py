@@ -2,10 +2,12 @@ from flask import Blueprint, render_template, request, jsonify, current_app
 from bson import ObjectId
 import json
 from datetime import datetime
-from app.models.database import Database
+from app.routes.api import _conversation_page_args, _object_id
 
 bp = Blueprint('history', __name__, url_prefix='/api')
 
+MAX_SEARCH_PAGE_SIZE = 50
+
 
 @bp.route('/history')
 def history():
@@ -15,34 +17,30 @@ def history():
 
 @bp.route('/history/conversations', methods=['GET'])
 def get_conversations():
-    """API endpoint to get all conversations for a user"""
+    """API endpoint to get a page of conversations for a user, newest first"""
     try:
         user_id = request.args.get('user_id', 'default_user')
-        limit = int(request.args.get('limit', 50))
         
-        db = Database()
-        conversations = db.get_conversations(user_id, limit)
+        page_args, error = _conversation_page_args(request.args)
+        if error:
+            return error
+        limit, before, fields = page_args
+        
+        db = current_app.config['DATABASE']
+        conversations, next_cursor = db.get_conversation_page(user_id, limit, before=before, fields=fields)
         
         # Convert ObjectId to string for JSON serialization
         for conv in conversations:
             conv['_id'] = str(conv['_id'])
-            if isinstance(conv['created_at'], datetime):
+            if isinstance(conv.get('created_at'), datetime):
                 conv['created_at'] = conv['created_at'].isoformat()
-            if isinstance(conv['updated_at'], datetime):
+            if isinstance(conv.get('updated_at'), datetime):
                 conv['updated_at'] = conv['updated_at'].isoformat()
         
-        # Close the database connection
-        db.close()
-        
-        return jsonify({'conversations': conversations})
+        return jsonify({'conversations': conversations, 'next_cursor': next_cursor})
         
     except Exception as e:
         print(f"Error in get_conversations: {str(e)}")
-        # Make sure to close the database connection in case of exception
-        try:
-            db.close()
-        except:
-            pass  # Ignore error if db wasn't initialized
         return jsonify({'error': 'Internal server error'}), 500
 
 
@@ -51,63 +49,149 @@ def delete_conversation(conversation_id):
     """API endpoint to delete a conversation"""
     try:
         user_id = request.args.get('user_id', 'default_user')
+        conversation_id = _object_id(conversation_id)
+        if conversation_id is None:
+            return jsonify({'error': 'Invalid conversation'}), 400
         
-        db = Database()
+        db = current_app.config['DATABASE']
         
-        # Verify the conversation belongs to the user
-        conversation = db.get_conversation(ObjectId(conversation_id))
+        # Read what the usage counters hold for the conversation before it is gone
+        conversation = db.get_conversation(conversation_id)
         if not conversation or conversation.get('user_id') != user_id:
-            db.close()  # Close the connection before returning
             return jsonify({'error': 'Invalid conversation'}), 400
+        messages = db.get_messages(conversation_id)
         
-        # In a real app, you might want to delete associated messages too
-        # For now, we'll just delete the conversation
-        result = db.db.conversations.delete_one({'_id': ObjectId(conversation_id), 'user_id': user_id})
+        # Only the owner's conversation is deleted, together with its messages
+        deleted_conversations, deleted_messages = db.delete_conversation(conversation_id, user_id)
         
-        if result.deleted_count == 0:
-            db.close()  # Close the connection before returning
-            return jsonify({'error': 'Conversation not found'}), 404
+        if deleted_conversations == 0:
+            return jsonify({'error': 'Invalid conversation'}), 400
+        
+        current_app.config['USAGE_STATS'].forget(user_id, [conversation.get('created_at')], messages)
         
-        # Close the database connection
-        db.close()
+        search_index = current_app.config.get('SEARCH_INDEX')
+        if search_index:
+            search_index.remove_conversation(conversation_id)
         
-        return jsonify({'message': 'Conversation deleted successfully'})
+        return jsonify({
+            'message': 'Conversation deleted successfully',
+            'deleted_messages': deleted_messages
+        })
         
     except Exception as e:
         print(f"Error in delete_conversation: {str(e)}")
-        # Make sure to close the database connection in case of exception
-        try:
-            db.close()
-        except:
-            pass  # Ignore error if db wasn't initialized
         return jsonify({'error': 'Internal server error'}), 500
 
 
+def _job_json(job):
+    """Progress of a deletion job as JSON-serializable fields"""
+    return {
+        'job_id': str(job['_id']),
+        'status': job['status'],
+        'total_conversations': job['total_conversations'],
+        'deleted_conversations': job['deleted_conversations'],
+        'deleted_messages': job['deleted_messages'],
+        'error': job.get('error'),
+        'created_at': job['created_at'].isoformat(),
+        'updated_at': job['updated_at'].isoformat()
+    }
+
+
 @bp.route('/history/conversations', methods=['DELETE'])
 def delete_all_conversations():
-    """API endpoint to delete all conversations for a user"""
+    """
+    API endpoint to delete all conversations of a user and their messages.
+    Users with more conversations than one deletion chunk are deleted by a
+    background job: the response is 202 with the job, whose progress is at
+    /api/history/jobs/<job_id>.
+    """
     try:
         user_id = request.args.get('user_id', 'default_user')
         
-        db = Database()
+        db = current_app.config['DATABASE']
+        jobs = current_app.config['DELETION_JOBS']
         
-        # Delete all conversations for the user
-        result = db.db.conversations.delete_many({'user_id': user_id})
+        # Small histories are deleted in this request, large ones in chunks in the background
+        count = db.conversations.count_documents({'user_id': user_id}, limit=jobs.chunk_size + 1)
+        job = jobs.start(user_id, background=count > jobs.chunk_size)
         
-        # In a real app, you might also want to delete associated messages
+        # Searches stop returning the history at once, even while a job is still deleting it
+        search_index = current_app.config.get('SEARCH_INDEX')
+        if search_index:
+            search_index.remove_user(user_id)
         
-        # Close the database connection
-        db.close()
+        if job['status'] == 'running':
+            return jsonify({
+                'message': 'Deleting conversations in the background',
+                'job': _job_json(job)
+            }), 202, {'Location': f"/api/history/jobs/{job['_id']}?user_id={user_id}"}
+        if job['status'] == 'failed':
+            return jsonify({'error': 'Internal server error', 'job': _job_json(job)}), 500
         
         return jsonify({
-            'message': f'{result.deleted_count} conversations deleted successfully'
+            'message': f"{job['deleted_conversations']} conversations deleted successfully",
+            'job': _job_json(job)
         })
         
     except Exception as e:
         print(f"Error in delete_all_conversations: {str(e)}")
-        # Make sure to close the database connection in case of exception
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@bp.route('/history/jobs/<job_id>', methods=['GET'])
+def get_deletion_job(job_id):
+    """Progress of a delete-all job"""
+    try:
+        user_id = request.args.get('user_id', 'default_user')
+        
+        if not ObjectId.is_valid(job_id):
+            return jsonify({'error': 'Job not found'}), 404
+        job = current_app.config['DELETION_JOBS'].get(ObjectId(job_id), user_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        return jsonify(_job_json(job))
+        
+    except Exception as e:
+        print(f"Error in get_deletion_job: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@bp.route('/history/search', methods=['GET'])
+def search_history():
+    """
+    Search the user's messages, best BM25 match first.
+    Paginated with `limit` (default 20, at most 50) and `offset` (`next_offset` of the previous page).
+    """
+    try:
+        user_id = request.args.get('user_id', 'default_user')
+        query = request.args.get('q', '').strip()
+        
+        if not query:
+            return jsonify({'error': 'q is required'}), 400
         try:
-            db.close()
-        except:
-            pass  # Ignore error if db wasn't initialized
-        return jsonify({'error': 'Internal server error'}), 500
\ No newline at end of file
+            limit = max(1, min(int(request.args.get('limit', 20)), MAX_SEARCH_PAGE_SIZE))
+            offset = max(0, int(request.args.get('offset', 0)))
+        except ValueError:
+            return jsonify({'error': 'limit and offset must be integers'}), 400
+        
+        search_index = current_app.config.get('SEARCH_INDEX')
+        if not search_index:
+            return jsonify({'error': 'Search is disabled'}), 404
+        if not search_index.ready:
+            return jsonify({'error': 'Search index is still building'}), 503, {'Retry-After': '10'}
+        
+        page = search_index.search(user_id, query, limit=limit, offset=offset)
+        
+        # Convert ObjectId and datetime values for JSON serialization
+        for result in page['results']:
+            result['message_id'] = str(result['message_id'])
+            result['conversation_id'] = str(result['conversation_id'])
+            if isinstance(result.get('timestamp'), datetime):
+                result['timestamp'] = result['timestamp'].isoformat()
+        
+        return jsonify(page)
+        
+    except Exception as e:
+        print(f"Error in search_history: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
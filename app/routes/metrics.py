@@ -0,0 +1,41 @@
+import time
+
+from flask import Blueprint, Response, g, request
+from flask.json.provider import DefaultJSONProvider
+
+from app.utils.metrics import HTTP_REQUEST_SECONDS, JSON_SERIALIZE_SECONDS, REGISTRY, current_route
+
+bp = Blueprint('metrics', __name__)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, timing every serialization for /metrics"""
+
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        text = super().dumps(obj, **kwargs)
+        JSON_SERIALIZE_SECONDS.observe(time.perf_counter() - started, current_route.get())
+        return text
+
+
+@bp.before_app_request
+def _start_timer():
+    # Label by the route template so ids in URLs do not create new series
+    current_route.set(request.url_rule.rule if request.url_rule else 'unmatched')
+    g.metrics_started = time.perf_counter()
+
+
+@bp.after_app_request
+def _observe_request(response):
+    # Streamed responses are timed until their headers are ready
+    if 'metrics_started' in g:
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - g.metrics_started, current_route.get(), request.method, str(response.status_code)
+        )
+    return response
+
+
+@bp.route('/metrics')
+def metrics():
+    """Histograms and counters of this process in the Prometheus text format"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,337 @@
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager, nullcontext
+from typing import AsyncIterator, Optional
+
+import aiohttp
+
+from .format_utils import StreamSanitizer, clean_response_format
+from .llm_errors import (BackendError, BackendResponseError, BackendTimeoutError, BackendUnavailableError,
+                         OverloadedError)
+from .metrics import observe_ollama_eval
+from .ollama_hosts import OllamaHostPool, host_at_fault
+from .prompts import render_text
+from .single_flight import AsyncSingleFlight
+
+
+async def _sanitized(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Async counterpart of StreamSanitizer.wrap"""
+    sanitizer = StreamSanitizer()
+    async for chunk in chunks:
+        text = sanitizer.feed(chunk)
+        if text:
+            yield text
+    text = sanitizer.close()
+    if text:
+        yield text
+
+
+class AsyncOllamaBackend:
+    """
+    asyncio client for the Ollama API.
+
+    One aiohttp session (and its keep-alive connection pool) is shared by all
+    requests, and a semaphore bounds how many generations are sent upstream at
+    once. Hosts are taken from the same OllamaHostPool as the synchronous
+    service, and a host that fails is retried on another one. Failures are
+    raised as BackendError subclasses so the router can fall back.
+    """
+
+    def __init__(self, hosts: OllamaHostPool, model_name: str, semaphore: asyncio.Semaphore,
+                 connect_timeout: float = 3, read_timeout: float = 60, keep_alive: str = '30m'):
+        self.hosts = hosts
+        self.model_name = model_name
+        self.keep_alive = keep_alive
+        self.semaphore = semaphore
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._session = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Create the shared session lazily, inside the running event loop"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=0, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout,
+                                              sock_read=self.read_timeout)
+            )
+        return self._session
+
+    @asynccontextmanager
+    async def _post(self, url: str, payload: dict):
+        """POST to a host's /api/chat, translating aiohttp failures into structured backend errors"""
+        session = await self._get_session()
+        try:
+            async with session.post(f"{url}/api/chat", json=payload) as response:
+                if response.status != 200:
+                    text = await response.text()
+                    raise BackendResponseError('ollama', f"{response.status} - {text}", status_code=response.status)
+                yield response
+        except aiohttp.ServerTimeoutError as e:
+            if isinstance(e, aiohttp.ConnectionTimeoutError):
+                raise BackendUnavailableError('ollama', f"connect timeout: {str(e)}") from e
+            raise BackendTimeoutError('ollama', f"read timeout: {str(e)}") from e
+        except asyncio.TimeoutError as e:
+            raise BackendTimeoutError('ollama', "read timeout") from e
+        except aiohttp.ClientConnectionError as e:
+            raise BackendUnavailableError('ollama', f"connection failed: {str(e)}") from e
+        except (aiohttp.ClientError, ValueError) as e:
+            raise BackendResponseError('ollama', str(e)) from e
+
+    def _payload(self, messages: list, stream: bool) -> dict:
+        return {"model": self.model_name, "messages": messages, "stream": stream, "keep_alive": self.keep_alive}
+
+    def _failed(self, host, error: BackendError, failed: list, started: bool = False):
+        """Record a failed attempt; re-raises unless the request can be retried on another host"""
+        if not host_at_fault(error):
+            raise error
+        self.hosts.mark_failed(host, error)
+        failed.append(host)
+        if started or len(failed) >= len(self.hosts):
+            raise error
+        print(f"Ollama host {host.url} failed, retrying on another host: {str(error)}")
+
+    async def generate(self, messages: list) -> str:
+        """Send chat messages and wait for the complete response"""
+        payload = self._payload(messages, stream=False)
+        failed = []
+        async with self.semaphore:
+            while True:
+                try:
+                    with self.hosts.lease(exclude=failed) as host:
+                        async with self._post(host.url, payload) as response:
+                            result = await response.json(content_type=None)
+                    break
+                except BackendError as e:
+                    self._failed(host, e, failed)
+        observe_ollama_eval(result)
+        return (result.get('message') or {}).get('content') or 'No response generated.'
+
+    async def stream(self, messages: list) -> AsyncIterator[str]:
+        """Yield raw text chunks from Ollama's NDJSON stream, trying another host until text arrives"""
+        payload = self._payload(messages, stream=True)
+        failed = []
+        async with self.semaphore:
+            while True:
+                started = False
+                try:
+                    with self.hosts.lease(exclude=failed) as host:
+                        async for text in self._stream_from(host.url, payload):
+                            started = True
+                            yield text
+                    return
+                except BackendError as e:
+                    self._failed(host, e, failed, started)
+
+    async def _stream_from(self, url: str, payload: dict) -> AsyncIterator[str]:
+        """Yield raw text chunks from one host"""
+        async with self._post(url, payload) as response:
+            async for line in response.content:
+                line = line.strip()
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get('error'):
+                    raise BackendResponseError('ollama', chunk['error'])
+                text = (chunk.get('message') or {}).get('content')
+                if text:
+                    yield text
+                if chunk.get('done'):
+                    observe_ollama_eval(chunk)
+                    break
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class AsyncGeminiBackend:
+    """asyncio wrapper around an already configured Gemini model"""
+
+    def __init__(self, model, semaphore: asyncio.Semaphore):
+        self.model = model
+        self.semaphore = semaphore
+
+    async def generate(self, prompt: str) -> str:
+        async with self.semaphore:
+            try:
+                response = await self.model.generate_content_async(prompt)
+                return response.text
+            except Exception as e:
+                raise BackendError('gemini', str(e)) from e
+
+
+class AsyncChatService:
+    """
+    asyncio counterpart of ChatService: Ollama as primary, Gemini as fallback.
+
+    Reuses the prompt building and Gemini configuration of an existing
+    ChatService so both paths answer the same way.
+    """
+
+    def __init__(self, chat_service, max_concurrency: Optional[int] = None):
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv('LLM_MAX_CONCURRENCY', '64'))
+        self.chat_service = chat_service
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        ollama_service = chat_service.ollama_service
+        self.ollama = AsyncOllamaBackend(
+            ollama_service.hosts, ollama_service.model_name, self._semaphore,
+            connect_timeout=ollama_service.connect_timeout, read_timeout=ollama_service.read_timeout,
+            keep_alive=ollama_service.keep_alive
+        )
+        # Share circuit breaker state with the synchronous service
+        self.router = chat_service.router
+        self.gemini = None
+        if chat_service.use_gemini and chat_service.model:
+            self.gemini = AsyncGeminiBackend(chat_service.model, self._semaphore)
+        self.single_flight = AsyncSingleFlight()
+
+    async def _build_messages(self, user_input: str, conversation_history: Optional[list],
+                              user_id: Optional[str]) -> list:
+        if self.chat_service.context_hook:
+            # The context hook reads MongoDB, so keep it off the event loop
+            return await asyncio.to_thread(self.chat_service.build_messages, user_input, conversation_history, user_id)
+        return self.chat_service.build_messages(user_input, conversation_history, user_id)
+
+    def _cache_key(self, user_input: str, conversation_history: Optional[list], use_cache: bool,
+                   user_id: Optional[str]) -> Optional[str]:
+        if not use_cache or conversation_history:
+            return None
+        return self.chat_service.cache_key(user_input, user_id)
+
+    async def _cache_get(self, cache_key: Optional[str]) -> Optional[str]:
+        if not cache_key:
+            return None
+        # The persistent tier does blocking MongoDB I/O, so keep it off the event loop
+        return await asyncio.to_thread(self.chat_service.response_cache.get, cache_key)
+
+    async def _cache_set(self, cache_key: Optional[str], response: str):
+        if cache_key and response:
+            await asyncio.to_thread(self.chat_service.response_cache.set, cache_key, response)
+
+    def _slot(self, user_id: Optional[str]):
+        """Admission and a slot from the ChatService's scheduler, shared with the worker threads"""
+        scheduler = self.chat_service.scheduler
+        if not scheduler:
+            return nullcontext()
+        scheduler.admit(user_id or 'default_user')
+        return scheduler.aslot(user_id or 'default_user')
+
+    async def get_chat_response(self, user_input: str, conversation_history: Optional[list] = None,
+                                use_cache: bool = True, user_id: Optional[str] = None) -> str:
+        """
+        Get a cleaned response, using the shared response cache for standalone questions.
+        Concurrent identical standalone questions share one generation.
+        """
+        cache_key = self._cache_key(user_input, conversation_history, use_cache, user_id)
+        cached = await self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+        refused = []
+
+        async def generate():
+            try:
+                async with self._slot(user_id):
+                    response = await self._generate_uncached(user_input, conversation_history, user_id)
+            except OverloadedError:
+                refused.append(user_id)
+                raise
+            await self._cache_set(cache_key, response)
+            return response
+
+        if conversation_history:
+            return await generate()
+        key = self.chat_service.flight_key(user_input, user_id)
+        try:
+            return await self.single_flight.do(key, generate)
+        except OverloadedError:
+            if refused:
+                raise
+            # The shared generation was refused a slot for its leader's user, not ours: try once on our own
+            return await self.single_flight.do(key, generate)
+
+    async def _generate_uncached(self, user_input: str, conversation_history: Optional[list],
+                                 user_id: Optional[str] = None) -> str:
+        """
+        Get a cleaned response, falling back to Gemini if Ollama fails or its circuit is open.
+        Raises AllBackendsFailedError when no backend can answer.
+        """
+        messages = await self._build_messages(user_input, conversation_history, user_id)
+
+        async def from_ollama():
+            return clean_response_format(await self.ollama.generate(messages))
+
+        async def from_gemini():
+            return clean_response_format(await self.gemini.generate(render_text(messages)))
+
+        attempts = [('ollama', from_ollama)]
+        if self.gemini:
+            attempts.append(('gemini', from_gemini))
+        return await self.router.call_async(attempts)
+
+    async def stream_chat_response(self, user_input: str, conversation_history: Optional[list] = None,
+                                   use_cache: bool = True, user_id: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Yield cleaned text chunks, answering standalone questions from the response cache when possible.
+        Concurrent identical standalone questions attach to the same upstream stream.
+        """
+        cache_key = self._cache_key(user_input, conversation_history, use_cache, user_id)
+        cached = await self._cache_get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+        refused = []
+
+        async def generate():
+            chunks = []
+            try:
+                async with self._slot(user_id):
+                    async for chunk in self._stream_uncached(user_input, conversation_history, user_id):
+                        chunks.append(chunk)
+                        yield chunk
+            except OverloadedError:
+                refused.append(user_id)
+                raise
+            await self._cache_set(cache_key, ''.join(chunks))
+
+        if conversation_history:
+            async for chunk in generate():
+                yield chunk
+            return
+        key = self.chat_service.flight_key(user_input, user_id)
+        try:
+            async for chunk in self.single_flight.stream(key, generate):
+                yield chunk
+        except OverloadedError:
+            if refused:
+                raise
+            # Refused before any text, for the leader's user: try once on our own
+            async for chunk in self.single_flight.stream(key, generate):
+                yield chunk
+
+    async def _stream_uncached(self, user_input: str, conversation_history: Optional[list],
+                               user_id: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Yield cleaned text chunks. Falls back to a single Gemini response if Ollama
+        fails before producing any output or its circuit is open.
+        """
+        messages = await self._build_messages(user_input, conversation_history, user_id)
+
+        async def from_gemini():
+            yield clean_response_format(await self.gemini.generate(render_text(messages)))
+
+        attempts = [('ollama', lambda: _sanitized(self.ollama.stream(messages)))]
+        if self.gemini:
+            attempts.append(('gemini', from_gemini))
+        async for chunk in self.router.stream_async(attempts):
+            yield chunk
+
+    async def close(self):
+        await self.ollama.close()
@@ -0,0 +1,243 @@
+import threading
+import time
+from typing import Callable, Iterator, List, Tuple
+
+from .llm_errors import AllBackendsFailedError, BackendError, CircuitOpenError
+from .metrics import LLM_FAILURES, LLM_REQUEST_SECONDS, LLM_TIME_TO_FIRST_TOKEN_SECONDS, current_route
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Per-backend circuit breaker.
+
+    closed: requests flow; consecutive failures are counted.
+    open: after failure_threshold consecutive failures requests are rejected
+          immediately for reset_timeout seconds.
+    half_open: one probe request is let through; success closes the circuit,
+               failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._successes = 0
+        self._failures = 0
+        self._rejected = 0
+        self._last_error = None
+        self._last_failure_at = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        """Caller must hold the lock"""
+        if self._state == OPEN and time.time() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._successes += 1
+            self._consecutive_failures = 0
+            self._state = CLOSED
+            self._probe_in_flight = False
+
+    def record_failure(self, error: Exception = None):
+        with self._lock:
+            self._failures += 1
+            self._consecutive_failures += 1
+            self._last_error = str(error) if error else None
+            self._last_failure_at = time.time()
+            if self._state == HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = time.time()
+            self._probe_in_flight = False
+
+    def release(self):
+        """Give up a half-open probe slot without an outcome (e.g. client disconnected)"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            state = self._current_state()
+            return {
+                'state': state,
+                'healthy': state == CLOSED,
+                'consecutive_failures': self._consecutive_failures,
+                'successes': self._successes,
+                'failures': self._failures,
+                'rejected': self._rejected,
+                'last_error': self._last_error,
+                'last_failure_at': self._last_failure_at,
+                'retry_at': self._opened_at + self.reset_timeout if state == OPEN else None
+            }
+
+
+class BackendRouter:
+    """
+    Tries backends in priority order, skipping those whose circuit is open.
+
+    Attempts are (backend_name, callable) pairs. A BackendError marks the
+    backend as failed and moves on to the next one; any other exception is a
+    bug and propagates unchanged. Every attempt is timed for /metrics, with
+    time to first chunk for streams.
+    """
+
+    def __init__(self, backend_names: List[str], failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.breakers = {
+            name: CircuitBreaker(name, failure_threshold, reset_timeout) for name in backend_names
+        }
+
+    def call(self, attempts: List[Tuple[str, Callable]]):
+        errors = []
+        for name, func in attempts:
+            breaker = self.breakers[name]
+            if not breaker.allow_request():
+                errors.append(CircuitOpenError(name))
+                continue
+            started_at = time.perf_counter()
+            try:
+                result = func()
+            except BackendError as e:
+                self._observe(name, 'generate', started_at)
+                self._record_failure(breaker, e)
+                errors.append(e)
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            self._observe(name, 'generate', started_at)
+            breaker.record_success()
+            return result
+        raise AllBackendsFailedError(errors)
+
+    async def call_async(self, attempts: List[Tuple[str, Callable]]):
+        """Like call(), but each callable returns an awaitable"""
+        errors = []
+        for name, func in attempts:
+            breaker = self.breakers[name]
+            if not breaker.allow_request():
+                errors.append(CircuitOpenError(name))
+                continue
+            started_at = time.perf_counter()
+            try:
+                result = await func()
+            except BackendError as e:
+                self._observe(name, 'generate', started_at)
+                self._record_failure(breaker, e)
+                errors.append(e)
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            self._observe(name, 'generate', started_at)
+            breaker.record_success()
+            return result
+        raise AllBackendsFailedError(errors)
+
+    def stream(self, attempts: List[Tuple[str, Callable[[], Iterator[str]]]]) -> Iterator[str]:
+        """
+        Stream from the first backend that produces output. A backend that fails
+        before its first chunk is skipped; a failure after output has been sent
+        is recorded and re-raised because the partial answer cannot be retracted.
+        """
+        errors = []
+        for name, factory in attempts:
+            breaker = self.breakers[name]
+            if not breaker.allow_request():
+                errors.append(CircuitOpenError(name))
+                continue
+            started = False
+            started_at = time.perf_counter()
+            try:
+                for chunk in factory():
+                    if not started:
+                        first_chunk = time.perf_counter() - started_at
+                        LLM_TIME_TO_FIRST_TOKEN_SECONDS.observe(first_chunk, name, current_route.get())
+                    started = True
+                    yield chunk
+            except BackendError as e:
+                self._observe(name, 'stream', started_at)
+                self._record_failure(breaker, e)
+                if started:
+                    raise
+                errors.append(e)
+                continue
+            except BaseException:
+                # Includes the consumer closing the stream early
+                breaker.release()
+                raise
+            self._observe(name, 'stream', started_at)
+            breaker.record_success()
+            return
+        raise AllBackendsFailedError(errors)
+
+    async def stream_async(self, attempts):
+        """Async generator version of stream(); factories return async iterators"""
+        errors = []
+        for name, factory in attempts:
+            breaker = self.breakers[name]
+            if not breaker.allow_request():
+                errors.append(CircuitOpenError(name))
+                continue
+            started = False
+            started_at = time.perf_counter()
+            try:
+                async for chunk in factory():
+                    if not started:
+                        first_chunk = time.perf_counter() - started_at
+                        LLM_TIME_TO_FIRST_TOKEN_SECONDS.observe(first_chunk, name, current_route.get())
+                    started = True
+                    yield chunk
+            except BackendError as e:
+                self._observe(name, 'stream', started_at)
+                self._record_failure(breaker, e)
+                if started:
+                    raise
+                errors.append(e)
+                continue
+            except BaseException:
+                # Includes the consumer closing the stream early
+                breaker.release()
+                raise
+            self._observe(name, 'stream', started_at)
+            breaker.record_success()
+            return
+        raise AllBackendsFailedError(errors)
+
+    @staticmethod
+    def _observe(name: str, mode: str, started_at: float):
+        LLM_REQUEST_SECONDS.observe(time.perf_counter() - started_at, name, mode, current_route.get())
+
+    def _record_failure(self, breaker: CircuitBreaker, error: BackendError):
+        LLM_FAILURES.inc(breaker.name, current_route.get())
+        breaker.record_failure(error)
+        print(f"LLM backend {breaker.name} failed: {error.message}")
+
+    def snapshot(self) -> dict:
+        return {name: breaker.snapshot() for name, breaker in self.breakers.items()}
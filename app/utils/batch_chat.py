@@ -0,0 +1,128 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List
+
+from bson import ObjectId
+
+from .llm_errors import AllBackendsFailedError, OverloadedError
+
+
+class BatchChat:
+    """
+    Answers lists of standalone questions on one shared, bounded thread pool.
+
+    Every batch submits its questions to the same `max_workers` threads, so
+    the number of generations running at once is bounded no matter how many
+    batches arrive; a 100-question batch takes about 100 / max_workers
+    generation times instead of 100. Results are yielded as the questions
+    finish, in completion order, and the answered turns are saved through
+    TurnWriter.commit_turns in groups of `save_batch_size` (one insert for
+    the conversations and one for the messages per group). Conversation ids
+    are assigned up front, so a result can name its conversation before the
+    group is written.
+
+    A question that fails yields an error result; the rest of the batch
+    carries on. Questions that have not started are cancelled when the
+    consumer stops iterating (e.g. the client disconnected).
+    """
+
+    def __init__(self, chat_service, turn_writer, max_workers: int = 8, save_batch_size: int = 50):
+        self.chat_service = chat_service
+        self.turn_writer = turn_writer
+        self.max_workers = max_workers
+        self.save_batch_size = save_batch_size
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chat-batch')
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._questions = 0
+        self._failed = 0
+
+    def _answer(self, user_id: str, question: Dict) -> str:
+        return self.chat_service.get_chat_response(question['message'], use_cache=question['use_cache'],
+                                                   user_id=user_id)
+
+    def run(self, user_id: str, questions: List[Dict]) -> Iterator[Dict]:
+        """
+        Answer `questions` (dicts with message and use_cache) and yield one
+        result per question as it completes, then a summary. Results carry
+        the question's index in the request.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            self._batches += 1
+            self._questions += len(questions)
+        # Copy the context per question, so metrics recorded by the workers keep the request's route label
+        futures = {
+            self.executor.submit(contextvars.copy_context().run, self._answer, user_id, question): index
+            for index, question in enumerate(questions)
+        }
+        pending_turns = []
+        counts = {'succeeded': 0, 'failed': 0, 'unsaved': 0}
+        try:
+            remaining = set(futures)
+            while remaining:
+                done, remaining = wait(remaining, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=futures.get):
+                    index = futures[future]
+                    result = self._result(index, future)
+                    if result['type'] == 'result':
+                        counts['succeeded'] += 1
+                        pending_turns.append((index, {
+                            'conversation_id': ObjectId(),
+                            'user_message': questions[index]['message'],
+                            'response_text': result['response'],
+                            'title': questions[index]['title']
+                        }))
+                        result['conversation_id'] = str(pending_turns[-1][1]['conversation_id'])
+                    else:
+                        counts['failed'] += 1
+                    yield result
+                if len(pending_turns) >= self.save_batch_size or not remaining:
+                    saved, pending_turns = pending_turns, []
+                    for failure in self._save(user_id, saved):
+                        counts['unsaved'] += len(failure['indexes'])
+                        yield failure
+        finally:
+            for future in futures:
+                future.cancel()
+            if pending_turns:
+                # Stopped early: keep the answers that were already generated
+                list(self._save(user_id, pending_turns))
+            with self._lock:
+                self._failed += counts['failed']
+
+        yield {'type': 'done', 'total': len(questions), **counts,
+               'seconds': round(time.perf_counter() - started, 3)}
+
+    def _result(self, index: int, future) -> Dict:
+        try:
+            return {'type': 'result', 'index': index, 'response': future.result()}
+        except OverloadedError as e:
+            return {'type': 'error', 'index': index, 'error': 'Too many requests', 'retry_after': e.retry_after}
+        except AllBackendsFailedError as e:
+            print(f"No LLM backend available for batch question {index}: {str(e)}")
+            return {'type': 'error', 'index': index, 'error': 'LLM service unavailable'}
+        except Exception as e:
+            print(f"Error answering batch question {index}: {str(e)}")
+            return {'type': 'error', 'index': index, 'error': 'Internal server error'}
+
+    def _save(self, user_id: str, turns: List) -> Iterator[Dict]:
+        try:
+            self.turn_writer.commit_turns(user_id, [turn for _, turn in turns])
+        except Exception as e:
+            print(f"Error saving batch turns: {str(e)}")
+            yield {'type': 'save_error', 'indexes': [index for index, _ in turns], 'error': 'Internal server error'}
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'batches': self._batches,
+                'questions': self._questions,
+                'failed': self._failed
+            }
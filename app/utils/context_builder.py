@@ -0,0 +1,102 @@
+import re
+from typing import Dict, List
+
+_WHITESPACE = re.compile(r'\s+')
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s')
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (about four characters per token for English text)"""
+    return (len(text or '') + 3) // 4
+
+
+class ContextBuilder:
+    """
+    Builds the conversation context for a chat turn at constant cost.
+
+    Only the last `max_messages` messages are read from MongoDB (projected,
+    limited, served by the (conversation_id, timestamp) index) and trimmed to
+    `token_budget`. Messages that slide out of that window are folded into a
+    short extractive summary stored on the conversation document, so older
+    turns still inform the answer without being re-read.
+    """
+
+    def __init__(self, db, max_messages: int = 6, token_budget: int = 2000, summary_token_budget: int = 300):
+        self.db = db
+        self.max_messages = max_messages
+        self.token_budget = token_budget
+        self.summary_token_budget = summary_token_budget
+
+    def build(self, conversation: Dict) -> List[Dict]:
+        """Return prompt context messages, oldest first, within the token budget"""
+        conversation_id = conversation['_id']
+        messages = self.db.get_recent_messages(conversation_id, self.max_messages)
+        summary = conversation.get('summary') or ''
+
+        # A full window means older messages may exist; fold any not yet summarized
+        if messages and len(messages) >= self.max_messages:
+            summary = self._update_summary(conversation, summary, messages[0])
+
+        return self._fit_to_budget(summary, messages)
+
+    def _update_summary(self, conversation: Dict, summary: str, window_start: Dict) -> str:
+        summarized_until = None
+        if conversation.get('summary_until'):
+            summarized_until = (conversation['summary_until'], conversation['summary_until_id'])
+        older = self.db.get_recent_messages(
+            conversation['_id'], self.max_messages,
+            after=summarized_until, before=(window_start['timestamp'], window_start['_id'])
+        )
+        if not older:
+            return summary
+
+        lines = summary.split('\n') if summary else []
+        lines.extend(self._summarize_message(msg) for msg in older)
+        while len(lines) > 1 and estimate_tokens('\n'.join(lines)) > self.summary_token_budget:
+            lines.pop(0)  # drop the oldest points first
+        summary = '\n'.join(lines)
+
+        self.db.update_conversation(conversation['_id'], {
+            'summary': summary,
+            'summary_until': older[-1]['timestamp'],
+            'summary_until_id': older[-1]['_id']
+        })
+        return summary
+
+    @staticmethod
+    def _summarize_message(message: Dict) -> str:
+        """First sentence of a message, capped in length"""
+        text = _WHITESPACE.sub(' ', message.get('content') or '').strip()
+        first_sentence = _SENTENCE_END.split(text, 1)[0]
+        if len(first_sentence) > 160:
+            first_sentence = first_sentence[:157] + '...'
+        prefix = 'User asked' if message.get('role') == 'user' else 'Assistant explained'
+        return f"{prefix}: {first_sentence}"
+
+    def _fit_to_budget(self, summary: str, messages: List[Dict]) -> List[Dict]:
+        budget = self.token_budget
+        context = []
+
+        summary_message = None
+        if summary:
+            summary_message = {'role': 'system', 'content': f"Earlier in this conversation:\n{summary}"}
+            budget -= estimate_tokens(summary_message['content'])
+
+        # Newest messages are the most relevant, so fill the budget from the end
+        for msg in reversed(messages):
+            cost = estimate_tokens(msg.get('content'))
+            if cost <= budget:
+                context.append(msg)
+                budget -= cost
+                continue
+            if budget >= 50:
+                # Keep the start of a long message rather than dropping it entirely
+                truncated = dict(msg)
+                truncated['content'] = msg.get('content', '')[:budget * 4 - 3] + '...'
+                context.append(truncated)
+            break
+
+        context.reverse()
+        if summary_message and budget >= 0:
+            context.insert(0, summary_message)
+        return context
@@ -4,6 +4,61 @@ from datetime import datetime
 from typing import List, Dict, Any
 import json
 
+# Role codes used by the columnar path; anything else is "other"
+ROLE_CODES = {'user': 0, 'assistant': 1}
+_OTHER_ROLE = 2
+
+_MESSAGE_ROW = np.dtype([('role', np.int8), ('length', np.int32)])
+
+
+class ActivityColumns:
+    """
+    Columnar view of a user's activity for the vectorized analytics path.
+
+    Holds conversation creation times as int64 milliseconds since the epoch,
+    and message roles (int8 codes) and content lengths (int32) as NumPy
+    arrays. Timestamps are converted once and shared by every metric, and
+    message content never leaves MongoDB: its length is computed in a
+    projection.
+    """
+
+    def __init__(self, created_at: np.ndarray, roles: np.ndarray, lengths: np.ndarray):
+        self.created_at = created_at
+        self.roles = roles
+        self.lengths = lengths
+
+    @classmethod
+    def from_rows(cls, conversations, messages) -> 'ActivityColumns':
+        """
+        Build the arrays from conversation `created_at` datetimes and
+        message rows shaped like {'role': ..., 'length': ...}
+        """
+        created_at = np.array(list(conversations), dtype='datetime64[ms]').astype(np.int64)
+        rows = np.fromiter(
+            ((ROLE_CODES.get(row.get('role'), _OTHER_ROLE), row.get('length') or 0) for row in messages),
+            dtype=_MESSAGE_ROW
+        )
+        return cls(created_at, rows['role'], rows['length'])
+
+    @classmethod
+    def load(cls, db, user_id: str) -> 'ActivityColumns':
+        """Fetch only the fields the metrics need for one user"""
+        created_at = []
+        conversation_ids = []
+        for conv in db.conversations.find({'user_id': user_id}, {'created_at': 1}):
+            conversation_ids.append(conv['_id'])
+            created_at.append(conv['created_at'])
+        
+        messages = db.messages.aggregate([
+            {'$match': {'conversation_id': {'$in': conversation_ids}}},
+            {'$project': {
+                '_id': 0,
+                'role': 1,
+                'length': {'$strLenCP': {'$ifNull': ['$content', '']}}
+            }}
+        ])
+        return cls.from_rows(created_at, messages)
+
 
 class DataAnalysisService:
     def __init__(self):
@@ -98,9 +153,10 @@ class DataAnalysisService:
         df['date'] = df['created_at'].dt.date
         daily_trend = df.groupby('date').size()
         
+        # Plain str/int keys so the result is JSON serializable
         return {
-            'activity_trend': daily_trend.to_dict(),
-            'busy_hours': hourly_activity.to_dict()
+            'activity_trend': {date.isoformat(): int(count) for date, count in daily_trend.items()},
+            'busy_hours': {int(hour): int(count) for hour, count in hourly_activity.items()}
         }
     
     def analyze_user_engagement(self, conversations: List[Dict], messages: List[Dict]) -> Dict[str, Any]:
@@ -113,4 +169,122 @@ class DataAnalysisService:
         return {
             'conversations': conv_metrics,
             'messages': msg_metrics
-        }
\ No newline at end of file
+        }
+    
+    def analyze_usage_counters(self, days: List[Dict]) -> Dict[str, Any]:
+        """
+        Build the /api/usage report from pre-aggregated daily counters
+        (see UsageStatsService) instead of raw conversations and messages
+        """
+        daily_conversations = {d['day']: d.get('conversations', 0) for d in days if d.get('conversations')}
+        total_conversations = sum(daily_conversations.values())
+        
+        if daily_conversations:
+            counts = np.array(list(daily_conversations.values()))
+            avg_conversations_per_day = float(counts.mean())
+            # Earliest day wins ties, like idxmax over a date-sorted index
+            peak_activity_day = min(daily_conversations, key=lambda day: (-daily_conversations[day], day))
+        else:
+            avg_conversations_per_day = 0
+            peak_activity_day = None
+        
+        total_messages = sum(d.get('messages', 0) for d in days)
+        total_length = sum(d.get('content_length', 0) for d in days)
+        user_msg_count = sum(d.get('roles', {}).get('user', 0) for d in days)
+        assistant_msg_count = sum(d.get('roles', {}).get('assistant', 0) for d in days)
+        
+        if total_messages:
+            avg_message_length = total_length / total_messages
+            user_vs_assistant_ratio = user_msg_count / assistant_msg_count if assistant_msg_count > 0 else float('inf')
+        else:
+            avg_message_length = 0
+            user_vs_assistant_ratio = 0
+        
+        hourly_activity = {}
+        for d in days:
+            for hour, bucket in d.get('hours', {}).items():
+                if bucket.get('conversations'):
+                    hourly_activity[int(hour)] = hourly_activity.get(int(hour), 0) + bucket['conversations']
+        busy_hours = dict(sorted(hourly_activity.items(), key=lambda item: item[1], reverse=True))
+        
+        return {
+            'engagement': {
+                'conversations': {
+                    'total_conversations': total_conversations,
+                    'avg_conversations_per_day': round(avg_conversations_per_day, 2),
+                    'peak_activity_day': peak_activity_day
+                },
+                'messages': {
+                    'total_messages': total_messages,
+                    'avg_message_length': round(avg_message_length, 2),
+                    'user_vs_assistant_ratio': round(user_vs_assistant_ratio, 2)
+                }
+            },
+            'time_series': {
+                'activity_trend': daily_conversations,
+                'busy_hours': busy_hours
+            },
+            'total_conversations': total_conversations,
+            'total_messages': total_messages
+        }
+    
+    def analyze_columns(self, columns: ActivityColumns) -> Dict[str, Any]:
+        """
+        Build the /api/usage report from an ActivityColumns view with
+        vectorized NumPy operations, without building DataFrames
+        """
+        total_conversations = int(columns.created_at.size)
+        total_messages = int(columns.roles.size)
+        
+        # Parse once: whole days and hour of day, shared by every metric below
+        days, daily_counts = np.unique(columns.created_at // 86_400_000, return_counts=True)
+        hour_counts = np.bincount((columns.created_at // 3_600_000) % 24, minlength=24)
+        day_labels = np.datetime_as_string(days.astype('datetime64[D]'))
+        
+        if total_conversations:
+            conv_metrics = {
+                'total_conversations': total_conversations,
+                'avg_conversations_per_day': round(float(daily_counts.mean()), 2),
+                # argmax returns the first maximum, i.e. the earliest day on ties
+                'peak_activity_day': str(day_labels[np.argmax(daily_counts)])
+            }
+            busy_order = np.argsort(-hour_counts, kind='stable')
+            time_series = {
+                'activity_trend': {str(day): int(count) for day, count in zip(day_labels, daily_counts)},
+                'busy_hours': {int(hour): int(hour_counts[hour]) for hour in busy_order if hour_counts[hour]}
+            }
+        else:
+            conv_metrics = {
+                'total_conversations': 0,
+                'avg_conversations_per_day': 0,
+                'peak_activity_day': None
+            }
+            time_series = {'activity_trend': [], 'busy_hours': []}
+        
+        if total_messages:
+            role_counts = np.bincount(columns.roles, minlength=_OTHER_ROLE + 1)
+            user_msg_count = int(role_counts[ROLE_CODES['user']])
+            assistant_msg_count = int(role_counts[ROLE_CODES['assistant']])
+            user_vs_assistant_ratio = user_msg_count / assistant_msg_count if assistant_msg_count > 0 else float('inf')
+            msg_metrics = {
+                'total_messages': total_messages,
+                # Sum in int64 so a million long messages cannot overflow int32
+                'avg_message_length': round(float(columns.lengths.sum(dtype=np.int64)) / total_messages, 2),
+                'user_vs_assistant_ratio': round(user_vs_assistant_ratio, 2)
+            }
+        else:
+            msg_metrics = {
+                'total_messages': 0,
+                'avg_message_length': 0,
+                'user_vs_assistant_ratio': 0
+            }
+        
+        return {
+            'engagement': {
+                'conversations': conv_metrics,
+                'messages': msg_metrics
+            },
+            'time_series': time_series,
+            'total_conversations': total_conversations,
+            'total_messages': total_messages
+        }
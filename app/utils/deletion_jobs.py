@@ -0,0 +1,139 @@
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+
+class DeletionJobs:
+    """
+    Deletes all of a user's conversations and their messages in chunks.
+
+    Each chunk is the user's next `chunk_size` conversation ids, read from the
+    (user_id, _id) index, then one delete_many for their messages and one for
+    the conversations. Progress is stored in the `deletion_jobs` collection
+    after every chunk, so any worker process can report it. A job whose
+    progress has not moved for `stale_after` is treated as abandoned (its
+    process died) and a new one may start; deletion simply continues with
+    what is left. When a job ends, the user's usage counters are recomputed
+    from what is left (usually nothing) through `usage_stats`.
+    """
+
+    def __init__(self, db, chunk_size: int = 500, stale_after: timedelta = timedelta(minutes=5),
+                 usage_stats=None):
+        self.db = db
+        self.usage_stats = usage_stats
+        self.chunk_size = chunk_size
+        self.stale_after = stale_after
+        self.collection = db.db['deletion_jobs']
+        try:
+            self.collection.create_index([('user_id', 1), ('status', 1)])
+        except Exception as e:
+            print(f"Error creating deletion job index: {str(e)}")
+
+    def start(self, user_id: str, background: bool = True) -> Dict:
+        """
+        Delete all of a user's conversations and messages. Returns the job
+        document: finished when `background` is False, otherwise running in a
+        thread (or the job already running for this user).
+        """
+        running = self.collection.find_one({
+            'user_id': user_id,
+            'status': 'running',
+            'updated_at': {'$gt': datetime.utcnow() - self.stale_after}
+        })
+        if running:
+            return running
+
+        now = datetime.utcnow()
+        job = {
+            '_id': ObjectId(),
+            'user_id': user_id,
+            'status': 'running',
+            'total_conversations': self.db.conversations.count_documents({'user_id': user_id}),
+            'deleted_conversations': 0,
+            'deleted_messages': 0,
+            'error': None,
+            'created_at': now,
+            'updated_at': now
+        }
+        self.collection.insert_one(job)
+
+        if not background:
+            return self._run(job['_id'], user_id)
+        threading.Thread(target=self._run, args=(job['_id'], user_id), name='delete-all', daemon=True).start()
+        return job
+
+    def _run(self, job_id: ObjectId, user_id: str) -> Dict:
+        try:
+            while True:
+                conversation_ids = [
+                    conv['_id'] for conv in
+                    self.db.conversations.find({'user_id': user_id}, {'_id': 1}).sort('_id', -1).limit(self.chunk_size)
+                ]
+                if not conversation_ids:
+                    break
+                conversations, messages = self.db.delete_conversations(conversation_ids)
+                self.collection.update_one({'_id': job_id}, {
+                    '$inc': {'deleted_conversations': conversations, 'deleted_messages': messages},
+                    '$set': {'updated_at': datetime.utcnow()}
+                })
+            update = {'status': 'done'}
+        except Exception as e:
+            print(f"Error in deletion job {job_id}: {str(e)}")
+            update = {'status': 'failed', 'error': str(e)}
+        if self.usage_stats:
+            try:
+                self.usage_stats.rebuild(user_id)
+            except Exception as e:
+                print(f"Error recomputing usage after deletion job {job_id}: {str(e)}")
+        update['updated_at'] = datetime.utcnow()
+        return self.collection.find_one_and_update({'_id': job_id}, {'$set': update},
+                                                   return_document=ReturnDocument.AFTER)
+
+    def get(self, job_id: ObjectId, user_id: str) -> Optional[Dict]:
+        """A user's job by id, or None"""
+        return self.collection.find_one({'_id': job_id, 'user_id': user_id})
+
+    def purge_orphaned_messages(self, batch_size: int = 1000, dry_run: bool = False,
+                                progress: Callable[[int, int], None] = None) -> Dict:
+        """
+        Delete messages whose conversation no longer exists, e.g. left behind
+        by deletes that predate cascading. Distinct conversation ids are read
+        from the messages index in batches of `batch_size`, looked up with one
+        $in query and the missing ones purged with one delete_many per batch.
+        `progress(conversations_checked, messages_deleted)` is called after each batch.
+        """
+        checked = orphaned = deleted = 0
+
+        def purge(batch):
+            nonlocal checked, orphaned, deleted
+            existing = {conv['_id'] for conv in self.db.conversations.find({'_id': {'$in': batch}}, {'_id': 1})}
+            missing = [conversation_id for conversation_id in batch if conversation_id not in existing]
+            checked += len(batch)
+            orphaned += len(missing)
+            if missing:
+                query = {'conversation_id': {'$in': missing}}
+                if dry_run:
+                    deleted += self.db.messages.count_documents(query)
+                else:
+                    deleted += self.db.messages.delete_many(query).deleted_count
+            if progress:
+                progress(checked, deleted)
+
+        batch = []
+        cursor = self.db.messages.aggregate(
+            # Sorting on the indexed field first lets the server walk the index for distinct ids
+            [{'$sort': {'conversation_id': 1}}, {'$group': {'_id': '$conversation_id'}}],
+            allowDiskUse=True
+        )
+        for row in cursor:
+            batch.append(row['_id'])
+            if len(batch) >= batch_size:
+                purge(batch)
+                batch = []
+        if batch:
+            purge(batch)
+
+        return {'conversations_checked': checked, 'orphaned_conversations': orphaned, 'messages_deleted': deleted}
@@ -0,0 +1,236 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict
+
+from .llm_errors import OverloadedError
+from .metrics import LLM_QUEUE_WAIT_SECONDS, LLM_REJECTED, current_route
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`"""
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """Take one token; returns 0, or the seconds until one is available (nothing taken)"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class _Waiter:
+    """A generation waiting for a slot: a thread on an Event, or a coroutine on a Future"""
+
+    __slots__ = ('user_id', 'granted', 'event', 'future', 'loop')
+
+    def __init__(self, user_id: str, event: threading.Event = None,
+                 future: asyncio.Future = None, loop: asyncio.AbstractEventLoop = None):
+        self.user_id = user_id
+        self.granted = False
+        self.event = event
+        self.future = future
+        self.loop = loop
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class FairScheduler:
+    """
+    Admission control and per-user fair queuing in front of the LLM backends.
+
+    At most `max_concurrency` generations run at once, across worker threads
+    and the asyncio front end. Further generations wait in one FIFO queue per
+    user, and a freed slot goes to the next user in round-robin order, so a
+    user with many requests in flight gets one turn per round like everyone
+    else instead of holding the backend.
+
+    Load is shed instead of queued without bound: admit() refuses a generation
+    when the user's token bucket (`user_rate` per second, `user_burst` at
+    once; no limit when user_rate is 0) is empty, and admit() and the slots
+    refuse when `max_queue` generations are waiting overall or
+    `max_user_queue` for the user. A generation that waited `queue_timeout`
+    seconds gives up. Refusals raise OverloadedError with a Retry-After
+    estimate from the queue depth and recent generation times.
+
+    Time spent waiting for a slot is recorded separately from generation
+    time, in chatbot_llm_queue_wait_seconds.
+    """
+
+    def __init__(self, max_concurrency: int = 8, max_queue: int = 200, max_user_queue: int = 20,
+                 user_rate: float = 0, user_burst: float = 10, queue_timeout: float = 30):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_user_queue = max_user_queue
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        self._queues: Dict[str, deque] = {}
+        self._turns = deque()  # users with waiters, in the order they are served
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._hold_seconds = None  # moving average of how long a slot is held
+        self._admitted = 0
+        self._rejected = {'rate_limited': 0, 'queue_full': 0, 'queue_timeout': 0}
+
+    def _retry_after(self, queued: int) -> int:
+        rounds = queued / self.max_concurrency + 1
+        return max(1, math.ceil(rounds * (self._hold_seconds or 1.0)))
+
+    def _reject(self, reason: str, retry_after: int) -> OverloadedError:
+        self._rejected[reason] += 1
+        LLM_REJECTED.inc(reason, current_route.get())
+        return OverloadedError(reason, retry_after)
+
+    def _over_limit(self, user_id: str) -> bool:
+        queue = self._queues.get(user_id)
+        return self._queued >= self.max_queue or (queue is not None and len(queue) >= self.max_user_queue)
+
+    def admit(self, user_id: str):
+        """
+        Check a generation before it asks for a slot; raises OverloadedError
+        when the user is over their rate or the queues are full
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.user_rate > 0:
+                bucket = self._buckets.get(user_id)
+                if bucket is None:
+                    if len(self._buckets) >= 10000:
+                        # Full buckets hold no state worth keeping
+                        self._buckets = {key: b for key, b in self._buckets.items() if not b.full(now)}
+                    bucket = self._buckets[user_id] = TokenBucket(self.user_rate, self.user_burst, now)
+                wait = bucket.take(now)
+                if wait:
+                    raise self._reject('rate_limited', max(1, math.ceil(wait)))
+            if self._active >= self.max_concurrency and self._over_limit(user_id):
+                raise self._reject('queue_full', self._retry_after(self._queued))
+            self._admitted += 1
+
+    def _enqueue(self, waiter: _Waiter) -> bool:
+        """Take a free slot (True) or queue the waiter (False); raises OverloadedError when full"""
+        with self._lock:
+            if self._active < self.max_concurrency and not self._queued:
+                self._active += 1
+                return True
+            if self._over_limit(waiter.user_id):
+                raise self._reject('queue_full', self._retry_after(self._queued))
+            queue = self._queues.get(waiter.user_id)
+            if queue is None:
+                queue = self._queues[waiter.user_id] = deque()
+                self._turns.append(waiter.user_id)
+            queue.append(waiter)
+            self._queued += 1
+            return False
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Remove a waiter that gave up; False if it was granted a slot in the meantime"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            queue = self._queues[waiter.user_id]
+            queue.remove(waiter)
+            self._queued -= 1
+            if not queue:
+                del self._queues[waiter.user_id]
+                self._turns.remove(waiter.user_id)
+            return True
+
+    def _release(self, held: float = None):
+        with self._lock:
+            if held is not None:
+                previous = self._hold_seconds if self._hold_seconds is not None else held
+                self._hold_seconds = previous + 0.1 * (held - previous)
+            self._active -= 1
+            if self._turns:
+                # Next user in turn; they go to the back if they have more waiting
+                user_id = self._turns.popleft()
+                queue = self._queues[user_id]
+                waiter = queue.popleft()
+                self._queued -= 1
+                if queue:
+                    self._turns.append(user_id)
+                else:
+                    del self._queues[user_id]
+                waiter.granted = True
+                self._active += 1
+                waiter.wake()
+
+    def _timed_out(self) -> OverloadedError:
+        with self._lock:
+            return self._reject('queue_timeout', self._retry_after(self._queued))
+
+    @contextmanager
+    def slot(self, user_id: str):
+        """Hold one of the generation slots, waiting for the user's turn"""
+        started = time.perf_counter()
+        waiter = _Waiter(user_id, event=threading.Event())
+        if not self._enqueue(waiter) and not waiter.event.wait(self.queue_timeout) and self._abandon(waiter):
+            raise self._timed_out()
+        acquired = time.perf_counter()
+        LLM_QUEUE_WAIT_SECONDS.observe(acquired - started, current_route.get())
+        try:
+            yield
+        finally:
+            self._release(time.perf_counter() - acquired)
+
+    @asynccontextmanager
+    async def aslot(self, user_id: str):
+        """slot() for coroutines; shares the same slots and queues"""
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(user_id, future=loop.create_future(), loop=loop)
+        if not self._enqueue(waiter):
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+            except asyncio.TimeoutError:
+                if self._abandon(waiter):
+                    raise self._timed_out()
+            except asyncio.CancelledError:
+                if not self._abandon(waiter):
+                    self._release()
+                raise
+        acquired = time.perf_counter()
+        LLM_QUEUE_WAIT_SECONDS.observe(acquired - started, current_route.get())
+        try:
+            yield
+        finally:
+            self._release(time.perf_counter() - acquired)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            busiest = max(self._queues, key=lambda user: len(self._queues[user]), default=None)
+            return {
+                'max_concurrency': self.max_concurrency,
+                'active': self._active,
+                'queued': self._queued,
+                'queued_users': len(self._queues),
+                'busiest_user_queued': len(self._queues[busiest]) if busiest else 0,
+                'avg_generation_seconds': round(self._hold_seconds or 0, 3),
+                'admitted': self._admitted,
+                'rejected': dict(self._rejected)
+            }
@@ -1,45 +1,157 @@
+import html
 import re
+import time
+
+from .metrics import RESPONSE_CLEAN_SECONDS, current_route
+
+# An HTML tag; it cannot contain another '<', so a stray "a < b" survives
+_TAG = re.compile(r'</?[A-Za-z!][^<>]*>')
+# A named or numeric character reference
+_ENTITY = re.compile(r'&(?:#[0-9]{1,7}|#[xX][0-9a-fA-F]{1,6}|[A-Za-z][A-Za-z0-9]{1,31});')
+# Tail of a chunk that may be the start of a character reference
+_PARTIAL_ENTITY = re.compile(r'&[#A-Za-z0-9]{0,32}\Z')
+# Tail of a chunk that may still become a tag: a lone '<' or '</', or a tag missing its '>'
+_PARTIAL_TAG = re.compile(r'</?(?:[A-Za-z!][^<>]*)?\Z')
+
+
+def _decode_entity(match):
+    token = match.group()
+    text = html.unescape(token)
+    if text == token:
+        return ''  # unknown entity
+    return text.replace('\xa0', ' ')
+
+
+def _decode_entities(text):
+    if '&' not in text:
+        return text
+    return _ENTITY.sub(_decode_entity, text)
+
+
+def _strip_tags(text):
+    if '<' not in text:
+        return text
+    return _TAG.sub('', text)
+
+
+def _collapse_newlines(text):
+    """
+    Drop blanks before each newline and all whitespace after it, so runs of
+    blank lines and indentation become a single newline. Plain string
+    methods per line are much faster here than a regex that has to be tried
+    at every space.
+    """
+    if '\n' not in text:
+        return text
+    lines = text.split('\n')
+    last = len(lines) - 1
+    collapsed = [lines[0].rstrip(' \t') if last else lines[0]]
+    for i in range(1, last + 1):
+        line = lines[i].lstrip()
+        if line:
+            collapsed.append(line.rstrip(' \t') if i < last else line)
+        elif i == last:
+            collapsed.append('')  # keep the newline that ends the text
+    return '\n'.join(collapsed)
+
 
 def clean_response_format(response_text):
     """
-    Clean up the response text by removing HTML tags and formatting appropriately
+    Clean up the response text by removing HTML tags and formatting appropriately.
+
+    Tags are removed, character references decoded (unknown named entities
+    are dropped) and blank lines and indentation after newlines collapsed,
+    each in one scan with precompiled patterns or string methods. Passes
+    with nothing to do are skipped, so calling this twice is cheap. Output that
+    still looks like markup (e.g. decoded "&lt;b&gt;") would change on a
+    second call, so each response should still be cleaned exactly once.
     """
     if not response_text:
         return response_text
-    
-    # More robust and comprehensive HTML tag removal - remove all HTML tags
-    # This pattern matches <tag> and </tag> with optional attributes
-    # First pass: more specific removal of common HTML tags including <strong>, <em>, etc.
-    cleaned = re.sub(r'<(strong|em|b|i|u|s|strike|del|ins|mark|small|sub|sup|code|pre|span|div|p|br|hr|ol|ul|li|a|img|blockquote|h1|h2|h3|h4|h5|h6)[^>]*?>', '', response_text, flags=re.IGNORECASE)
-    # Second pass: remove any remaining HTML tags that might have been missed
-    cleaned = re.sub(r'</(strong|em|b|i|u|s|strike|del|ins|mark|small|sub|sup|code|pre|span|div|p|br|hr|ol|ul|li|a|img|blockquote|h1|h2|h3|h4|h5|h6)>', '', cleaned, flags=re.IGNORECASE)
-    # Final pass: remove any other HTML tags that might still exist
-    cleaned = re.sub(r'<[^>]*?>', '', cleaned)
-    
-    # Replace multiple consecutive newlines with double newline
-    cleaned = re.sub(r'\n\s*\n\s*\n+', '\n\n', cleaned)
-    
-    # Clean up any extra spaces around newlines
-    cleaned = re.sub(r'[ \t]+\n', '\n', cleaned)
-    
-    # Remove extra spaces at beginning of lines that are not needed
-    cleaned = re.sub(r'\n\s+', '\n', cleaned)
-    
-    # Remove any remaining HTML entities that might be left
-    # Common HTML entities
-    cleaned = re.sub(r'&nbsp;', ' ', cleaned)
-    cleaned = re.sub(r'&lt;', '<', cleaned)
-    cleaned = re.sub(r'&gt;', '>', cleaned)
-    cleaned = re.sub(r'&amp;', '&', cleaned)
-    cleaned = re.sub(r'&quot;', '"', cleaned)
-    cleaned = re.sub(r'&#39;', "'", cleaned)
-    cleaned = re.sub(r'&[a-zA-Z]+;', '', cleaned)  # Remove other HTML entities
-    
-    return cleaned.strip()
+
+    started = time.perf_counter()
+    cleaned = _collapse_newlines(_decode_entities(_strip_tags(response_text))).strip()
+    RESPONSE_CLEAN_SECONDS.observe(time.perf_counter() - started, 'full', current_route.get())
+    return cleaned
+
+
+class StreamSanitizer:
+    """
+    Incremental clean_response_format for streamed responses.
+
+    feed() returns the cleaned text that is safe to emit so far, holding back
+    what may still become a tag or entity at the end of a chunk (not every
+    '<': comparisons like "left < right" go out at once) and any trailing
+    whitespace, which may still be collapsed or stripped. The concatenation of
+    every feed() and close() result equals clean_response_format() of the
+    whole text.
+    """
+
+    def __init__(self):
+        self._pending = ''
+        self._whitespace = ''
+        self._started = False
+        self.elapsed = 0.0  # seconds spent in feed() and close()
+
+    def feed(self, chunk: str) -> str:
+        started = time.perf_counter()
+        text = self._pending + chunk
+
+        # Hold back a tail that may still become a tag; tags never contain '<', so
+        # earlier ones are complete, and a '<' not starting a tag ("i <= n") is text
+        hold = len(text)
+        tag_start = text.rfind('<')
+        if tag_start != -1 and _PARTIAL_TAG.match(text, tag_start):
+            hold = tag_start
+        self._pending = text[hold:]
+        text = _strip_tags(text[:hold])
+
+        # Then a character reference that may continue in the next chunk
+        partial_entity = _PARTIAL_ENTITY.search(text)
+        if partial_entity:
+            self._pending = text[partial_entity.start():] + self._pending
+            text = text[:partial_entity.start()]
+
+        text = self._emit(_decode_entities(text))
+        self.elapsed += time.perf_counter() - started
+        return text
+
+    def close(self) -> str:
+        """Flush what is left at the end of the stream and record the total cleaning time"""
+        started = time.perf_counter()
+        text = self._emit(_decode_entities(_strip_tags(self._pending)))
+        self._pending = ''
+        self._whitespace = ''  # trailing whitespace is stripped
+        self.elapsed += time.perf_counter() - started
+        RESPONSE_CLEAN_SECONDS.observe(self.elapsed, 'stream', current_route.get())
+        return text
+
+    def _emit(self, text: str) -> str:
+        text = self._whitespace + text
+        end = len(text.rstrip())
+        self._whitespace = text[end:]
+        text = _collapse_newlines(text[:end])
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        return text
+
+    @classmethod
+    def wrap(cls, chunks):
+        """Sanitize an iterator of raw chunks, skipping chunks that clean to nothing"""
+        sanitizer = cls()
+        for chunk in chunks:
+            text = sanitizer.feed(chunk)
+            if text:
+                yield text
+        text = sanitizer.close()
+        if text:
+            yield text
+
 
 def format_response_for_display(response_text):
     """
     Format the response for better display in the UI
     """
     cleaned = clean_response_format(response_text)
-    return cleaned
\ No newline at end of file
+    return cleaned
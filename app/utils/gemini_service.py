@@ -1,16 +1,35 @@
 import google.generativeai as genai
 import os
+from contextlib import nullcontext
+from typing import Iterator, Optional
 from dotenv import load_dotenv
 from .ollama_service import OllamaService
 from .format_utils import clean_response_format
+from .prompts import render_text
+from .backend_router import BackendRouter
+from .llm_errors import BackendError, OverloadedError
+from .response_cache import prompt_key
+from .single_flight import SingleFlight
 
 load_dotenv()
 
 class ChatService:
-    def __init__(self):
+    def __init__(self, response_cache=None):
         # Initialize Ollama as primary service
         self.ollama_service = OllamaService()
         
+        # Optional ResponseCache for repeated standalone questions
+        self.response_cache = response_cache
+        
+        # Identical standalone questions in flight at the same time share one generation
+        self.single_flight = SingleFlight()
+        
+        # Optional callable(user_input, user_id) -> extra context messages, e.g. the user's related past answers
+        self.context_hook = None
+        
+        # Optional FairScheduler: generations wait for a slot, taking turns between users
+        self.scheduler = None
+        
         # Check if Gemini API key is available for fallback
         api_key = os.getenv('GEMINI_API_KEY')
         self.use_gemini = False
@@ -38,161 +57,187 @@ class ChatService:
                 print(f"Error initializing Gemini as fallback: {str(e)}")
         else:
             print("GEMINI_API_KEY not provided, Ollama Qwen2.5 will be used as primary (no fallback)")
+        
+        # Health-aware routing: a backend that keeps failing is skipped until its circuit half-opens
+        self.router = BackendRouter(
+            ['ollama', 'gemini'],
+            failure_threshold=int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '3')),
+            reset_timeout=float(os.getenv('CIRCUIT_RESET_TIMEOUT', '30'))
+        )
     
-    def get_chat_response(self, user_input: str) -> str:
+    def prompt_scope(self, user_id: Optional[str]) -> Optional[str]:
         """
-        Get a response from the Ollama Qwen2.5 model for DSA algorithm explanations,
-        with fallback to Gemini if Ollama is not available
+        Who a standalone answer may be shared with: everyone (None) unless the
+        context hook adds the user's own history to the prompt
         """
-        # Try Ollama first (as primary)
+        return (user_id or 'default_user') if self.context_hook else None
+    
+    def flight_key(self, user_input: str, user_id: Optional[str] = None) -> str:
+        """Single-flight key for a standalone question"""
+        return prompt_key(user_input, self.ollama_service.model_name, self.prompt_scope(user_id))
+    
+    def cache_key(self, user_input: str, user_id: Optional[str] = None) -> Optional[str]:
+        """Response cache key for a standalone question, or None if caching is disabled"""
+        if not self.response_cache:
+            return None
+        return self.response_cache.make_key(user_input, self.ollama_service.model_name, self.prompt_scope(user_id))
+    
+    def build_messages(self, user_input: str, conversation_history: Optional[list] = None,
+                       user_id: Optional[str] = None) -> list:
+        """
+        Prompt messages for a question. Context from the context hook goes after
+        the history, so the prompt prefix shared with earlier turns is kept.
+        """
+        if self.context_hook:
+            try:
+                conversation_history = list(conversation_history or []) + self.context_hook(user_input, user_id)
+            except Exception as e:
+                print(f"Error in context hook: {str(e)}")
+        return self.ollama_service.build_messages(user_input, conversation_history)
+    
+    def _slot(self, user_id: Optional[str]):
+        """
+        Admit the user's generation and hold a scheduler slot for it, or no limit without a scheduler.
+        Called only once a generation is needed, so cache hits and coalesced questions are not charged.
+        """
+        if not self.scheduler:
+            return nullcontext()
+        self.scheduler.admit(user_id or 'default_user')
+        return self.scheduler.slot(user_id or 'default_user')
+    
+    def get_chat_response(self, user_input: str, use_cache: bool = True, user_id: Optional[str] = None) -> str:
+        """
+        Get a response for a standalone question, served from the response cache when possible.
+        Concurrent identical questions wait for one shared generation.
+        Raises AllBackendsFailedError when neither Ollama nor Gemini can answer, and
+        OverloadedError when the scheduler refuses the generation.
+        """
+        cache_key = self.cache_key(user_input, user_id) if use_cache else None
+        if cache_key:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        refused = []
+        
+        def generate():
+            try:
+                with self._slot(user_id):
+                    response = self._generate(self.build_messages(user_input, user_id=user_id))
+            except OverloadedError:
+                refused.append(user_id)
+                raise
+            if cache_key and response:
+                self.response_cache.set(cache_key, response)
+            return response
+        
+        key = self.flight_key(user_input, user_id)
         try:
-            response = self.ollama_service.get_chat_response(user_input)
-            # Check if Ollama failed to provide a valid response
-            if not response or "Error" in response or "error" in response or "connecting to Ollama" in response.lower():
-                print("Ollama failed, falling back to Gemini")
-                # Fallback to Gemini if available
-                if self.use_gemini and self.model:
-                    try:
-                        # Create a prompt that focuses on algorithmic explanations without code
-                        prompt = f"""
-                        As a DSA expert, please explain the algorithmic approach to solve this problem:
-                        {user_input}
-                        
-                        Focus on:
-                        1. Algorithmic approach
-                        2. Time and space complexity
-                        3. Data structures to use
-                        4. Step-by-step thought process
-                        5. Do NOT provide actual code implementation
-                        6. Only provide the approach and explanation
-                        7. Format the response in a clean, readable way with proper markdown-style formatting (use * or - for lists, ** for bold text, and avoid HTML tags like <strong>)
-                        """
-                        
-                        gemini_response = self.model.generate_content(prompt)
-                        cleaned_response = clean_response_format(gemini_response.text)
-                        return cleaned_response
-                    except Exception as e:
-                        print(f"Error getting response from Gemini: {str(e)}")
-                        cleaned_response = clean_response_format(response)  # Return Ollama error if Gemini also fails
-                        return cleaned_response
-            cleaned_response = clean_response_format(response)
-            return cleaned_response
-        except Exception as e:
-            print(f"Error getting response from Ollama: {str(e)}")
-            print("Falling back to Gemini service")
-            # Fallback to Gemini if available
-            if self.use_gemini and self.model:
-                try:
-                    # Create a prompt that focuses on algorithmic explanations without code
-                    prompt = f"""
-                    As a DSA expert, please explain the algorithmic approach to solve this problem:
-                    {user_input}
-                    
-                    Focus on:
-                    1. Algorithmic approach
-                    2. Time and space complexity
-                    3. Data structures to use
-                    4. Step-by-step thought process
-                    5. Do NOT provide actual code implementation
-                    6. Only provide the approach and explanation
-                    7. Format the response in a clean, readable way with proper markdown-style formatting (use * or - for lists, ** for bold text, and avoid HTML tags like <strong>)
-                    """
-                    
-                    gemini_response = self.model.generate_content(prompt)
-                    cleaned_response = clean_response_format(gemini_response.text)
-                    return cleaned_response
-                except Exception as gemini_e:
-                    print(f"Error getting response from Gemini: {str(gemini_e)}")
-                    cleaned_response = clean_response_format(f"Error: Could not get response from either Ollama or Gemini services.")
-                    return cleaned_response
-            else:
-                cleaned_response = clean_response_format(f"Error: Ollama service failed and no Gemini fallback available: {str(e)}")
-                return cleaned_response
+            return self.single_flight.do(key, generate)
+        except OverloadedError:
+            if refused:
+                raise
+            # The shared generation was refused a slot for its leader's user, not ours: try once on our own
+            return self.single_flight.do(key, generate)
     
-    def chat_with_history(self, conversation_history: list, user_input: str) -> str:
+    def chat_with_history(self, conversation_history: list, user_input: str, user_id: Optional[str] = None) -> str:
         """
         Get a response considering the conversation history,
         with Ollama as primary and fallback to Gemini if needed
         """
-        # Try Ollama first (as primary)
+        with self._slot(user_id):
+            return self._generate(self.build_messages(user_input, conversation_history, user_id))
+    
+    def _gemini_generate(self, prompt: str) -> str:
+        """Get a complete response from Gemini, raising BackendError on failure"""
         try:
-            response = self.ollama_service.chat_with_history(conversation_history, user_input)
-            # Check if Ollama failed to provide a valid response
-            if not response or "Error" in response or "error" in response or "connecting to Ollama" in response.lower():
-                print("Ollama failed, falling back to Gemini")
-                # Fallback to Gemini if available
-                if self.use_gemini and self.model:
-                    try:
-                        # Format the conversation history for context
-                        history_context = ""
-                        for msg in conversation_history[-5:]:  # Use last 5 exchanges for context
-                            role = "User" if msg.get('role') == 'user' else "Assistant"
-                            history_context += f"{role}: {msg.get('content')}\n\n"
-                        
-                        prompt = f"""
-                        Previous conversation context:
-                        {history_context}
-                        
-                        Current question: {user_input}
-                        
-                        As a DSA expert, please explain the algorithmic approach to solve this problem, considering the context if relevant:
-                        
-                        Focus on:
-                        1. Algorithmic approach
-                        2. Time and space complexity
-                        3. Data structures to use
-                        4. Step-by-step thought process
-                        5. Do NOT provide actual code implementation
-                        6. Only provide the approach and explanation
-                        7. Format the response in a clean, readable way with proper markdown-style formatting (use * or - for lists, ** for bold text, and avoid HTML tags like <strong>)
-                        """
-                        
-                        gemini_response = self.model.generate_content(prompt)
-                        cleaned_response = clean_response_format(gemini_response.text)
-                        return cleaned_response
-                    except Exception as e:
-                        print(f"Error getting response from Gemini: {str(e)}")
-                        cleaned_response = clean_response_format(response)  # Return Ollama error if Gemini also fails
-                        return cleaned_response
-            cleaned_response = clean_response_format(response)
-            return cleaned_response
+            gemini_response = self.model.generate_content(prompt)
+            return clean_response_format(gemini_response.text)
         except Exception as e:
-            print(f"Error getting response from Ollama: {str(e)}")
-            print("Falling back to Gemini service")
-            # Fallback to Gemini if available
+            raise BackendError('gemini', str(e)) from e
+    
+    def _attempts(self, messages: list) -> list:
+        """Backends to try for a prompt, in priority order"""
+        attempts = [('ollama', lambda: self.ollama_service.generate(messages))]
+        if self.use_gemini and self.model:
+            # Gemini has no chat messages here; it gets the same prompt flattened to text
+            attempts.append(('gemini', lambda: self._gemini_generate(render_text(messages))))
+        return attempts
+    
+    def _generate(self, messages: list) -> str:
+        """Ollama first, Gemini as fallback, skipping backends whose circuit is open"""
+        return self.router.call(self._attempts(messages))
+    
+    def stream_chat_response(self, user_input: str, conversation_history: Optional[list] = None,
+                             use_cache: bool = True, user_id: Optional[str] = None) -> Iterator[str]:
+        """
+        Stream a response as cleaned text chunks. Standalone questions are answered from the
+        response cache when possible and stored in it once the stream completes.
+        """
+        cache_key = self.cache_key(user_input, user_id) if use_cache and not conversation_history else None
+        if cache_key:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+        
+        if conversation_history:
+            yield from self._stream(user_input, conversation_history, user_id)
+            return
+        
+        refused = []
+        
+        def generate():
+            chunks = []
+            try:
+                for chunk in self._stream(user_input, user_id=user_id):
+                    chunks.append(chunk)
+                    yield chunk
+            except OverloadedError:
+                refused.append(user_id)
+                raise
+            if cache_key:
+                # Chunks are already cleaned by the backends
+                response = ''.join(chunks)
+                if response:
+                    self.response_cache.set(cache_key, response)
+        
+        # Concurrent identical questions attach to the same upstream stream
+        key = self.flight_key(user_input, user_id)
+        try:
+            yield from self.single_flight.stream(key, generate)
+        except OverloadedError:
+            if refused:
+                raise
+            # Refused before any text, for the leader's user: try once on our own
+            yield from self.single_flight.stream(key, generate)
+    
+    def _stream(self, user_input: str, conversation_history: Optional[list] = None,
+                user_id: Optional[str] = None) -> Iterator[str]:
+        """
+        Stream cleaned text chunks from Ollama, holding a scheduler slot until the stream ends.
+        Falls back to a single Gemini response if Ollama fails before producing any output
+        or its circuit is open.
+        """
+        with self._slot(user_id):
+            messages = self.build_messages(user_input, conversation_history, user_id)
+            attempts = [('ollama', lambda: self.ollama_service.stream_chat_response(messages))]
             if self.use_gemini and self.model:
-                try:
-                    # Format the conversation history for context
-                    history_context = ""
-                    for msg in conversation_history[-5:]:  # Use last 5 exchanges for context
-                        role = "User" if msg.get('role') == 'user' else "Assistant"
-                        history_context += f"{role}: {msg.get('content')}\n\n"
-                    
-                    prompt = f"""
-                    Previous conversation context:
-                    {history_context}
-                    
-                    Current question: {user_input}
-                    
-                    As a DSA expert, please explain the algorithmic approach to solve this problem, considering the context if relevant:
-                    
-                    Focus on:
-                    1. Algorithmic approach
-                    2. Time and space complexity
-                    3. Data structures to use
-                    4. Step-by-step thought process
-                    5. Do NOT provide actual code implementation
-                    6. Only provide the approach and explanation
-                    7. Format the response in a clean, readable way with proper markdown-style formatting (use * or - for lists, ** for bold text, and avoid HTML tags like <strong>)
-                    """
-                    
-                    gemini_response = self.model.generate_content(prompt)
-                    cleaned_response = clean_response_format(gemini_response.text)
-                    return cleaned_response
-                except Exception as gemini_e:
-                    print(f"Error getting response from Gemini: {str(gemini_e)}")
-                    cleaned_response = clean_response_format(f"Error: Could not get response from either Ollama or Gemini services.")
-                    return cleaned_response
-            else:
-                cleaned_response = clean_response_format(f"Error: Ollama service failed and no Gemini fallback available: {str(e)}")
-                return cleaned_response
\ No newline at end of file
+                attempts.append(('gemini', lambda: iter([self._gemini_generate(render_text(messages))])))
+            yield from self.router.stream(attempts)
+    
+    def stats(self) -> dict:
+        """Counters for the cache and request coalescing layers in front of the LLM backends"""
+        return {
+            'cache': self.response_cache.stats() if self.response_cache else None,
+            'coalescing': self.single_flight.stats(),
+            'scheduler': self.scheduler.stats() if self.scheduler else None
+        }
+    
+    def backend_health(self) -> dict:
+        """Circuit breaker state per backend"""
+        health = self.router.snapshot()
+        health['gemini']['configured'] = bool(self.use_gemini and self.model)
+        health['ollama']['configured'] = True
+        health['ollama']['hosts'] = self.ollama_service.hosts.snapshot()
+        return health
@@ -0,0 +1,47 @@
+class BackendError(Exception):
+    """An LLM backend failed to produce a response"""
+
+    def __init__(self, backend: str, message: str):
+        super().__init__(f"{backend}: {message}")
+        self.backend = backend
+        self.message = message
+
+
+class BackendUnavailableError(BackendError):
+    """The backend could not be reached (connection refused, DNS, connect timeout)"""
+
+
+class BackendTimeoutError(BackendError):
+    """The backend accepted the request but did not answer within the read timeout"""
+
+
+class BackendResponseError(BackendError):
+    """The backend answered with an error status or an unusable body"""
+
+    def __init__(self, backend: str, message: str, status_code: int = None):
+        super().__init__(backend, message)
+        self.status_code = status_code
+
+
+class CircuitOpenError(BackendError):
+    """The backend was skipped because its circuit breaker is open"""
+
+    def __init__(self, backend: str):
+        super().__init__(backend, "circuit open")
+
+
+class AllBackendsFailedError(Exception):
+    """Every configured backend failed or was skipped"""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(str(e) for e in errors) or "no backends configured")
+        self.errors = list(errors)
+
+
+class OverloadedError(Exception):
+    """A generation was refused by admission control; the client may retry after `retry_after` seconds"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"{reason}, retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
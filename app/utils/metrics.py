@@ -0,0 +1,222 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Sequence, Tuple
+
+from pymongo import monitoring
+
+# Route template of the request being served, set by the web layer; work done
+# outside a request (background writers, CLI commands) is labelled 'background'
+current_route: ContextVar[str] = ContextVar('current_route', default='background')
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000)
+TOKEN_BUCKETS = (25, 50, 100, 200, 400, 800, 1600, 3200, 6400, 12800)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], le: str = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus text format, one series per label set.
+
+    observe() is a bisect and three additions under a lock, cheap enough for
+    every Mongo command and every response.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        """Record a value; `labels` are given in the order of `labelnames`"""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (plus +Inf), sum, count
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels: str):
+        """Observe the duration of the block in seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            snapshot = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {count}')
+        return '\n'.join(lines)
+
+
+class Counter:
+    """Monotonic counter in the Prometheus text format, one series per label set"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            snapshot = sorted(self._series.items())
+        for labels, value in snapshot:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value}')
+        return '\n'.join(lines)
+
+
+class MetricsRegistry:
+    """The metrics of this process, rendered together for /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'chatbot_http_request_seconds', 'Time to produce a response, by route, method and status',
+    ('route', 'method', 'status')
+)
+MONGO_COMMAND_SECONDS = REGISTRY.histogram(
+    'chatbot_mongo_command_seconds', 'MongoDB command round trips, by command and route',
+    ('command', 'route')
+)
+MONGO_COMMAND_FAILURES = REGISTRY.counter(
+    'chatbot_mongo_command_failures_total', 'MongoDB commands that failed, by command and route',
+    ('command', 'route')
+)
+LLM_REQUEST_SECONDS = REGISTRY.histogram(
+    'chatbot_llm_request_seconds', 'LLM generations from request to last token, by backend, mode and route',
+    ('backend', 'mode', 'route')
+)
+LLM_TIME_TO_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    'chatbot_llm_time_to_first_token_seconds',
+    'Time until a streamed generation produced its first text, by backend and route',
+    ('backend', 'route')
+)
+LLM_TOKENS_PER_SECOND = REGISTRY.histogram(
+    'chatbot_llm_tokens_per_second', "Generation speed reported by Ollama (eval_count / eval_duration), by backend",
+    ('backend',), buckets=RATE_BUCKETS
+)
+LLM_GENERATED_TOKENS = REGISTRY.counter(
+    'chatbot_llm_generated_tokens_total', "Tokens generated as reported by Ollama's eval_count, by backend",
+    ('backend',)
+)
+PROMPT_TOKENS = REGISTRY.histogram(
+    'chatbot_prompt_tokens', 'Estimated size of the prompts sent to the LLM, by route',
+    ('route',), buckets=TOKEN_BUCKETS
+)
+LLM_PROMPT_EVAL_TOKENS = REGISTRY.histogram(
+    'chatbot_llm_prompt_eval_tokens',
+    "Prompt tokens Ollama evaluated (prompt_eval_count; a cached prefix is not evaluated again), by backend",
+    ('backend',), buckets=TOKEN_BUCKETS
+)
+LLM_QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    'chatbot_llm_queue_wait_seconds', 'Time generations waited for a scheduler slot before starting, by route',
+    ('route',)
+)
+LLM_REJECTED = REGISTRY.counter(
+    'chatbot_llm_rejected_total', 'Generations refused by the scheduler, by reason and route',
+    ('reason', 'route')
+)
+OLLAMA_HOST_REQUESTS = REGISTRY.counter(
+    'chatbot_ollama_host_requests_total', 'Requests sent to each Ollama host, by host and outcome',
+    ('host', 'outcome')
+)
+LLM_FAILURES = REGISTRY.counter(
+    'chatbot_llm_failures_total', 'LLM calls that raised, by backend and route',
+    ('backend', 'route')
+)
+RESPONSE_CLEAN_SECONDS = REGISTRY.histogram(
+    'chatbot_response_clean_seconds', 'Time spent cleaning response text, by mode and route',
+    ('mode', 'route')
+)
+JSON_SERIALIZE_SECONDS = REGISTRY.histogram(
+    'chatbot_json_serialize_seconds', 'Time spent serializing JSON responses, by route',
+    ('route',)
+)
+
+
+def observe_ollama_eval(result: dict, backend: str = 'ollama'):
+    """Record prompt tokens, generated tokens and tokens/sec from the eval stats of Ollama's final response"""
+    if result.get('prompt_eval_count') is not None:
+        LLM_PROMPT_EVAL_TOKENS.observe(result['prompt_eval_count'], backend)
+    eval_count = result.get('eval_count')
+    eval_duration = result.get('eval_duration')  # nanoseconds
+    if eval_count:
+        LLM_GENERATED_TOKENS.inc(backend, amount=eval_count)
+        if eval_duration:
+            LLM_TOKENS_PER_SECOND.observe(eval_count / (eval_duration / 1e9), backend)
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """
+    pymongo command listener feeding MONGO_COMMAND_SECONDS.
+
+    The driver reports each command's round trip itself, so every query,
+    insert, getMore and aggregate issued through the client is timed without
+    wrapping Database methods, including cursors consumed later.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, event.command_name, current_route.get())
+
+    def failed(self, event):
+        route = current_route.get()
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, event.command_name, route)
+        MONGO_COMMAND_FAILURES.inc(event.command_name, route)
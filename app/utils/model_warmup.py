@@ -0,0 +1,131 @@
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+
+def parse_hours(value: str) -> Optional[Tuple[int, int]]:
+    """'8-20' -> (8, 20); an empty value means all day"""
+    if not value or not value.strip():
+        return None
+    start, end = (int(part) for part in value.split('-'))
+    if not (0 <= start <= 23 and 0 <= end <= 24):
+        raise ValueError(f"invalid hours '{value}', expected e.g. 8-20")
+    return start, end
+
+
+class ModelWarmer:
+    """
+    Loads the Ollama model before the first chat and keeps it loaded.
+
+    The warm-up checks which Ollama hosts list the model in /api/tags, then
+    sends each of them a chat request with no messages, which makes Ollama
+    load the model and hold it for `keep_alive`. It retries every `retry_interval` until it succeeds
+    and is repeated every `interval` while the local hour is within `hours`
+    (all day when None), so Ollama does not unload an idle model during
+    business hours. Outside them the model may be unloaded as usual.
+
+    `ready` is True once the last warm-up or ping succeeded on at least one
+    host; the readiness endpoint reports it so the load balancer only routes
+    to warm instances.
+    """
+
+    def __init__(self, ollama_service, interval: float = 240, hours: Optional[Tuple[int, int]] = None,
+                 retry_interval: float = 10, load_timeout: float = 300):
+        self.ollama_service = ollama_service
+        self.interval = interval
+        self.hours = hours
+        self.retry_interval = retry_interval
+        self.load_timeout = load_timeout
+        self.ready = False
+        self.model_available = None
+        self.last_success = None
+        self.last_error = None
+        self.load_seconds = None
+        self.warm_hosts = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def in_hours(self, now: Optional[datetime] = None) -> bool:
+        if self.hours is None:
+            return True
+        hour = (now or datetime.now()).hour
+        start, end = self.hours
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end  # window across midnight, e.g. 22-6
+
+    def check_available(self) -> List:
+        """The Ollama hosts that are up with OLLAMA_MODEL pulled"""
+        hosts = self.ollama_service.hosts
+        return [host for host in hosts.hosts if hosts.check(host)]
+
+    def _load(self, url: str):
+        service = self.ollama_service
+        # No messages: Ollama only loads the model and refreshes its keep_alive
+        response = requests.post(
+            f"{url}/api/chat",
+            json={"model": service.model_name, "messages": [], "keep_alive": service.keep_alive},
+            timeout=(service.connect_timeout, self.load_timeout)
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"{response.status_code} - {response.text}")
+
+    def warm_up(self) -> bool:
+        """Load the model on every host that has it; returns whether the instance is ready"""
+        service = self.ollama_service
+        try:
+            available = self.check_available()
+            self.model_available = bool(available)
+            if not available:
+                raise RuntimeError(f"model {service.model_name} not found in /api/tags on any host")
+            errors = []
+            started = time.perf_counter()
+            for host in available:
+                try:
+                    self._load(host.url)
+                except Exception as e:
+                    errors.append(f"{host.url}: {str(e)}")
+            self.warm_hosts = len(available) - len(errors)
+            if not self.warm_hosts:
+                raise RuntimeError("; ".join(errors))
+            self.load_seconds = round(time.perf_counter() - started, 3)
+            self.last_success = datetime.utcnow()
+            self.last_error = "; ".join(errors) or None
+            self.ready = True
+        except Exception as e:
+            print(f"Ollama warm-up failed: {str(e)}")
+            self.last_error = str(e)
+            self.warm_hosts = 0
+            self.ready = False
+        return self.ready
+
+    def start(self):
+        """Warm up and keep the model loaded from a daemon thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='ollama-warmup', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        self.warm_up()
+        while not self._stop.wait(self.interval if self.ready else self.retry_interval):
+            if not self.ready or self.in_hours():
+                self.warm_up()
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self) -> Dict:
+        return {
+            'ready': self.ready,
+            'model': self.ollama_service.model_name,
+            'model_available': self.model_available,
+            'keep_alive': self.ollama_service.keep_alive,
+            'last_success': self.last_success.isoformat() if self.last_success else None,
+            'load_seconds': self.load_seconds,
+            'warm_hosts': self.warm_hosts,
+            'hosts': len(self.ollama_service.hosts),
+            'error': self.last_error
+        }
@@ -0,0 +1,122 @@
+from typing import Any, Dict
+
+_DAY = {'$dateToString': {'format': '%Y-%m-%d', 'date': '$created_at'}}
+
+
+class MongoAnalysisService:
+    """
+    DataAnalysisService metrics computed by MongoDB aggregation pipelines.
+
+    Grouping, counting and averaging run in `$group` stages on the server,
+    so only the aggregated rows cross the wire instead of every conversation
+    and message document. Results match the pandas implementation.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def analyze_conversation_metrics(self, user_id: str) -> Dict[str, Any]:
+        """
+        Total conversations, average per active day and the busiest day
+        """
+        pipeline = [
+            {'$match': {'user_id': user_id}},
+            {'$group': {'_id': _DAY, 'count': {'$sum': 1}}},
+            # Earliest day wins ties, like idxmax over a date-sorted index
+            {'$sort': {'count': -1, '_id': 1}},
+            {'$group': {
+                '_id': None,
+                'total_conversations': {'$sum': '$count'},
+                'avg_conversations_per_day': {'$avg': '$count'},
+                'peak_activity_day': {'$first': '$_id'}
+            }}
+        ]
+        result = next(self.db.conversations.aggregate(pipeline), None)
+        if not result or not result['total_conversations']:
+            return {
+                'total_conversations': 0,
+                'avg_conversations_per_day': 0,
+                'peak_activity_day': None
+            }
+
+        return {
+            'total_conversations': result['total_conversations'],
+            'avg_conversations_per_day': round(result['avg_conversations_per_day'], 2),
+            'peak_activity_day': result['peak_activity_day']
+        }
+
+    def analyze_message_patterns(self, user_id: str) -> Dict[str, Any]:
+        """
+        Message count, average length (in code points) and user/assistant ratio
+        """
+        # Messages carry no user_id, so they are joined to the user's conversations on the server,
+        # through the messages' conversation_id index; $unwind right after $lookup streams them one by one
+        pipeline = [
+            {'$match': {'user_id': user_id}},
+            {'$project': {'_id': 1}},
+            {'$lookup': {
+                'from': self.db.messages.name,
+                'localField': '_id',
+                'foreignField': 'conversation_id',
+                'as': 'message'
+            }},
+            {'$unwind': '$message'},
+            {'$group': {
+                '_id': None,
+                'total_messages': {'$sum': 1},
+                'avg_message_length': {'$avg': {'$strLenCP': {'$ifNull': ['$message.content', '']}}},
+                'user_msg_count': {'$sum': {'$cond': [{'$eq': ['$message.role', 'user']}, 1, 0]}},
+                'assistant_msg_count': {'$sum': {'$cond': [{'$eq': ['$message.role', 'assistant']}, 1, 0]}}
+            }}
+        ]
+        result = next(self.db.conversations.aggregate(pipeline), None)
+        if not result or not result['total_messages']:
+            return {
+                'total_messages': 0,
+                'avg_message_length': 0,
+                'user_vs_assistant_ratio': 0
+            }
+
+        assistant_msg_count = result['assistant_msg_count']
+        user_vs_assistant_ratio = result['user_msg_count'] / assistant_msg_count if assistant_msg_count > 0 else float('inf')
+
+        return {
+            'total_messages': result['total_messages'],
+            'avg_message_length': round(result['avg_message_length'], 2),
+            'user_vs_assistant_ratio': round(user_vs_assistant_ratio, 2)
+        }
+
+    def generate_time_series_analysis(self, user_id: str) -> Dict[str, Any]:
+        """
+        Conversations per day and per hour of day, busiest hours first
+        """
+        pipeline = [
+            {'$match': {'user_id': user_id}},
+            {'$facet': {
+                'days': [
+                    {'$group': {'_id': _DAY, 'count': {'$sum': 1}}},
+                    {'$sort': {'_id': 1}}
+                ],
+                'hours': [
+                    {'$group': {'_id': {'$hour': '$created_at'}, 'count': {'$sum': 1}}},
+                    {'$sort': {'count': -1, '_id': 1}}
+                ]
+            }}
+        ]
+        result = next(self.db.conversations.aggregate(pipeline), None)
+        if not result or not result['days']:
+            return {'activity_trend': [], 'busy_hours': []}
+
+        return {
+            'activity_trend': {row['_id']: row['count'] for row in result['days']},
+            'busy_hours': {row['_id']: row['count'] for row in result['hours']}
+        }
+
+    def analyze_user_engagement(self, user_id: str) -> Dict[str, Any]:
+        """
+        Analyze user engagement patterns
+        """
+        return {
+            'conversations': self.analyze_conversation_metrics(user_id),
+            'messages': self.analyze_message_patterns(user_id)
+        }
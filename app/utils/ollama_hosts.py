@@ -0,0 +1,178 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import requests
+
+from .llm_errors import BackendError, BackendResponseError
+from .metrics import OLLAMA_HOST_REQUESTS
+
+
+def parse_hosts(value: str) -> List[str]:
+    """'http://a:11434, http://b:11434' -> ['http://a:11434', 'http://b:11434']"""
+    hosts = [host.strip().rstrip('/') for host in (value or '').split(',') if host.strip()]
+    if not hosts:
+        raise ValueError("OLLAMA_URL must name at least one host")
+    return hosts
+
+
+def model_tag(model_name: str) -> str:
+    """The name /api/tags lists a model under: an untagged name means ':latest'"""
+    return model_name if ':' in model_name else f"{model_name}:latest"
+
+
+def host_at_fault(error: BackendError) -> bool:
+    """Whether a failure is the host's, so the request may be retried on another host"""
+    if isinstance(error, BackendResponseError) and error.status_code is not None:
+        # 404: the host does not have the model; another 4xx means the request itself is bad
+        return error.status_code >= 500 or error.status_code == 404
+    return True
+
+
+class OllamaHost:
+    """One Ollama node and what the pool knows about it"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        # None until the first health check; unknown hosts are used
+        self.healthy = None
+        self.has_model = None
+        self.latency = None  # moving average of successful request seconds
+        self.requests = 0
+        self.failures = 0
+        self.last_check = None
+        self.last_error = None
+
+    @property
+    def eligible(self) -> bool:
+        return self.healthy is not False and self.has_model is not False
+
+
+class OllamaHostPool:
+    """
+    Spreads generations over several Ollama nodes.
+
+    Each request goes to the eligible host with the fewest requests in
+    flight from this process; ties go to the host with the lower recent
+    latency. Eligible means the last health check found the host up with
+    OLLAMA_MODEL pulled. Health checks call /api/tags on every host every
+    `check_interval` seconds from a background thread, and a host whose
+    request fails is taken out of rotation until a check finds it healthy
+    again. When no host is eligible the others are tried anyway, so a
+    stale check cannot take the service down.
+
+    Callers take a host with lease(), report a host at fault with
+    mark_failed() and, to retry elsewhere, pass the hosts that already
+    failed as `exclude`.
+    """
+
+    def __init__(self, urls: List[str], model_name: str, check_interval: float = 10,
+                 connect_timeout: float = 3, read_timeout: float = 10):
+        self.hosts = [OllamaHost(url) for url in urls]
+        self.model_name = model_name
+        self.check_interval = check_interval
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self) -> int:
+        return len(self.hosts)
+
+    def check(self, host: OllamaHost) -> bool:
+        """Call /api/tags on a host and record whether it is up with the model; returns eligibility"""
+        try:
+            response = requests.get(f"{host.url}/api/tags", timeout=(self.connect_timeout, self.read_timeout))
+            response.raise_for_status()
+            names = {model.get('name') for model in response.json().get('models', [])}
+            has_model = model_tag(self.model_name) in names
+            error = None if has_model else f"model {self.model_name} not found in /api/tags"
+            healthy = True
+        except Exception as e:
+            healthy, has_model, error = False, None, str(e)
+        with self._lock:
+            host.healthy = healthy
+            if has_model is not None:
+                host.has_model = has_model
+            host.last_check = time.time()
+            host.last_error = error
+        return host.eligible
+
+    def check_all(self):
+        for host in self.hosts:
+            self.check(host)
+
+    def start(self):
+        """Check the hosts now and then every check_interval seconds, from a daemon thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='ollama-health', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        self.check_all()
+        while not self._stop.wait(self.check_interval):
+            self.check_all()
+
+    def stop(self):
+        self._stop.set()
+
+    def _pick(self, exclude) -> Optional[OllamaHost]:
+        candidates = [host for host in self.hosts if host not in exclude]
+        eligible = [host for host in candidates if host.eligible] or candidates
+        if not eligible:
+            return None
+        return min(eligible, key=lambda host: (host.outstanding, host.latency or 0))
+
+    @contextmanager
+    def lease(self, exclude=()):
+        """Yield the host to send a request to, or None when every host is excluded"""
+        with self._lock:
+            host = self._pick(exclude)
+            if host is not None:
+                host.outstanding += 1
+                host.requests += 1
+        if host is None:
+            yield None
+            return
+        started = time.perf_counter()
+        outcome = 'cancelled'  # e.g. a stream closed by the client
+        try:
+            yield host
+            outcome = 'success'
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            self._release(host, outcome, time.perf_counter() - started)
+
+    def _release(self, host: OllamaHost, outcome: str, seconds: float):
+        with self._lock:
+            host.outstanding -= 1
+            if outcome == 'success':
+                host.latency = seconds if host.latency is None else host.latency + 0.2 * (seconds - host.latency)
+        OLLAMA_HOST_REQUESTS.inc(host.url, outcome)
+
+    def mark_failed(self, host: OllamaHost, error: Exception):
+        """Take a host out of rotation until a health check finds it up again"""
+        with self._lock:
+            host.failures += 1
+            host.healthy = False
+            host.last_error = str(error)
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            return [{
+                'url': host.url,
+                'eligible': host.eligible,
+                'healthy': host.healthy,
+                'has_model': host.has_model,
+                'outstanding': host.outstanding,
+                'requests': host.requests,
+                'failures': host.failures,
+                'latency_seconds': round(host.latency, 3) if host.latency is not None else None,
+                'last_check': host.last_check,
+                'last_error': host.last_error
+            } for host in self.hosts]
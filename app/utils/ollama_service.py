@@ -1,115 +1,174 @@
 import requests
+import json
 import os
-from typing import Optional
-from .format_utils import clean_response_format
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from .format_utils import StreamSanitizer, clean_response_format
+from .llm_errors import BackendError, BackendResponseError, BackendTimeoutError, BackendUnavailableError
+from .metrics import observe_ollama_eval
+from .ollama_hosts import OllamaHostPool, host_at_fault, parse_hosts
+from .prompts import build_messages
 
 
 class OllamaService:
     def __init__(self):
-        # Use Ollama URL from environment variable or default to localhost
-        self.ollama_url = os.getenv('OLLAMA_URL', 'http://localhost:11434')
         # Default to Qwen2.5 model - can be overridden via environment variable
         self.model_name = os.getenv('OLLAMA_MODEL', 'qwen2.5:latest')  # Default to qwen2.5:latest
+        # Fail fast when Ollama is down; allow slow generations once connected
+        self.connect_timeout = float(os.getenv('OLLAMA_CONNECT_TIMEOUT', '3'))
+        self.read_timeout = float(os.getenv('OLLAMA_READ_TIMEOUT', '60'))
+        # How long Ollama keeps the model (and its prompt cache) loaded after a request
+        self.keep_alive = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+        # One or more Ollama nodes (comma-separated OLLAMA_URL), default localhost
+        self.hosts = OllamaHostPool(
+            parse_hosts(os.getenv('OLLAMA_URL', 'http://localhost:11434')),
+            self.model_name,
+            check_interval=float(os.getenv('OLLAMA_HEALTH_INTERVAL', '10')),
+            connect_timeout=self.connect_timeout
+        )
+        self.ollama_url = self.hosts.hosts[0].url
+    
+    def build_messages(self, user_input: str, conversation_history: Optional[list] = None) -> list:
+        """
+        Chat messages for a question: the shared DSA system prompt, recent history, the question
+        """
+        return build_messages(user_input, conversation_history)
     
     def get_chat_response(self, user_input: str) -> str:
         """
         Get a response from the local Ollama model for DSA algorithm explanations
         """
-        try:
-            # Create a prompt that focuses on algorithmic explanations without code
-            prompt = f"""
-            As a DSA expert, please explain the algorithmic approach to solve this problem:
-            {user_input}
-            
-            Focus on:
-            1. Algorithmic approach
-            2. Time and space complexity
-            3. Data structures to use
-            4. Step-by-step thought process
-            5. Do NOT provide actual code implementation
-            6. Only provide the approach and explanation
-            7. Format the response in a clean, readable way with proper markdown-style formatting (use * or - for lists, ** for bold text, and avoid HTML tags like <strong>)
-            """
-            
-            # Prepare the request to Ollama API
-            payload = {
-                "model": self.model_name,
-                "prompt": prompt,
-                "stream": False
-            }
-            
-            response = requests.post(
-                f"{self.ollama_url}/api/generate",
-                json=payload,
-                timeout=60  # 60 second timeout
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                raw_response = result.get('response', 'No response generated.')
-                # Clean up the response format
-                cleaned_response = clean_response_format(raw_response)
-                return cleaned_response
-            else:
-                return f"Error from Ollama: {response.status_code} - {response.text}"
-                
-        except requests.exceptions.RequestException as e:
-            return f"Error connecting to Ollama: {str(e)}"
-        except Exception as e:
-            return f"Error getting response from Ollama: {str(e)}"
+        return self.generate(self.build_messages(user_input))
     
     def chat_with_history(self, conversation_history: list, user_input: str) -> str:
         """
         Get a response considering the conversation history
         """
+        return self.generate(self.build_messages(user_input, conversation_history))
+    
+    @contextmanager
+    def _translate_errors(self):
+        """Turn requests exceptions into structured backend errors"""
         try:
-            # Format the conversation history for context
-            history_context = ""
-            for msg in conversation_history[-5:]:  # Use last 5 exchanges for context
-                role = "User" if msg.get('role') == 'user' else "Assistant"
-                history_context += f"{role}: {msg.get('content')}\n\n"
-            
-            prompt = f"""
-            Previous conversation context:
-            {history_context}
-            
-            Current question: {user_input}
-            
-            As a DSA expert, please explain the algorithmic approach to solve this problem, considering the context if relevant:
-            
-            Focus on:
-            1. Algorithmic approach
-            2. Time and space complexity
-            3. Data structures to use
-            4. Step-by-step thought process
-            5. Do NOT provide actual code implementation
-            6. Only provide the approach and explanation
-            7. Format the response in a clean, readable way with proper markdown-style formatting (use * or - for lists, ** for bold text, and avoid HTML tags like <strong>)
-            """
-            
-            # Prepare the request to Ollama API
-            payload = {
-                "model": self.model_name,
-                "prompt": prompt,
-                "stream": False
-            }
-            
+            yield
+        except requests.exceptions.ConnectTimeout as e:
+            raise BackendUnavailableError('ollama', f"connect timeout: {str(e)}") from e
+        except requests.exceptions.ConnectionError as e:
+            raise BackendUnavailableError('ollama', f"connection failed: {str(e)}") from e
+        except requests.exceptions.Timeout as e:
+            raise BackendTimeoutError('ollama', f"read timeout: {str(e)}") from e
+        except requests.exceptions.RequestException as e:
+            raise BackendResponseError('ollama', str(e)) from e
+        except ValueError as e:
+            raise BackendResponseError('ollama', f"invalid response body: {str(e)}") from e
+    
+    def _payload(self, messages: list, stream: bool) -> dict:
+        # keep_alive keeps the model loaded, so the shared system prompt stays in its KV cache
+        return {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": stream,
+            "keep_alive": self.keep_alive
+        }
+    
+    def generate(self, messages: list) -> str:
+        """
+        Send chat messages to Ollama's /api/chat and wait for the complete response.
+        A host that fails is retried on the next one; raises a BackendError subclass
+        when none of them answers.
+        """
+        payload = self._payload(messages, stream=False)
+        failed = []
+        while True:
+            try:
+                with self.hosts.lease(exclude=failed) as host:
+                    result = self._post(host.url, payload)
+                break
+            except BackendError as e:
+                if not host_at_fault(e):
+                    raise
+                self.hosts.mark_failed(host, e)
+                failed.append(host)
+                if len(failed) >= len(self.hosts):
+                    raise
+                print(f"Ollama host {host.url} failed, retrying on another host: {str(e)}")
+        
+        # Prompt and generated tokens and tokens/sec from Ollama's own eval stats
+        observe_ollama_eval(result)
+        raw_response = (result.get('message') or {}).get('content') or 'No response generated.'
+        # Clean up the response format
+        return clean_response_format(raw_response)
+    
+    def _post(self, url: str, payload: dict) -> dict:
+        """POST a non-streaming chat to one host and return the decoded response"""
+        with self._translate_errors():
             response = requests.post(
-                f"{self.ollama_url}/api/generate",
+                f"{url}/api/chat",
                 json=payload,
-                timeout=60  # 60 second timeout
+                timeout=(self.connect_timeout, self.read_timeout)
             )
             
-            if response.status_code == 200:
-                result = response.json()
-                raw_response = result.get('response', 'No response generated.')
-                # Clean up the response format
-                cleaned_response = clean_response_format(raw_response)
-                return cleaned_response
-            else:
-                return f"Error from Ollama: {response.status_code} - {response.text}"
-                
-        except requests.exceptions.RequestException as e:
-            return f"Error connecting to Ollama: {str(e)}"
-        except Exception as e:
-            return f"Error getting response from Ollama: {str(e)}"
\ No newline at end of file
+            if response.status_code != 200:
+                raise BackendResponseError(
+                    'ollama', f"{response.status_code} - {response.text}", status_code=response.status_code
+                )
+            return response.json()
+    
+    def stream_chat_response(self, messages: list) -> Iterator[str]:
+        """
+        Stream a response from Ollama, yielding cleaned text chunks as they are generated.
+        Raises a BackendError subclass on connection, timeout or HTTP errors.
+        """
+        return StreamSanitizer.wrap(self._stream_raw(messages))
+    
+    def _stream_raw(self, messages: list) -> Iterator[str]:
+        """
+        Yield raw text chunks from Ollama's NDJSON stream. A host that fails before
+        producing any text is retried on the next one.
+        """
+        payload = self._payload(messages, stream=True)
+        failed = []
+        while True:
+            started = False
+            try:
+                with self.hosts.lease(exclude=failed) as host:
+                    for text in self._stream_from(host.url, payload):
+                        started = True
+                        yield text
+                return
+            except BackendError as e:
+                if not host_at_fault(e):
+                    raise
+                self.hosts.mark_failed(host, e)
+                failed.append(host)
+                if started or len(failed) >= len(self.hosts):
+                    raise  # text already sent cannot be taken back
+                print(f"Ollama host {host.url} failed, retrying on another host: {str(e)}")
+    
+    def _stream_from(self, url: str, payload: dict) -> Iterator[str]:
+        """Yield raw text chunks from one host"""
+        # Ollama streams newline-delimited JSON objects, one per generated chunk
+        with self._translate_errors():
+            with requests.post(
+                f"{url}/api/chat",
+                json=payload,
+                stream=True,
+                timeout=(self.connect_timeout, self.read_timeout)  # read timeout applies per chunk
+            ) as response:
+                if response.status_code != 200:
+                    raise BackendResponseError(
+                        'ollama', f"{response.status_code} - {response.text}", status_code=response.status_code
+                    )
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get('error'):
+                        raise BackendResponseError('ollama', chunk['error'])
+                    text = (chunk.get('message') or {}).get('content', '')
+                    if text:
+                        yield text
+                    if chunk.get('done'):
+                        # The final chunk carries the eval stats of the whole generation
+                        observe_ollama_eval(chunk)
+                        break
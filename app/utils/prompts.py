@@ -0,0 +1,67 @@
+import textwrap
+from typing import Dict, List, Optional
+
+from .context_builder import estimate_tokens
+from .metrics import PROMPT_TOKENS, current_route
+
+
+def _normalize(text: str) -> str:
+    """Dedent, strip every line and drop repeated blank lines, so no indentation reaches the model"""
+    lines = [line.strip() for line in textwrap.dedent(text).strip().splitlines()]
+    normalized = []
+    for line in lines:
+        if line or (normalized and normalized[-1]):
+            normalized.append(line)
+    return '\n'.join(normalized)
+
+
+# The DSA instructions, rendered once. They open every prompt unchanged, so the
+# model server can reuse the cached prefix across requests and turns.
+SYSTEM_PROMPT = _normalize("""
+    As a DSA expert, please explain the algorithmic approach to solve the user's problem,
+    considering the previous conversation if relevant.
+
+    Focus on:
+    1. Algorithmic approach
+    2. Time and space complexity
+    3. Data structures to use
+    4. Step-by-step thought process
+    5. Do NOT provide actual code implementation
+    6. Only provide the approach and explanation
+    7. Format the response in a clean, readable way with proper markdown-style formatting (use * or - for lists, ** for bold text, and avoid HTML tags like <strong>)
+""")
+
+SYSTEM_PROMPT_TOKENS = estimate_tokens(SYSTEM_PROMPT)
+
+_ROLES = {'user': 'user', 'assistant': 'assistant', 'system': 'system'}
+_TEXT_LABELS = {'user': 'User', 'system': 'Context'}
+
+
+def build_messages(user_input: str, conversation_history: Optional[List[Dict]] = None) -> List[Dict]:
+    """
+    Chat messages for a question: the shared system prompt, the (already
+    windowed and token-budgeted) history, then the question
+    """
+    messages = [{'role': 'system', 'content': SYSTEM_PROMPT}]
+    for msg in conversation_history or ():
+        messages.append({'role': _ROLES.get(msg.get('role'), 'assistant'), 'content': msg.get('content') or ''})
+    messages.append({'role': 'user', 'content': user_input})
+    PROMPT_TOKENS.observe(prompt_tokens(messages), current_route.get())
+    return messages
+
+
+def render_text(messages: List[Dict]) -> str:
+    """Flatten chat messages into one prompt string for backends without a chat API (Gemini)"""
+    *history, question = messages[1:]
+    parts = [SYSTEM_PROMPT]
+    if history:
+        parts.append('Previous conversation context:\n' + '\n\n'.join(
+            f"{_TEXT_LABELS.get(msg['role'], 'Assistant')}: {msg['content']}" for msg in history
+        ))
+    parts.append(f"Current question: {question['content']}")
+    return '\n\n'.join(parts)
+
+
+def prompt_tokens(messages: List[Dict]) -> int:
+    """Estimated prompt size in tokens"""
+    return sum(estimate_tokens(msg['content']) for msg in messages)
@@ -0,0 +1,141 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    return _WHITESPACE.sub(' ', prompt.strip().lower()).rstrip(' ?!.')
+
+
+def prompt_key(prompt: str, model_name: str, scope: Optional[str] = None) -> str:
+    """
+    Stable key for a question asked of a given model. Answers whose prompt
+    depends on who asks (e.g. context from the user's own history) pass that
+    user as `scope`, so they are never shared with anyone else.
+    """
+    text = f"{model_name}\x00{normalize_prompt(prompt)}"
+    if scope is not None:
+        text += f"\x00{scope}"
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Cache of LLM responses keyed by normalized prompt and model name.
+
+    The in-process tier is an LRU bounded by total size in bytes, with a TTL
+    per entry. An optional MongoDB collection acts as a shared persistent
+    tier so every worker process benefits from the same answers; Mongo's TTL
+    index removes expired documents.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, ttl_seconds: int = 86400, collection=None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.collection = collection
+        self._entries = OrderedDict()  # key -> (expires_at, response, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._persistent_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        if self.collection is not None:
+            try:
+                self.collection.create_index([('expires_at', 1)], expireAfterSeconds=0)
+            except Exception as e:
+                print(f"Error creating response cache index: {str(e)}")
+
+    def make_key(self, prompt: str, model_name: str, scope: Optional[str] = None) -> str:
+        return prompt_key(prompt, model_name, scope)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, response, size = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return response
+                self._remove(key)
+
+        if self.collection is not None:
+            try:
+                doc = self.collection.find_one({'_id': key, 'expires_at': {'$gt': datetime.utcnow()}})
+            except Exception as e:
+                print(f"Error reading persistent response cache: {str(e)}")
+                doc = None
+            if doc:
+                self._store(key, doc['response'])
+                with self._lock:
+                    self._persistent_hits += 1
+                return doc['response']
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def set(self, key: str, response: str):
+        """Store a response in memory and, if configured, in MongoDB"""
+        self._store(key, response)
+        if self.collection is not None:
+            try:
+                self.collection.replace_one(
+                    {'_id': key},
+                    {'_id': key, 'response': response,
+                     'expires_at': datetime.utcnow() + timedelta(seconds=self.ttl_seconds)},
+                    upsert=True
+                )
+            except Exception as e:
+                print(f"Error writing persistent response cache: {str(e)}")
+
+    def _store(self, key: str, response: str):
+        size = len(key) + len(response.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + self.ttl_seconds, response, size)
+            self._bytes += size
+            # Evict least recently used entries until we fit the byte budget
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+    def _remove(self, key: str):
+        """Drop an entry; caller must hold the lock"""
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._persistent_hits + self._misses
+            return {
+                'hits': self._hits,
+                'persistent_hits': self._persistent_hits,
+                'misses': self._misses,
+                'hit_ratio': round((self._hits + self._persistent_hits) / lookups, 4) if lookups else 0,
+                'evictions': self._evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'persistent': self.collection is not None
+            }
@@ -0,0 +1,338 @@
+import html
+import math
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+
+from app.models.database import saved_time
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+_WORD = re.compile(r'[A-Za-z0-9]+')
+_SPACE = re.compile(r'\s+')
+
+# Words too common to help ranking; leaving them out keeps the postings small
+STOPWORDS = frozenset("""
+    a an and are as at be but by can do does for from has have how i if in into is it its
+    of on or so that the their then there these this to was we what when which will with you your
+""".split())
+
+MAX_FIELD = 0xFFFF  # term frequency and document length are packed into 16 bits each
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased alphanumeric terms without stopwords"""
+    return [term for term in _TOKEN.findall((text or '').lower()) if term not in STOPWORDS]
+
+
+def highlight(content: str, terms: Iterable[str], width: int = 200) -> str:
+    """
+    HTML-escaped excerpt of `content` around the densest run of query terms,
+    with each match wrapped in <mark>
+    """
+    terms = set(terms)
+    content = content or ''
+    matches = [m.span() for m in _WORD.finditer(content) if m.group().lower() in terms][:50]
+
+    start, anchor = 0, 0
+    if matches:
+        # Start shortly before the match that has the most other matches within the window
+        anchor = max(matches, key=lambda span: sum(1 for other in matches if span[0] <= other[0] < span[0] + width))[0]
+        start = max(0, min(anchor - width // 5, len(content) - width))
+    end = min(len(content), start + width)
+    if start > 0:
+        # Do not cut a word at either end
+        space = content.find(' ', start, anchor)
+        start = space + 1 if space != -1 else start
+    if end < len(content):
+        space = content.rfind(' ', start, end)
+        end = space if space > start else end
+
+    parts = ['…'] if start > 0 else []
+    position = start
+    for match_start, match_end in matches:
+        if match_start < start or match_end > end:
+            continue
+        parts.append(html.escape(_SPACE.sub(' ', content[position:match_start])))
+        parts.append(f"<mark>{html.escape(content[match_start:match_end])}</mark>")
+        position = match_end
+    parts.append(html.escape(_SPACE.sub(' ', content[position:end])))
+    if end < len(content):
+        parts.append('…')
+    return ''.join(parts).strip()
+
+
+class SearchIndex:
+    """
+    BM25 full-text search over message contents, scoped to one user.
+
+    Messages have no user_id, so each message is attributed to the owner of
+    its conversation. The index lives in this process: per term, one
+    array('I') of (doc, user, tf << 16 | length) triples, so a term's postings
+    are a single buffer that NumPy filters by user and scores without a
+    Python loop, and only the page of hits is read back from MongoDB for
+    titles and snippets.
+
+    `start()` builds it from MongoDB in a background thread; searches are
+    refused until it is `ready`. Afterwards a search first calls `refresh()`
+    when the last one is more than `refresh_interval` seconds old, which
+    indexes messages saved since the previous refresh minus `overlap` seconds
+    (by their saved_at, so messages that write-behind replays from its spill
+    log long after their _id was assigned are picked up too); ids seen
+    within that window are remembered so they are not indexed twice. Deletes made through this process apply immediately;
+    hits deleted by another process are dropped when their page is loaded.
+    Document frequencies and lengths are not reduced by deletes.
+    """
+
+    def __init__(self, db, refresh_interval: float = 5, overlap: float = 120, k1: float = 1.2, b: float = 0.75):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.overlap = overlap
+        self.k1 = k1
+        self.b = b
+        self.ready = False
+        self.error = None
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._postings: Dict[str, array] = {}
+        self._doc_ids = bytearray()  # 12-byte message ObjectIds, by doc number
+        self._doc_conversations = array('I')
+        self._doc_count = 0
+        self._total_length = 0
+        self._conversations: List[ObjectId] = []
+        self._conversation_index: Dict[ObjectId, int] = {}
+        self._conversation_users = array('I')
+        self._users: Dict[str, int] = {}
+        self._next_user = 0
+        self._dead_conversations = set()
+        self._dead_docs = set()
+        self._recent: Dict[ObjectId, float] = {}
+        self._refreshed_from = time.time()
+        self._last_refresh = 0.0
+
+    # Building and updating
+
+    def start(self):
+        """Build the index from MongoDB in a daemon thread"""
+        threading.Thread(target=self.build, name='search-index', daemon=True).start()
+
+    def build(self, batch_size: int = 1000):
+        """Index every conversation's messages; sets `ready` when done"""
+        self._refreshed_from = time.time()
+        self._last_refresh = time.monotonic()
+        try:
+            for conversation in self.db.conversations.find({}, {'user_id': 1}).batch_size(10000):
+                self._add_conversation(conversation['_id'], conversation.get('user_id'))
+            batch = []
+            projection = {'conversation_id': 1, 'content': 1, 'saved_at': 1}
+            for message in self.db.messages.find({}, projection).batch_size(batch_size):
+                batch.append(message)
+                if len(batch) >= batch_size:
+                    self._index_messages(batch)
+                    batch = []
+            self._index_messages(batch)
+            self.ready = True
+        except Exception as e:
+            print(f"Error building search index: {str(e)}")
+            self.error = str(e)
+
+    def refresh(self):
+        """Index messages written since the previous refresh (by any process)"""
+        if not self._refresh_lock.acquire(blocking=False):
+            return  # another request is already refreshing
+        try:
+            started = time.time()
+            since = self._refreshed_from - self.overlap
+            saved_since = datetime.fromtimestamp(since, timezone.utc).replace(tzinfo=None)
+            new_ids = [
+                message['_id'] for message in self.db.messages_saved_since(saved_since, {'_id': 1})
+                if message['_id'] not in self._recent
+            ]
+            if new_ids:
+                messages = list(self.db.messages.find({'_id': {'$in': new_ids}},
+                                                      {'conversation_id': 1, 'content': 1, 'saved_at': 1}))
+                unknown = list({m['conversation_id'] for m in messages} - self._conversation_index.keys())
+                if unknown:
+                    for conversation in self.db.conversations.find({'_id': {'$in': unknown}}, {'user_id': 1}):
+                        self._add_conversation(conversation['_id'], conversation.get('user_id'))
+                self._index_messages(messages)
+            with self._lock:
+                self._recent = {message_id: at for message_id, at in self._recent.items() if at >= since}
+            self._refreshed_from = started
+            self._last_refresh = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    def _add_conversation(self, conversation_id: ObjectId, user_id: Optional[str]):
+        with self._lock:
+            if conversation_id in self._conversation_index or user_id is None:
+                return
+            user = self._users.get(user_id)
+            if user is None:
+                user = self._users[user_id] = self._next_user
+                self._next_user += 1
+            self._conversation_index[conversation_id] = len(self._conversations)
+            self._conversations.append(conversation_id)
+            self._conversation_users.append(user)
+
+    def _index_messages(self, messages: List[Dict]):
+        """Add messages of known conversations; others are retried by the next refresh"""
+        recent_since = self._refreshed_from - self.overlap
+        with self._lock:
+            for message in messages:
+                if message['conversation_id'] not in self._conversation_index:
+                    continue  # orphaned, or its conversation is not written yet
+                self.add(message['_id'], message['conversation_id'], message.get('content'))
+                saved = saved_time(message)
+                if saved >= recent_since:
+                    self._recent[message['_id']] = saved
+
+    def add(self, message_id: ObjectId, conversation_id: ObjectId, content: str, user_id: Optional[str] = None):
+        """Index one message; `user_id` is only needed when its conversation is not indexed yet"""
+        with self._lock:
+            if user_id is not None:
+                self._add_conversation(conversation_id, user_id)
+            conversation = self._conversation_index[conversation_id]
+            user = self._conversation_users[conversation]
+            terms = Counter(tokenize(content))
+            doc = self._doc_count
+            length = min(sum(terms.values()), MAX_FIELD)
+            self._doc_ids += message_id.binary
+            self._doc_conversations.append(conversation)
+            self._doc_count += 1
+            self._total_length += length
+            for term, tf in terms.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = array('I')
+                postings.extend((doc, user, min(tf, MAX_FIELD) << 16 | length))
+
+    def remove_conversation(self, conversation_id: ObjectId):
+        """Stop returning a deleted conversation's messages"""
+        with self._lock:
+            conversation = self._conversation_index.get(conversation_id)
+            if conversation is not None:
+                self._dead_conversations.add(conversation)
+
+    def remove_user(self, user_id: str):
+        """Stop returning any of a user's current messages (delete-all); later ones are indexed afresh"""
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    # Querying
+
+    def rank(self, user_id: str, query: str, limit: int = 20, offset: int = 0) -> Tuple[List[Tuple[int, float]], int]:
+        """
+        The user's messages matching any query term, best BM25 score first.
+        Returns ([(doc, score)] for the requested page, total number of matches).
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None or not terms or not self._doc_count:
+                return [], 0
+            doc_count = self._doc_count
+            average_length = self._total_length / doc_count or 1
+            docs, scores = [], []
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                frequency = len(postings) // 3
+                idf = math.log(1 + (doc_count - frequency + 0.5) / (frequency + 0.5))
+                triples = np.frombuffer(postings, dtype=np.uint32).reshape(-1, 3)
+                try:
+                    mine = triples[triples[:, 1] == user]  # a copy, so the buffer can grow again
+                finally:
+                    del triples
+                tf = (mine[:, 2] >> 16).astype(np.float64)
+                length = (mine[:, 2] & MAX_FIELD).astype(np.float64)
+                docs.append(mine[:, 0].astype(np.int64))
+                scores.append(idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / average_length)))
+            if not docs:
+                return [], 0
+
+            unique_docs, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+            totals = np.bincount(inverse, weights=np.concatenate(scores))
+            if self._dead_conversations or self._dead_docs:
+                view = np.frombuffer(self._doc_conversations, dtype=np.uint32)
+                try:
+                    conversations = view[unique_docs]
+                finally:
+                    del view
+                alive = ~np.isin(conversations, list(self._dead_conversations)) & \
+                    ~np.isin(unique_docs, list(self._dead_docs))
+                unique_docs, totals = unique_docs[alive], totals[alive]
+
+        total = len(unique_docs)
+        wanted = min(offset + limit, total)
+        if wanted <= 0:
+            return [], total
+        candidates = np.argpartition(-totals, wanted - 1)[:wanted] if wanted < total else np.arange(total)
+        # Ties go to the newer message, so pages do not overlap
+        ordered = candidates[np.lexsort((-unique_docs[candidates], -totals[candidates]))]
+        page = ordered[offset:offset + limit]
+        return [(int(unique_docs[i]), float(totals[i])) for i in page], total
+
+    def _doc_keys(self, doc: int) -> Tuple[ObjectId, ObjectId]:
+        return (ObjectId(bytes(self._doc_ids[doc * 12:doc * 12 + 12])),
+                self._conversations[self._doc_conversations[doc]])
+
+    def search(self, user_id: str, query: str, limit: int = 20, offset: int = 0) -> Dict:
+        """
+        A page of the user's messages matching `query`, with their conversation
+        titles and highlighted snippets
+        """
+        if time.monotonic() - self._last_refresh >= self.refresh_interval:
+            self.refresh()
+        hits, total = self.rank(user_id, query, limit, offset)
+        with self._lock:
+            keys = [self._doc_keys(doc) for doc, _ in hits]
+
+        message_ids = [message_id for message_id, _ in keys]
+        messages = {
+            message['_id']: message for message in
+            self.db.messages.find({'_id': {'$in': message_ids}}, {'content': 1, 'role': 1, 'timestamp': 1})
+        }
+        titles = {
+            conversation['_id']: conversation.get('title') for conversation in
+            self.db.conversations.find({'_id': {'$in': list({c for _, c in keys})}}, {'title': 1})
+        }
+
+        terms = tokenize(query)
+        results = []
+        for (doc, score), (message_id, conversation_id) in zip(hits, keys):
+            message = messages.get(message_id)
+            if message is None or conversation_id not in titles:
+                with self._lock:
+                    self._dead_docs.add(doc)  # deleted by another process
+                continue
+            results.append({
+                'message_id': message_id,
+                'conversation_id': conversation_id,
+                'title': titles[conversation_id],
+                'role': message.get('role'),
+                'timestamp': message.get('timestamp'),
+                'score': round(score, 4),
+                'snippet': highlight(message.get('content'), terms)
+            })
+        return {
+            'results': results,
+            'total': total,
+            'next_offset': offset + limit if offset + limit < total else None
+        }
+
+    def stats(self) -> Dict:
+        return {
+            'ready': self.ready,
+            'messages': self._doc_count,
+            'terms': len(self._postings),
+            'conversations': len(self._conversations),
+            'error': self.error
+        }
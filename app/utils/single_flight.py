@@ -0,0 +1,232 @@
+import asyncio
+import contextvars
+import threading
+from typing import AsyncIterator, Awaitable, Callable, Iterator
+
+
+class _Call:
+    """One in-flight blocking call shared by every caller with the same key"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _SharedStream:
+    """
+    Buffer of chunks produced by one upstream iterator.
+
+    The upstream is drained by a background thread so a slow or disconnected
+    client cannot stall the others; every subscriber replays the buffer from
+    the start and then follows new chunks as they arrive.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def run(self, iterator: Iterator[str], on_finish: Callable[[], None]):
+        try:
+            for chunk in iterator:
+                with self.condition:
+                    self.chunks.append(chunk)
+                    self.condition.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            on_finish()
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    def subscribe(self) -> Iterator[str]:
+        position = 0
+        while True:
+            with self.condition:
+                while position >= len(self.chunks) and not self.done:
+                    self.condition.wait()
+                pending = self.chunks[position:]
+                position = len(self.chunks)
+                finished = self.done
+            for chunk in pending:
+                yield chunk
+            if finished and position >= len(self.chunks):
+                if self.error:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical work.
+
+    Callers that ask for a key while a call for that key is already running
+    wait for it and receive the same result (or exception) instead of starting
+    their own upstream request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self._executions = 0
+        self._coalesced = 0
+
+    def do(self, key: str, func: Callable[[], str]) -> str:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self._executions += 1
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stream(self, key: str, factory: Callable[[], Iterator[str]]) -> Iterator[str]:
+        """Attach to the in-flight stream for key, starting one from factory if there is none"""
+        with self._lock:
+            shared = self._streams.get(key)
+            if shared is None:
+                shared = _SharedStream()
+                self._streams[key] = shared
+                self._executions += 1
+                leader = True
+            else:
+                self._coalesced += 1
+                leader = False
+
+        if leader:
+            def finish():
+                with self._lock:
+                    self._streams.pop(key, None)
+
+            # The drain thread works for the leader's request, so it keeps its context (e.g. metrics labels)
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(shared.run, factory(), finish), daemon=True).start()
+        return shared.subscribe()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'executions': self._executions,
+                'coalesced': self._coalesced,
+                'in_flight': len(self._calls) + len(self._streams)
+            }
+
+
+class _AsyncSharedStream:
+    """
+    asyncio version of _SharedStream: a task drains the upstream async
+    iterator into the buffer, and every subscriber replays it from the start
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.condition = asyncio.Condition()
+
+    async def run(self, iterator: AsyncIterator[str]):
+        try:
+            async for chunk in iterator:
+                async with self.condition:
+                    self.chunks.append(chunk)
+                    self.condition.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            async with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        position = 0
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(lambda: position < len(self.chunks) or self.done)
+                pending = self.chunks[position:]
+                position = len(self.chunks)
+                finished = self.done
+            for chunk in pending:
+                yield chunk
+            if finished and position >= len(self.chunks):
+                if self.error:
+                    raise self.error
+                return
+
+
+class AsyncSingleFlight:
+    """
+    asyncio version of SingleFlight for the async backend.
+
+    The shared generation runs in its own task rather than in the first
+    caller's coroutine, so when any one caller is cancelled (e.g. its client
+    disconnected) the others still get the result.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self._streams = {}
+        self._executions = 0
+        self._coalesced = 0
+
+    async def do(self, key: str, coroutine_factory: Callable[[], Awaitable]):
+        task = self._tasks.get(key)
+        # A finished task may wait a moment for its done callback; it is not in flight any more
+        if task is None or task.done():
+            task = asyncio.ensure_future(coroutine_factory())
+            self._tasks[key] = task
+            self._executions += 1
+            task.add_done_callback(lambda done: self._finished(self._tasks, key, done, done))
+        else:
+            self._coalesced += 1
+        return await asyncio.shield(task)
+
+    def stream(self, key: str, factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Attach to the in-flight stream for key, starting one from factory if there is none"""
+        shared = self._streams.get(key)
+        if shared is None or shared.done:
+            shared = _AsyncSharedStream()
+            self._streams[key] = shared
+            self._executions += 1
+            task = asyncio.ensure_future(shared.run(factory()))
+            task.add_done_callback(lambda done: self._finished(self._streams, key, shared, done))
+        else:
+            self._coalesced += 1
+        return shared.subscribe()
+
+    @staticmethod
+    def _finished(flights: dict, key: str, flight, task: asyncio.Future):
+        if flights.get(key) is flight:
+            del flights[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved when every caller had gone away
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            'executions': self._executions,
+            'coalesced': self._coalesced,
+            'in_flight': len(self._tasks) + len(self._streams)
+        }
@@ -0,0 +1,224 @@
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+
+from .write_behind import WriteBehindQueue
+
+
+class TurnWriter:
+    """
+    Persists chat turns without making the response wait for MongoDB.
+
+    With write-behind enabled, _ids are assigned up front. A new
+    conversation is inserted before returning, so a follow-up turn routed to
+    any worker process finds it; the rest of the turn (both messages, user
+    upsert, updated_at and usage counters) goes through a bounded queue
+    applied in batches by a background thread, coalesced per user and
+    conversation. Each turn is one queued operation, so it is queued,
+    spilled and replayed whole. When the queue is full or MongoDB is
+    unreachable, turns are spilled to an append-only log in `spill_dir` and
+    replayed on recovery; while writes are failing, new conversations are
+    queued too and this process remembers them until they are written (later
+    turns of such a conversation carry it along). Every write in a turn is
+    safe to repeat: inserts skip documents that already exist and usage is
+    counted once per turn, so a batch that is retried or replayed twice
+    changes nothing.
+
+    Without write-behind, the turn is applied before returning.
+    """
+
+    def __init__(self, db, usage_stats, write_behind: bool = True, queue_size: int = 10000,
+                 batch_size: int = 100, spill_dir: Optional[str] = None):
+        self.db = db
+        self.usage_stats = usage_stats
+        # New conversations queued while MongoDB was failing, so follow-up turns here can find them
+        self._pending_conversations = {}
+        self._pending_lock = threading.Lock()
+        self.queue = None
+        if write_behind:
+            self.queue = WriteBehindQueue(self._apply, max_size=queue_size, batch_size=batch_size, spill_dir=spill_dir)
+
+    def commit_turn(self, user_id: str, conversation_id: Optional[ObjectId], user_message: str,
+                    response_text: str, title: str = None) -> ObjectId:
+        """
+        Save one user/assistant exchange. Creates the conversation when
+        conversation_id is None and returns the conversation id.
+        """
+        now = datetime.utcnow()
+        conversations = []
+        new_conversations = []
+        if not conversation_id:
+            conversation = {
+                '_id': ObjectId(),
+                'user_id': user_id,
+                'title': title,
+                'created_at': now,
+                'updated_at': now
+            }
+            conversations = self._create_conversations([conversation])
+            conversation_id = conversation['_id']
+            new_conversations.append(now)
+        else:
+            conversation_id = ObjectId(conversation_id)
+            pending = self.pending_conversation(conversation_id)
+            if pending is not None:
+                # Written with this turn too, in case the turn that created it is applied later
+                conversations.append(pending)
+
+        # Increasing _ids order the two messages on equal timestamps
+        messages = [
+            {'_id': ObjectId(), 'conversation_id': conversation_id, 'role': 'user', 'content': user_message, 'timestamp': now},
+            {'_id': ObjectId(), 'conversation_id': conversation_id, 'role': 'assistant', 'content': response_text, 'timestamp': now}
+        ]
+        self._defer({
+            'op': 'turn',
+            'user_id': user_id,
+            'created_at': now,
+            'conversations': conversations,
+            'messages': messages,
+            'touch_conversation': conversation_id,
+            'new_conversations': new_conversations
+        })
+        return conversation_id
+
+    def commit_turns(self, user_id: str, turns: List[Dict]) -> List[ObjectId]:
+        """
+        Save many standalone exchanges of one user, each in a new conversation,
+        with one insert for all the conversations and one for all the messages.
+        Each turn has user_message, response_text, title and optionally a
+        conversation_id assigned up front. Returns the conversation ids.
+        """
+        now = datetime.utcnow()
+        conversations = []
+        messages = []
+        for turn in turns:
+            conversation = {
+                '_id': turn.get('conversation_id') or ObjectId(),
+                'user_id': user_id,
+                'title': turn['title'],
+                'created_at': now,
+                'updated_at': now
+            }
+            conversations.append(conversation)
+            messages += [
+                {'_id': ObjectId(), 'conversation_id': conversation['_id'], 'role': 'user',
+                 'content': turn['user_message'], 'timestamp': now},
+                {'_id': ObjectId(), 'conversation_id': conversation['_id'], 'role': 'assistant',
+                 'content': turn['response_text'], 'timestamp': now}
+            ]
+        if not conversations:
+            return []
+
+        self._defer({
+            'op': 'turn',
+            'user_id': user_id,
+            'created_at': now,
+            'conversations': self._create_conversations(conversations),
+            'messages': messages,
+            'touch_conversation': None,
+            'new_conversations': [now] * len(conversations)
+        })
+        return [conversation['_id'] for conversation in conversations]
+
+    def _create_conversations(self, conversations: List[Dict]) -> List[Dict]:
+        """
+        Insert new conversations now; returns the ones to write with the turn
+        instead: all of them without write-behind, and while MongoDB is failing,
+        when they are remembered until they are written
+        """
+        if self.queue is None:
+            return conversations
+        if self.queue.healthy:
+            try:
+                self.db.save_conversations(conversations)
+                return []
+            except Exception as e:
+                print(f"Error creating conversations, deferring them: {str(e)}")
+        with self._pending_lock:
+            for conversation in conversations:
+                self._pending_conversations[conversation['_id']] = conversation
+        return conversations
+
+    def pending_conversation(self, conversation_id: ObjectId) -> Optional[Dict]:
+        """A conversation created while MongoDB was failing that has not been written yet, or None"""
+        with self._pending_lock:
+            return self._pending_conversations.get(conversation_id)
+
+    def _defer(self, op: Dict):
+        if self.queue is None:
+            self._apply([op])
+        else:
+            self.queue.submit(op)
+
+    def _apply(self, ops: List[Dict]):
+        """
+        Apply a batch of deferred turns: inserts first, then one write per
+        user and conversation, and the usage counters last.
+        """
+        conversations = []
+        messages = []
+        users = {}
+        touched = {}
+        usage = []
+        for op in ops:
+            if op['op'] == 'turn':
+                conversations.extend(op['conversations'])
+                messages.extend(op['messages'])
+                users.setdefault(op['user_id'], op['created_at'])
+                if op['touch_conversation'] is not None:
+                    previous = touched.get(op['touch_conversation'])
+                    if previous is None or op['created_at'] > previous:
+                        touched[op['touch_conversation']] = op['created_at']
+                usage.append((op['user_id'], op['new_conversations'], op['messages']))
+            # Single writes, as spilled by earlier versions
+            elif op['op'] == 'create_conversation':
+                conversations.append(op['conversation'])
+            elif op['op'] == 'insert_messages':
+                messages.extend(op['messages'])
+            elif op['op'] == 'ensure_user':
+                users.setdefault(op['user_id'], op['created_at'])
+            elif op['op'] == 'touch_conversation':
+                previous = touched.get(op['conversation_id'])
+                if previous is None or op['updated_at'] > previous:
+                    touched[op['conversation_id']] = op['updated_at']
+            elif op['op'] == 'usage':
+                usage.append((op['user_id'], op['conversations'], op['messages']))
+
+        if conversations:
+            # A conversation carried by several turns is inserted once
+            conversations = list({conversation['_id']: conversation for conversation in conversations}.values())
+            self.db.save_conversations(conversations)
+            with self._pending_lock:
+                for conversation in conversations:
+                    self._pending_conversations.pop(conversation['_id'], None)
+        if messages:
+            self.db.save_messages(messages)
+        for user_id, created_at in users.items():
+            self.db.ensure_user(user_id, created_at)
+        for conversation_id, updated_at in touched.items():
+            self.db.touch_conversation(conversation_id, updated_at)
+        if usage:
+            self.usage_stats.record_batch(usage)
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait for deferred writes to be applied or spilled"""
+        return self.queue.flush(timeout) if self.queue else True
+
+    def replay(self) -> bool:
+        """Apply spilled writes now; True when none are left"""
+        return self.queue.replay() if self.queue else True
+
+    def close(self, timeout: float = 10):
+        """Flush deferred writes and stop the background worker"""
+        if self.queue:
+            self.queue.close(timeout)
+
+    def stats(self) -> dict:
+        if not self.queue:
+            return {'write_behind': False}
+        stats = self.queue.stats()
+        with self._pending_lock:
+            stats['pending_conversations'] = len(self._pending_conversations)
+        return stats
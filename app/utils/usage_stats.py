@@ -0,0 +1,187 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+# Entries remembered per user and day, to skip ones that are applied again
+COUNTED_KEYS = 1000
+
+
+def _empty_day(user_id: str, day: str) -> Dict:
+    return {
+        'user_id': user_id,
+        'day': day,
+        'conversations': 0,
+        'messages': 0,
+        'content_length': 0,
+        'roles': {'user': 0, 'assistant': 0},
+        'hours': {}
+    }
+
+
+class UsageStatsService:
+    """
+    Incrementally maintained per-user usage counters.
+
+    One document per user and UTC day in `usage_daily` holds conversation and
+    message counts, total content length, per-role counts and per-hour
+    buckets. Writes are a single upserted $inc per day touched, and
+    /api/usage reads O(days) small documents instead of every message.
+
+    Counting saved messages is idempotent: the first message _id of each
+    entry is pushed to the day's `counted` list (the last COUNTED_KEYS) in
+    the same update as the $inc, which only matches while the list does not
+    hold it, so a write-behind batch that is retried or replayed after a
+    partial failure is not counted twice.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = db.db['usage_daily']
+        try:
+            self.collection.create_index([('user_id', 1), ('day', 1)], unique=True)
+        except Exception as e:
+            print(f"Error creating usage index: {str(e)}")
+
+    @staticmethod
+    def _bucket(timestamp: datetime):
+        return timestamp.strftime('%Y-%m-%d'), str(timestamp.hour)
+
+    def record(self, user_id: str, conversations: Iterable[datetime] = (), messages: Iterable[Dict] = ()):
+        """
+        Count new conversations (by created_at) and messages (dicts with role,
+        content and timestamp) for a user.
+        """
+        self.record_batch([(user_id, conversations, messages)])
+
+    def _increments(self, entries: Iterable[Tuple[str, Iterable[datetime], Iterable[Dict]]],
+                    sign: int = 1) -> Dict[Tuple[str, str], Dict[str, int]]:
+        """The $inc document for each (user_id, day) touched by the entries"""
+        increments = defaultdict(lambda: defaultdict(int))
+        for user_id, conversations, messages in entries:
+            for created_at in conversations:
+                day, hour = self._bucket(created_at)
+                inc = increments[(user_id, day)]
+                inc['conversations'] += sign
+                inc[f'hours.{hour}.conversations'] += sign
+            for message in messages:
+                day, hour = self._bucket(message['timestamp'])
+                inc = increments[(user_id, day)]
+                inc['messages'] += sign
+                inc['content_length'] += sign * len(message.get('content') or '')
+                inc[f"roles.{message.get('role')}"] += sign
+                inc[f'hours.{hour}.messages'] += sign
+        return increments
+
+    def record_batch(self, entries: Iterable[Tuple[str, Iterable[datetime], Iterable[Dict]]]):
+        """
+        record() for many (user_id, conversations, messages) entries at once,
+        with one upsert per user and day touched. Entries whose messages have
+        _ids are counted once, however often they are recorded.
+        """
+        plain = []
+        keyed = defaultdict(list)
+        for user_id, conversations, messages in entries:
+            messages = list(messages)
+            key = messages[0].get('_id') if messages else None
+            if key is None:
+                plain.append((user_id, conversations, messages))
+                continue
+            for (_, day), inc in self._increments([(user_id, conversations, messages)]).items():
+                keyed[(user_id, day)].append((key, inc))
+
+        for (user_id, day), inc in self._increments(plain).items():
+            self.collection.update_one(
+                {'user_id': user_id, 'day': day},
+                {'$inc': dict(inc)},
+                upsert=True
+            )
+        for (user_id, day), counts in keyed.items():
+            try:
+                self._count_once(user_id, day, counts, upsert=True)
+            except DuplicateKeyError:
+                # The day already counted some of the entries, or another writer just created it
+                for entry in counts:
+                    self._count_once(user_id, day, [entry], upsert=False)
+
+    def _count_once(self, user_id: str, day: str, counts: List[Tuple[object, Dict[str, int]]], upsert: bool):
+        """Apply (key, increments) entries to a day in one update, unless it counted any of the keys"""
+        total = defaultdict(int)
+        for _, inc in counts:
+            for field, value in inc.items():
+                total[field] += value
+        keys = [key for key, _ in counts]
+        # When the day exists but counted a key, the upsert's insert fails on the unique (user_id, day) index
+        self.collection.update_one(
+            {'user_id': user_id, 'day': day, 'counted': {'$nin': keys}},
+            {'$inc': dict(total), '$push': {'counted': {'$each': keys, '$slice': -COUNTED_KEYS}}},
+            upsert=upsert
+        )
+
+    def forget(self, user_id: str, conversations: Iterable[datetime] = (), messages: Iterable[Dict] = ()):
+        """
+        Subtract deleted conversations and messages that record() counted;
+        days left with nothing are removed, as rebuild() would not write them
+        """
+        conversations = [created_at for created_at in conversations if isinstance(created_at, datetime)]
+        messages = [message for message in messages if isinstance(message.get('timestamp'), datetime)]
+        increments = self._increments([(user_id, conversations, messages)], sign=-1)
+        for (_, day), inc in increments.items():
+            self.collection.update_one({'user_id': user_id, 'day': day}, {'$inc': dict(inc)})
+        if increments:
+            self.collection.delete_many({
+                'user_id': user_id,
+                'day': {'$in': [day for _, day in increments]},
+                'conversations': {'$lte': 0},
+                'messages': {'$lte': 0}
+            })
+
+    def get_days(self, user_id: str) -> List[Dict]:
+        """All daily counter documents for a user, oldest first"""
+        return list(self.collection.find({'user_id': user_id}, {'_id': 0, 'counted': 0}).sort('day', 1))
+
+    def rebuild(self, user_id: Optional[str] = None, batch_size: int = 1000) -> int:
+        """
+        Recompute the counters from the conversations and messages collections,
+        for one user or everyone. Returns the number of daily documents written.
+        """
+        conversation_filter = {'user_id': user_id} if user_id else {}
+        days = {}
+        owners = {}
+
+        def day_doc(owner, timestamp):
+            day, hour = self._bucket(timestamp)
+            doc = days.get((owner, day))
+            if doc is None:
+                doc = days[(owner, day)] = _empty_day(owner, day)
+            return doc, doc['hours'].setdefault(hour, {'conversations': 0, 'messages': 0})
+
+        for conv in self.db.conversations.find(conversation_filter, {'user_id': 1, 'created_at': 1}):
+            owners[conv['_id']] = conv['user_id']
+            if isinstance(conv.get('created_at'), datetime):
+                doc, hour = day_doc(conv['user_id'], conv['created_at'])
+                doc['conversations'] += 1
+                hour['conversations'] += 1
+
+        conversation_ids = list(owners)
+        for start in range(0, len(conversation_ids), batch_size):
+            batch = conversation_ids[start:start + batch_size]
+            cursor = self.db.messages.find(
+                {'conversation_id': {'$in': batch}},
+                {'conversation_id': 1, 'role': 1, 'content': 1, 'timestamp': 1}
+            )
+            for msg in cursor:
+                if not isinstance(msg.get('timestamp'), datetime):
+                    continue
+                doc, hour = day_doc(owners[msg['conversation_id']], msg['timestamp'])
+                doc['messages'] += 1
+                doc['content_length'] += len(msg.get('content') or '')
+                doc['roles'][msg.get('role')] = doc['roles'].get(msg.get('role'), 0) + 1
+                hour['messages'] += 1
+
+        self.collection.delete_many(conversation_filter)
+        documents = list(days.values())
+        for start in range(0, len(documents), batch_size):
+            self.collection.insert_many(documents[start:start + batch_size], ordered=False)
+        return len(documents)
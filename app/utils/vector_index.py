@@ -0,0 +1,429 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+
+from app.models.database import saved_time
+
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+_SIGN_BIT = np.uint64(1 << 40)
+_SCALE = 127.0  # unit vectors are stored as int8 components times this
+
+META_FILE = 'meta.json'
+LOCK_FILE = 'writer.lock'
+
+
+def owner_key(user_id: str) -> int:
+    """Stable 64-bit key of a user id, stored per row instead of the id itself"""
+    return int.from_bytes(hashlib.blake2b(user_id.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+class HashingVectorizer:
+    """
+    Embeds text locally, without a model or network access.
+
+    Character 3- to 5-grams of the lowercased, whitespace-collapsed text are
+    hashed into `dim` buckets with a hashed sign, counts are damped with
+    log1p and the vector is L2-normalized, so a dot product is the cosine
+    similarity. Paraphrases share most of their n-grams even when words are
+    reordered or inflected. The hash is fixed, so vectors stay comparable
+    across processes and restarts.
+    """
+
+    def __init__(self, dim: int = 256, ngrams: Tuple[int, ...] = (3, 4, 5)):
+        self.dim = dim
+        self.ngrams = tuple(sorted(ngrams))
+
+    def transform(self, text: str) -> np.ndarray:
+        return self.transform_many([text])[0]
+
+    def transform_many(self, texts: List[str]) -> np.ndarray:
+        """One row per text; all texts are hashed in a few array operations"""
+        normalized = [(' ' + ' '.join((text or '').lower().split()) + ' ').encode('utf-8') for text in texts]
+        data = np.frombuffer(b''.join(normalized), dtype=np.uint8).astype(np.uint64)
+        lengths = np.fromiter((len(text) for text in normalized), dtype=np.int64, count=len(normalized))
+        rows = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+
+        # Polynomial hash of every n-gram, extended one byte at a time from 1-grams
+        buckets, signs = [], []
+        hashes = data
+        for n in range(2, self.ngrams[-1] + 1):
+            hashes = hashes[:-1] * np.uint64(257) + data[n - 1:]
+            if n not in self.ngrams:
+                continue
+            within = rows[:len(hashes)] == rows[n - 1:]  # skip n-grams spanning two texts
+            mixed = (hashes[within] + np.uint64(n)) * _MIX
+            mixed ^= mixed >> np.uint64(29)
+            buckets.append(rows[:len(hashes)][within] * self.dim + (mixed % np.uint64(self.dim)).astype(np.int64))
+            signs.append(np.where(mixed & _SIGN_BIT, 1.0, -1.0))
+
+        counts = np.bincount(np.concatenate(buckets), weights=np.concatenate(signs),
+                             minlength=len(texts) * self.dim).reshape(len(texts), self.dim)
+        vectors = (np.sign(counts) * np.log1p(np.abs(counts))).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+
+class QuestionIndex:
+    """
+    Nearest past questions, for "similar questions" and related context.
+
+    Each row is one answered turn: the vector of the user's question, the
+    _ids of the question and its answer, and a hash of the conversation
+    owner. Rows live in memory-mapped files under `directory` (vectors as
+    int8), so a restart maps them instead of re-embedding every message.
+
+    One process at a time is the writer (it holds an flock on writer.lock):
+    every `refresh_interval` seconds it embeds turns written to MongoDB
+    since the last refresh, by any process (by saved_at, so turns replayed
+    from the write-behind spill log are included), and appends them. Other
+    processes map the same files read-only and pick up new rows when
+    meta.json changes; one of them takes over if the writer exits.
+
+    Searches are exact, over the asking user's rows only, so one user's
+    questions never surface for another. Deleted turns are not removed from
+    the files; they are skipped when their messages are loaded.
+
+    meta.json records which database the rows came from (its name and
+    first message _id). When the writer finds the directory was built from
+    another database, or the oldest message has since been deleted, it
+    starts over instead of trusting the stored watermark.
+    """
+
+    def __init__(self, db, directory: str, dim: int = 256, refresh_interval: float = 5, overlap: float = 120,
+                 initial_capacity: int = 65536):
+        self.db = db
+        self.directory = directory
+        self.vectorizer = HashingVectorizer(dim)
+        self.dim = dim
+        self.refresh_interval = refresh_interval
+        self.overlap = overlap
+        self.initial_capacity = initial_capacity
+        self.ready = False
+        self.writer = False
+        self.error = None
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_file = None
+        self._meta_mtime = None
+        self._count = 0
+        self._capacity = 0
+        self._watermark = 0.0
+        self._source = None
+        self._vectors = self._keys = self._owners = None
+        self._recent: Dict[ObjectId, float] = {}
+        self._waiting: Dict[ObjectId, Dict] = {}  # conversation_id -> question still without an answer
+
+    # Files
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _files(self):
+        return (('vectors.i8', np.int8, (self.dim,)), ('keys.u8', np.uint8, (24,)), ('owners.i64', np.int64, ()))
+
+    def _map(self, capacity: int):
+        """(Re)map the row files at `capacity` rows; the writer grows them first"""
+        mode = 'r+' if self.writer else 'r'
+        maps = []
+        for name, dtype, shape in self._files():
+            path = self._path(name)
+            if self.writer:
+                size = capacity * int(np.prod(shape, dtype=np.int64) or 1) * np.dtype(dtype).itemsize
+                with open(path, 'ab') as f:
+                    if f.tell() < size:
+                        f.truncate(size)
+            maps.append(np.memmap(path, dtype=dtype, mode=mode, shape=(capacity,) + shape))
+        self._vectors, self._keys, self._owners = maps
+        self._capacity = capacity
+
+    def _read_meta(self) -> Optional[Dict]:
+        try:
+            with open(self._path(META_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self):
+        for mapped in (self._vectors, self._keys, self._owners):
+            mapped.flush()
+        meta = {'dim': self.dim, 'count': self._count, 'capacity': self._capacity,
+                'watermark': self._watermark, 'source': self._source}
+        tmp = self._path(META_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._path(META_FILE))
+
+    def _db_source(self) -> Optional[Dict]:
+        """Identity of the indexed database: its name and first message _id"""
+        if self.db is None:
+            return None
+        first = self.db.messages.find_one({}, {'_id': 1}, sort=[('_id', 1)])
+        return {'database': self.db.db.name, 'first_message': str(first['_id']) if first else None}
+
+    def _load(self):
+        """Map the files described by meta.json, or start empty files as the writer"""
+        meta = self._read_meta()
+        if meta and meta['dim'] != self.dim:
+            if not self.writer:
+                raise RuntimeError(f"index in {self.directory} has dim {meta['dim']}, expected {self.dim}")
+            print(f"Rebuilding question index: dim changed from {meta['dim']} to {self.dim}")
+            meta = None
+        if self.writer:
+            self._source = self._db_source()
+            if meta and meta.get('source') != self._source:
+                print(f"Rebuilding question index: {self.directory} was built from another database "
+                      f"({meta.get('source')}, now {self._source})")
+                meta = None
+        with self._lock:
+            if meta is None:
+                if not self.writer:
+                    return  # wait for the writer to create it
+                self._count, self._watermark = 0, 0.0
+                self._map(self.initial_capacity)
+                self._write_meta()
+            else:
+                self._count, self._watermark = meta['count'], meta['watermark']
+                self._source = meta.get('source')
+                self._map(meta['capacity'])
+            self._meta_mtime = os.stat(self._path(META_FILE)).st_mtime_ns
+            if self.writer:
+                self._recover_recent()
+            self.ready = True
+
+    def _sync(self):
+        """Pick up rows the writer appended since the last look at meta.json"""
+        try:
+            mtime = os.stat(self._path(META_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._meta_mtime:
+            return
+        if not self.ready:
+            self._load()
+            return
+        meta = self._read_meta()
+        with self._lock:
+            if meta['capacity'] != self._capacity:
+                self._map(meta['capacity'])
+            self._count = meta['count']
+            self._meta_mtime = mtime
+
+    # Background work
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='question-index', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                if not self.writer and self._try_become_writer():
+                    self._load()
+                if self.writer:
+                    self.refresh()
+                else:
+                    self._sync()
+                self.error = None
+            except Exception as e:
+                print(f"Error updating question index: {str(e)}")
+                self.error = str(e)
+            if self._stop.wait(self.refresh_interval):
+                return
+
+    def _try_become_writer(self) -> bool:
+        lock_file = open(self._path(LOCK_FILE), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self.writer = True
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._lock_file is not None:
+            self._lock_file.close()  # releases the flock
+            self._lock_file = None
+
+    def _recover_recent(self):
+        """
+        Question ids of the newest rows, so the refresh overlap does not add
+        them twice. Rows are in saved order, not _id order (a replayed turn
+        keeps its old _id), so the whole tail is checked rather than stopping
+        at the first older row; a replayed turn may still be added again,
+        and similar_turns skips such duplicates.
+        """
+        since = self._watermark - self.overlap
+        keys = np.asarray(self._keys[max(0, self._count - 100000):self._count, :12])
+        # An ObjectId starts with its creation time in seconds, big-endian
+        created = keys[:, :4].copy().view('>u4').ravel()
+        for row in np.flatnonzero(created >= since):
+            self._recent[ObjectId(bytes(keys[row]))] = float(created[row])
+
+    def refresh(self, batch_size: int = 1000):
+        """
+        Embed turns answered since the last refresh. Messages are read in the
+        order they were saved and each question is paired with the next answer
+        in its conversation; the first refresh of an empty index reads them all.
+        """
+        started = time.time()
+        since = self._watermark - self.overlap
+        projection = {'conversation_id': 1, 'role': 1, 'content': 1, 'saved_at': 1}
+        if self._watermark:
+            saved_since = datetime.fromtimestamp(since, timezone.utc).replace(tzinfo=None)
+            cursor = self.db.messages_saved_since(saved_since, projection)
+        else:
+            cursor = self.db.messages.find({}, projection).sort('_id', 1)
+        turns = []
+        for message in cursor.batch_size(batch_size):
+            if message.get('role') == 'user':
+                self._waiting[message['conversation_id']] = message
+                continue
+            question = self._waiting.pop(message['conversation_id'], None)
+            if question is not None and question['_id'] not in self._recent:
+                turns.append((question, message))
+            if len(turns) >= batch_size:
+                self._add_turns(turns)
+                turns = []
+        self._add_turns(turns)
+
+        # A question answered after this refresh is read again by the next one
+        self._waiting = {
+            conversation_id: question for conversation_id, question in self._waiting.items()
+            if saved_time(question) >= started - self.overlap
+        }
+        if self._source is not None and self._source['first_message'] is None:
+            self._source = self._db_source()  # started on an empty database
+        with self._lock:
+            self._recent = {question_id: at for question_id, at in self._recent.items() if at >= since}
+            self._watermark = started
+            self._write_meta()
+
+    def _add_turns(self, turns: List[Tuple[Dict, Dict]]):
+        if not turns:
+            return
+        conversation_ids = list({question['conversation_id'] for question, _ in turns})
+        owners = {
+            conversation['_id']: owner_key(conversation['user_id']) for conversation in
+            self.db.conversations.find({'_id': {'$in': conversation_ids}}, {'user_id': 1})
+            if conversation.get('user_id') is not None
+        }
+        turns = [(question, answer) for question, answer in turns if question['conversation_id'] in owners]
+        if not turns:
+            return  # orphaned messages
+        vectors = self.vectorizer.transform_many([question.get('content') for question, _ in turns])
+        keys = np.frombuffer(b''.join(question['_id'].binary + answer['_id'].binary for question, answer in turns),
+                             dtype=np.uint8).reshape(-1, 24)
+        self._append(vectors, keys, np.array([owners[question['conversation_id']] for question, _ in turns]))
+        for question, _ in turns:
+            self._recent[question['_id']] = saved_time(question)
+
+    def _append(self, vectors: np.ndarray, keys: np.ndarray, owners: np.ndarray):
+        with self._lock:
+            start, end = self._count, self._count + len(vectors)
+            if end > self._capacity:
+                capacity = self._capacity
+                while capacity < end:
+                    capacity *= 2
+                self._map(capacity)
+            self._vectors[start:end] = np.round(vectors * _SCALE)
+            self._keys[start:end] = keys
+            self._owners[start:end] = owners
+            self._count = end
+
+    # Queries
+
+    def search(self, text: str, k: int = 5, user_id: Optional[str] = None) -> List[Tuple[ObjectId, ObjectId, float]]:
+        """
+        The k rows closest to `text` as (question_id, answer_id, cosine similarity),
+        among the user's own questions when `user_id` is given, otherwise among
+        everyone's (a full scan, for offline use; the app always passes the user)
+        """
+        query = self.vectorizer.transform(text)
+        with self._lock:
+            count = self._count
+            if not self.ready or not count or not query.any():
+                return []
+            if user_id is not None:
+                rows = np.flatnonzero(np.asarray(self._owners[:count]) == owner_key(user_id))
+            else:
+                rows = np.arange(count)
+            if not len(rows):
+                return []
+            scores = self._vectors[rows].astype(np.float32) @ query / _SCALE
+            top = np.argpartition(-scores, min(k, len(rows)) - 1)[:k] if len(rows) > k else np.arange(len(rows))
+            top = top[np.argsort(-scores[top])]
+            keys = self._keys[rows[top]]
+        return [(ObjectId(bytes(key[:12])), ObjectId(bytes(key[12:])), float(score))
+                for key, score in zip(keys, scores[top])]
+
+    def similar_turns(self, text: str, k: int = 5, user_id: Optional[str] = None, min_score: float = 0.0) -> List[Dict]:
+        """Closest past turns with their question and answer text; deleted ones are skipped"""
+        hits = [hit for hit in self.search(text, k=2 * k, user_id=user_id) if hit[2] >= min_score]
+        if not hits:
+            return []
+        ids = [question_id for question_id, _, _ in hits] + [answer_id for _, answer_id, _ in hits]
+        messages = {
+            message['_id']: message for message in
+            self.db.messages.find({'_id': {'$in': ids}}, {'conversation_id': 1, 'content': 1, 'timestamp': 1})
+        }
+        turns = []
+        seen = set()
+        for question_id, answer_id, score in hits:
+            question, answer = messages.get(question_id), messages.get(answer_id)
+            if question is None or answer is None or question_id in seen:
+                continue
+            seen.add(question_id)
+            turns.append({
+                'question_id': question_id,
+                'answer_id': answer_id,
+                'conversation_id': question['conversation_id'],
+                'question': question.get('content'),
+                'answer': answer.get('content'),
+                'timestamp': question.get('timestamp'),
+                'score': round(score, 4)
+            })
+            if len(turns) == k:
+                break
+        return turns
+
+    def related_context(self, user_input: str, user_id: Optional[str], min_score: float = 0.7,
+                        max_tokens: int = 400) -> List[Dict]:
+        """
+        Context messages for ChatService: the answer to the most similar
+        question the same user asked before, trimmed to about `max_tokens`.
+        Only the user's own rows are searched, so one user's conversations
+        never reach another user's prompt.
+        """
+        turns = self.similar_turns(user_input, k=1, user_id=user_id or 'default_user', min_score=min_score)
+        if not turns:
+            return []
+        answer = turns[0]['answer'] or ''
+        if len(answer) > max_tokens * 4:
+            answer = answer[:max_tokens * 4].rsplit(' ', 1)[0] + ' …'
+        return [{
+            'role': 'system',
+            'content': f"A similar question answered before:\nQuestion: {turns[0]['question']}\nAnswer: {answer}"
+        }]
+
+    def stats(self) -> Dict:
+        return {
+            'ready': self.ready,
+            'writer': self.writer,
+            'rows': self._count,
+            'error': self.error
+        }
@@ -0,0 +1,243 @@
+import glob
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from bson import json_util
+from bson.json_util import CANONICAL_JSON_OPTIONS
+
+# Round-trips ObjectIds and (naive UTC) datetimes through the spill log
+_SPILL_JSON = CANONICAL_JSON_OPTIONS.with_options(tz_aware=False)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class WriteBehindQueue:
+    """
+    Bounded queue of deferred writes applied in batches by a background thread.
+
+    Operations are plain dicts handed to `handler(batch)`; they should be
+    idempotent, since a batch may be applied again after a partial failure.
+    A failed batch is retried with backoff. An operation is queued, spilled
+    and replayed whole, but separate operations may be applied out of order
+    when some of them are spilled, so writes that belong together should be
+    submitted as one operation. flush() waits for everything
+    queued so far; close() flushes and stops the worker.
+
+    Without `spill_dir`, a full queue makes the caller apply its operation
+    inline and a batch that keeps failing is dropped. With `spill_dir`, both
+    cases append the operations to a local log instead (one JSON line each,
+    fsynced), which the worker replays once writes succeed again, and on
+    the next start if the process died first. Each process appends to its
+    own spill-<pid>.log; logs of dead processes are adopted on replay.
+    """
+
+    def __init__(self, handler: Callable[[List[Dict]], None], max_size: int = 10000,
+                 batch_size: int = 100, max_retries: int = 3, retry_delay: float = 0.5,
+                 spill_dir: Optional[str] = None, replay_interval: float = 5.0):
+        self.handler = handler
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.spill_dir = spill_dir
+        self.replay_interval = replay_interval
+        self._queue = queue.Queue(maxsize=max_size)
+        self._closed = False
+        self._healthy = True
+        self._in_flight = None
+        self._spill_lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._spill_pending = False
+        self._last_replay = 0.0
+        self._submitted = 0
+        self._inline = 0
+        self._batches = 0
+        self._failed = 0
+        self._spilled = 0
+        self._replayed = 0
+
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._spill_path = os.path.join(self.spill_dir, f'spill-{os.getpid()}.log')
+            # Leftovers from an earlier run are replayed by the worker as soon as it starts
+            self._spill_pending = bool(glob.glob(os.path.join(self.spill_dir, '*.log')))
+
+        self._worker = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._worker.start()
+
+    @property
+    def healthy(self) -> bool:
+        """False while the last batch failed, i.e. the target looks unreachable"""
+        return self._healthy
+
+    def submit(self, op: Dict):
+        """Queue an operation; when the queue is full or closed, spill it or apply it in the caller"""
+        self._submitted += 1
+        if not self._closed:
+            try:
+                self._queue.put_nowait(op)
+                return
+            except queue.Full:
+                pass
+        if self.spill_dir:
+            self._spill([op])
+            return
+        self._inline += 1
+        self._apply([op])
+
+    def _run(self):
+        while True:
+            try:
+                op = self._queue.get(timeout=self.replay_interval if self._spill_pending else 0.5)
+            except queue.Empty:
+                if self._closed:
+                    return
+                self._maybe_replay()
+                continue
+            batch = [op]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._in_flight = batch
+            try:
+                if self._apply(batch):
+                    self._maybe_replay()
+            finally:
+                self._in_flight = None
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _apply(self, batch: List[Dict], spill: bool = True) -> bool:
+        # While the target is known to be failing, give up after one attempt
+        attempts = self.max_retries + 1 if self._healthy else 1
+        for attempt in range(attempts):
+            try:
+                self.handler(batch)
+                self._batches += 1
+                self._healthy = True
+                return True
+            except Exception as e:
+                if attempt == attempts - 1:
+                    self._healthy = False
+                    if spill and self.spill_dir:
+                        print(f"Error applying {len(batch)} deferred writes, spilling to disk: {str(e)}")
+                        self._spill(batch)
+                    elif spill:
+                        self._failed += len(batch)
+                        print(f"Error applying {len(batch)} deferred writes: {str(e)}")
+                    return False
+                time.sleep(self.retry_delay * (2 ** attempt))
+
+    def _spill(self, ops: List[Dict]):
+        lines = ''.join(json_util.dumps(op, json_options=_SPILL_JSON) + '\n' for op in ops)
+        with self._spill_lock:
+            with open(self._spill_path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self._spilled += len(ops)
+            self._spill_pending = True
+
+    def _claim_spill_logs(self) -> List[str]:
+        """Move our spill log and those of dead processes aside for replay; returns the files to replay"""
+        pid = os.getpid()
+        with self._spill_lock:
+            for path in glob.glob(os.path.join(self.spill_dir, 'spill-*.log')) + \
+                    glob.glob(os.path.join(self.spill_dir, 'replay-*.log')):
+                owner = int(os.path.basename(path).split('-')[1].split('.')[0])
+                if owner != pid and _pid_alive(owner):
+                    continue
+                if path.startswith(os.path.join(self.spill_dir, 'replay-')) and owner == pid:
+                    continue
+                target = os.path.join(self.spill_dir, f'replay-{pid}-{time.time_ns()}.log')
+                try:
+                    os.replace(path, target)
+                except FileNotFoundError:
+                    continue  # another process claimed it first
+            self._spill_pending = False
+        return sorted(glob.glob(os.path.join(self.spill_dir, f'replay-{pid}-*.log')))
+
+    def _maybe_replay(self):
+        if not self._spill_pending or time.monotonic() - self._last_replay < self.replay_interval:
+            return
+        self.replay()
+
+    def replay(self) -> bool:
+        """Apply spilled operations; True when nothing is left on disk"""
+        if not self.spill_dir:
+            return True
+        with self._replay_lock:
+            self._last_replay = time.monotonic()
+            for path in self._claim_spill_logs():
+                with open(path, encoding='utf-8') as f:
+                    ops = [json_util.loads(line, json_options=_SPILL_JSON) for line in f if line.strip()]
+                for start in range(0, len(ops), self.batch_size):
+                    if not self._apply(ops[start:start + self.batch_size], spill=False):
+                        # Keep what is left for the next attempt
+                        remaining = ops[start:]
+                        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                            f.writelines(json_util.dumps(op, json_options=_SPILL_JSON) + '\n' for op in remaining)
+                            f.flush()
+                            os.fsync(f.fileno())
+                        os.replace(path + '.tmp', path)
+                        self._spill_pending = True
+                        return False
+                    self._replayed += len(ops[start:start + self.batch_size])
+                os.remove(path)
+            return True
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until every queued operation has been applied or spilled; False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 10):
+        """
+        Apply what is queued and stop the worker; later submits are spilled or
+        applied inline. If the worker cannot finish within `timeout`, whatever
+        is still queued or in flight is spilled so it survives the exit.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._worker.join(timeout)
+        if self._worker.is_alive() and self.spill_dir:
+            leftover = list(self._in_flight or [])  # applying it twice is harmless
+            while True:
+                try:
+                    leftover.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if leftover:
+                self._spill(leftover)
+
+    def stats(self) -> dict:
+        return {
+            'queued': self._queue.qsize(),
+            'max_size': self._queue.maxsize,
+            'submitted': self._submitted,
+            'applied_inline': self._inline,
+            'batches': self._batches,
+            'failed': self._failed,
+            'spilled': self._spilled,
+            'replayed': self._replayed,
+            'spill_pending': self._spill_pending
+        }
@@ -0,0 +1,128 @@
+"""
+Check that the pandas, columnar and MongoDB aggregation analytics engines
+agree, then compare their latency.
+
+The pandas engine fetches every conversation and message document and groups
+them in Python; the columnar engine fetches projected fields into NumPy
+arrays; the mongo engine runs $group pipelines on the server and only
+transfers the aggregated rows. Random conversations and messages are seeded
+into a scratch database, every engine runs over them, and any difference in
+the results fails the run before timings are reported.
+
+Usage:
+    python benchmarks/bench_analytics_engines.py --conversations 50 500 --messages-per-conversation 20
+
+Requires a running MongoDB at MONGO_URI (default mongodb://localhost:27017/).
+The scratch database is dropped afterwards.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.models.database import Database
+from app.utils.data_analysis_service import ActivityColumns, DataAnalysisService
+from app.utils.mongo_analysis_service import MongoAnalysisService
+
+SAMPLE_TEXT = ['', 'ok', 'Short answer.', 'Ünïcödé ✓ text', 'x' * 500]
+
+
+def seed(db, user_id, conversations, messages_per_conversation):
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(days=30)
+    for _ in range(conversations):
+        created_at = start + timedelta(minutes=random.randint(0, 30 * 24 * 60))
+        conversation_id = db.conversations.insert_one({
+            'user_id': user_id, 'title': 'bench', 'created_at': created_at, 'updated_at': created_at
+        }).inserted_id
+        messages = [
+            {
+                'conversation_id': conversation_id,
+                'role': random.choice(['user', 'assistant']),
+                'content': random.choice(SAMPLE_TEXT + ['y' * random.randint(1, 2000)]),
+                'timestamp': created_at + timedelta(seconds=30 * i)
+            }
+            for i in range(messages_per_conversation)
+        ]
+        if messages:
+            db.messages.insert_many(messages)
+
+
+def pandas_report(db, analysis, user_id):
+    conversations = db.get_conversations(user_id, limit=0)
+    messages = []
+    for conv in conversations:
+        messages.extend(db.get_messages(conv['_id']))
+    return {
+        'engagement': analysis.analyze_user_engagement(conversations, messages),
+        'time_series': analysis.generate_time_series_analysis(conversations)
+    }
+
+
+def mongo_report(mongo_analysis, user_id):
+    return {
+        'engagement': mongo_analysis.analyze_user_engagement(user_id),
+        'time_series': mongo_analysis.generate_time_series_analysis(user_id)
+    }
+
+
+def columnar_report(db, analysis, user_id):
+    report = analysis.analyze_columns(ActivityColumns.load(db, user_id))
+    return {'engagement': report['engagement'], 'time_series': report['time_series']}
+
+
+def timed(handler, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        handler()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--conversations', type=int, nargs='+', default=[0, 1, 50, 500])
+    parser.add_argument('--messages-per-conversation', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+    args = parser.parse_args()
+
+    # Indexes are created in the scratch database only
+    db = Database(args.mongo_uri, create_indexes=False)
+    db.db = db.client['chatbot_analytics_bench']
+    db.users = db.db['users']
+    db.conversations = db.db['conversations']
+    db.messages = db.db['messages']
+    db._create_indexes()
+    analysis = DataAnalysisService()
+    mongo_analysis = MongoAnalysisService(db)
+
+    print(f"{'conversations':>13} {'messages':>9} {'pandas (ms)':>12} {'columnar (ms)':>14} {'mongo (ms)':>11}")
+    try:
+        for total in args.conversations:
+            user_id = f'bench_user_{total}'
+            seed(db, user_id, total, args.messages_per_conversation)
+
+            expected = pandas_report(db, analysis, user_id)
+            for name, actual in (('columnar', columnar_report(db, analysis, user_id)),
+                                 ('mongo', mongo_report(mongo_analysis, user_id))):
+                if expected != actual:
+                    print(f"Engines disagree for {total} conversations:\n  pandas: {expected}\n  {name}: {actual}")
+                    sys.exit(1)
+
+            print(f"{total:>13} {total * args.messages_per_conversation:>9} "
+                  f"{timed(lambda: pandas_report(db, analysis, user_id), args.repeat):>12.1f} "
+                  f"{timed(lambda: columnar_report(db, analysis, user_id), args.repeat):>14.1f} "
+                  f"{timed(lambda: mongo_report(mongo_analysis, user_id), args.repeat):>11.1f}")
+    finally:
+        db.client.drop_database('chatbot_analytics_bench')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Show how many concurrent generations one process can hold.
+
+Starts a fake Ollama server with a fixed generation latency and sends N
+simultaneous chats through:
+
+- the blocking ChatService on a fixed pool of worker threads (like a
+  threaded Flask server), and
+- AsyncChatService on a single event loop.
+
+With a 1 s generation, the threaded path finishes in about N / workers
+seconds while the async path stays near 1 s until LLM_MAX_CONCURRENCY is
+reached.
+
+Usage:
+    python benchmarks/bench_async_concurrency.py --levels 1 10 50 100 200 --workers 8
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fake_ollama import start_fake_ollama
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 10, 50, 100, 200])
+    parser.add_argument('--workers', type=int, default=8, help='threads available to the blocking path')
+    parser.add_argument('--latency', type=float, default=1.0, help='fake generation latency in seconds')
+    parser.add_argument('--max-concurrency', type=int, default=256)
+    args = parser.parse_args()
+
+    server, url = start_fake_ollama(first_token_delay=args.latency, tokens_per_sec=0)
+    os.environ['OLLAMA_URL'] = url
+    os.environ['GEMINI_API_KEY'] = ''
+
+    from app.utils.async_llm import AsyncChatService
+    from app.utils.gemini_service import ChatService
+
+    chat_service = ChatService()
+
+    async def run_async_levels():
+        async_service = AsyncChatService(chat_service, max_concurrency=args.max_concurrency)
+        results = {}
+        for level in args.levels:
+            start = time.perf_counter()
+            await asyncio.gather(*(async_service.get_chat_response(f'question {i}') for i in range(level)))
+            results[level] = time.perf_counter() - start
+        await async_service.close()
+        return results
+
+    async_results = asyncio.run(run_async_levels())
+
+    print(f"{'concurrency':>11} | {'threaded (s)':>12} {'req/s':>8} | {'asyncio (s)':>11} {'req/s':>8}")
+    for level in args.levels:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            list(pool.map(lambda i: chat_service.get_chat_response(f'question {i}'), range(level)))
+        threaded = time.perf_counter() - start
+        asynced = async_results[level]
+        print(f"{level:>11} | {threaded:>12.2f} {level / threaded:>8.1f} | {asynced:>11.2f} {level / asynced:>8.1f}")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
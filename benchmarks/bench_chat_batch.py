@@ -0,0 +1,120 @@
+"""
+Wall-clock time of POST /api/chat/batch against the fake Ollama.
+
+Answers the same number of distinct questions (the response cache is off)
+first one by one through POST /api/chat, then as one batch at each worker
+pool size, and reports the time, questions/sec, when the first result line
+arrived and that every question got exactly one result. With a fixed
+generation time the batch should take about questions / pool size
+generation times, not questions generation times.
+
+Usage:
+    python benchmarks/bench_chat_batch.py --questions 100 --pool-sizes 1 4 8 16 32
+
+Needs `pip install mongomock`; no MongoDB or Ollama.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fake_ollama import start_fake_ollama
+
+
+def use_mongomock():
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit('mongomock is not installed (pip install mongomock)')
+    import app.models.database as database_module
+    client = mongomock.MongoClient()
+    database_module.MongoClient = lambda *args, **kwargs: client
+
+
+def run_batch(client, questions):
+    """POST one batch; returns (seconds, seconds to the first result line, result lines, summary)"""
+    started = time.perf_counter()
+    first = None
+    results, summary = [], None
+    response = client.post('/api/chat/batch', json={'user_id': 'bench_user', 'questions': questions},
+                           buffered=False)
+    for line in response.iter_encoded():
+        for item in filter(None, line.decode().split('\n')):
+            payload = json.loads(item)
+            if payload['type'] == 'done':
+                summary = payload
+            else:
+                first = first or time.perf_counter() - started
+                results.append(payload)
+    return time.perf_counter() - started, first, results, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', type=int, default=100)
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--first-token-delay', type=float, default=0.2, help='fake Ollama latency in seconds')
+    parser.add_argument('--tokens-per-sec', type=float, default=200)
+    parser.add_argument('--serial', type=int, default=20,
+                        help='questions answered one by one for the baseline (scaled to --questions)')
+    args = parser.parse_args()
+
+    _, ollama_url = start_fake_ollama(first_token_delay=args.first_token_delay, tokens_per_sec=args.tokens_per_sec)
+    os.environ['OLLAMA_URL'] = ollama_url
+    os.environ['GEMINI_API_KEY'] = ''
+    # Distinct questions are generated anyway; the cache would only hide repeated runs
+    os.environ['RESPONSE_CACHE_ENABLED'] = 'false'
+    for setting in ('OLLAMA_WARMUP_ENABLED', 'SEARCH_INDEX_ENABLED', 'QUESTION_INDEX_ENABLED'):
+        os.environ[setting] = 'false'
+    # Measure the pool, not the scheduler's global limit
+    os.environ['SCHEDULER_MAX_CONCURRENCY'] = str(max(args.pool_sizes))
+    spill_dir = tempfile.mkdtemp(prefix='bench-batch-spill-')
+    os.environ['WRITE_BEHIND_SPILL_DIR'] = spill_dir
+    use_mongomock()
+
+    from app import create_app
+    from app.utils.batch_chat import BatchChat
+    flask_app = create_app()
+    client = flask_app.test_client()
+    try:
+        started = time.perf_counter()
+        for i in range(args.serial):
+            response = client.post('/api/chat', json={'user_id': 'bench_user', 'message': f'serial question {i}'})
+            assert response.status_code == 200, response.get_data(as_text=True)
+        per_question = (time.perf_counter() - started) / args.serial
+        print(f"{args.questions} questions, generation ~{per_question * 1000:.0f} ms each "
+              f"(first token {args.first_token_delay * 1000:.0f} ms)\n")
+        print(f"{'mode':<18} {'seconds':>8} {'q/s':>7} {'first ms':>9} {'speedup':>8} {'ok':>5}")
+        print(f"{'one by one':<18} {per_question * args.questions:>8.2f} {1 / per_question:>7.1f} "
+              f"{per_question * 1000:>9.0f} {1:>7.1f}x {'-':>5}")
+
+        for pool_size in args.pool_sizes:
+            previous = flask_app.config['BATCH_CHAT']
+            flask_app.config['BATCH_CHAT'] = BatchChat(
+                flask_app.config['GEMINI_SERVICE'], flask_app.config['TURN_WRITER'], max_workers=pool_size
+            )
+            previous.close()
+            questions = [f'pool {pool_size} question {i}' for i in range(args.questions)]
+            seconds, first, results, summary = run_batch(client, questions)
+            complete = sorted(result['index'] for result in results) == list(range(args.questions))
+            ok = summary['succeeded'] if complete else 'BAD'
+            print(f"{f'batch, {pool_size} workers':<18} {seconds:>8.2f} {args.questions / seconds:>7.1f} "
+                  f"{first * 1000:>9.0f} {per_question * args.questions / seconds:>7.1f}x {ok:>5}")
+
+        flask_app.config['TURN_WRITER'].flush(timeout=30)
+        saved = flask_app.config['DATABASE'].conversations.count_documents({'user_id': 'bench_user'})
+        print(f"\nconversations saved: {saved} "
+              f"(expected {args.serial + args.questions * len(args.pool_sizes)})")
+    finally:
+        flask_app.config['BATCH_CHAT'].close()
+        flask_app.config['TURN_WRITER'].close()
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
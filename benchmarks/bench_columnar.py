@@ -0,0 +1,98 @@
+"""
+Time and peak memory of the pandas analytics path vs. the columnar NumPy path.
+
+Both paths get the rows a MongoDB cursor would hand them, generated in
+memory so no server is needed: the pandas path gets full message documents
+(_id, conversation_id, role, content, timestamp) and builds DataFrames; the
+columnar path gets the projected {role, length} rows and conversation
+timestamps and builds NumPy arrays. Memory is measured with tracemalloc,
+separately for holding the input rows and for the analysis itself.
+
+Usage:
+    python benchmarks/bench_columnar.py --messages 1000000 --conversations 50000
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.utils.data_analysis_service import ActivityColumns, DataAnalysisService
+
+
+def measure(label, build_input, analyze):
+    gc.collect()
+    tracemalloc.start()
+    rows = build_input()
+    input_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+
+    start = time.perf_counter()
+    analyze(rows)
+    elapsed = time.perf_counter() - start
+    analysis_peak = tracemalloc.get_traced_memory()[1] - input_bytes
+    tracemalloc.stop()
+
+    print(f"{label:<10} {elapsed:9.2f}s  input {input_bytes / 2**20:8.1f} MiB  "
+          f"analysis peak {analysis_peak / 2**20:8.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--conversations', type=int, default=50_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    start = datetime(2024, 1, 1)
+    created_at = [start + timedelta(seconds=rng.randint(0, 365 * 86400)) for _ in range(args.conversations)]
+    conversation_ids = [ObjectId() for _ in range(args.conversations)]
+    lengths = [rng.randint(10, 1200) for _ in range(args.messages)]
+    owners = [rng.randrange(args.conversations) for _ in range(args.messages)]
+    analysis = DataAnalysisService()
+
+    def full_documents():
+        conversations = [
+            {'_id': conversation_ids[i], 'user_id': 'bench_user', 'title': 'bench',
+             'created_at': created_at[i], 'updated_at': created_at[i]}
+            for i in range(args.conversations)
+        ]
+        messages = [
+            {'_id': ObjectId(), 'conversation_id': conversation_ids[owner],
+             'role': 'user' if i % 2 == 0 else 'assistant', 'content': 'x' * lengths[i],
+             'timestamp': created_at[owner] + timedelta(seconds=i % 600)}
+            for i, owner in enumerate(owners)
+        ]
+        return conversations, messages
+
+    def pandas_analyze(rows):
+        conversations, messages = rows
+        analysis.analyze_user_engagement(conversations, messages)
+        analysis.generate_time_series_analysis(conversations)
+
+    def projected_rows():
+        messages = [
+            {'role': 'user' if i % 2 == 0 else 'assistant', 'length': lengths[i]}
+            for i in range(args.messages)
+        ]
+        return list(created_at), messages
+
+    def columnar_analyze(rows):
+        conversations, messages = rows
+        analysis.analyze_columns(ActivityColumns.from_rows(conversations, messages))
+
+    print(f"{args.conversations} conversations, {args.messages} messages")
+    measure('pandas', full_documents, pandas_analyze)
+    measure('columnar', projected_rows, columnar_analyze)
+
+
+if __name__ == '__main__':
+    main()
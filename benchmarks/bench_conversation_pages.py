@@ -0,0 +1,80 @@
+"""
+Page latency of the conversation list at increasing depth.
+
+Seeds one user with many conversations and walks the whole list with the
+keyset cursor (`before`/`next_cursor`), reporting latency at several page
+numbers; an offset (skip) query for the same pages is timed for comparison.
+Keyset pages are an index range scan on (user_id, _id), so their latency
+should stay flat while skip grows with the page number.
+
+Usage:
+    python benchmarks/bench_conversation_pages.py --conversations 100000 --page-size 50
+
+Requires a running MongoDB at MONGO_URI (default mongodb://localhost:27017/).
+Writes to a scratch database which is dropped afterwards.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.models.database import CONVERSATION_LIST_FIELDS, Database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--conversations', type=int, default=100_000)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+    args = parser.parse_args()
+
+    db = Database(args.mongo_uri, create_indexes=False)
+    db.db = db.client['chatbot_pages_bench']
+    db.conversations = db.db['conversations']
+    db.messages = db.db['messages']
+    db._create_indexes()
+
+    user_id = 'bench_user'
+    start = datetime.utcnow() - timedelta(days=365)
+    batch = []
+    for i in range(args.conversations):
+        created_at = start + timedelta(minutes=i)
+        batch.append({'user_id': user_id, 'title': f'Conversation {i}', 'created_at': created_at,
+                      'updated_at': created_at, 'summary': 'x' * 500})
+        if len(batch) == 10_000:
+            db.conversations.insert_many(batch)
+            batch = []
+    if batch:
+        db.conversations.insert_many(batch)
+
+    pages = args.conversations // args.page_size
+    report_at = {1, 10, 100, 1000, pages // 2, pages}
+    projection = {field: 1 for field in CONVERSATION_LIST_FIELDS}
+
+    print(f"{'page':>6} {'keyset (ms)':>12} {'skip (ms)':>10}")
+    try:
+        before = None
+        for page in range(1, pages + 1):
+            started = time.perf_counter()
+            conversations, next_cursor = db.get_conversation_page(user_id, args.page_size, before=before)
+            keyset_ms = (time.perf_counter() - started) * 1000
+
+            if page in report_at:
+                started = time.perf_counter()
+                list(db.conversations.find({'user_id': user_id}, projection).sort('_id', -1)
+                     .skip((page - 1) * args.page_size).limit(args.page_size))
+                skip_ms = (time.perf_counter() - started) * 1000
+                print(f"{page:>6} {keyset_ms:>12.2f} {skip_ms:>10.2f}")
+            if next_cursor is None:
+                break
+            before = conversations[-1]['_id']
+    finally:
+        db.client.drop_database('chatbot_pages_bench')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
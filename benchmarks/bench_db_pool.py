@@ -0,0 +1,56 @@
+"""
+Compare per-request MongoClient creation with the shared pooled client.
+
+The "before" mode mirrors the old route pattern: build a Database (new
+MongoClient, server handshake, four create_index calls), run one query and
+close it. The "after" mode reuses a single pooled Database across threads.
+
+Usage:
+    python benchmarks/bench_db_pool.py --requests 500 --threads 8
+
+Requires a running MongoDB at MONGO_URI (default mongodb://localhost:27017/).
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.models.database import Database
+
+
+def run(label, handler, total, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(lambda _: handler(), range(total)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {total / elapsed:10.1f} req/s  ({elapsed:.2f}s for {total} requests)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--pool-size', type=int, default=50)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+    args = parser.parse_args()
+
+    def per_request_client():
+        db = Database(args.mongo_uri)
+        db.get_conversations('bench_user', limit=10)
+        db.close()
+
+    shared = Database(args.mongo_uri, max_pool_size=args.pool_size)
+
+    def pooled_client():
+        shared.get_conversations('bench_user', limit=10)
+
+    run('before: client per request', per_request_client, args.requests, args.threads)
+    run('after: shared pooled client', pooled_client, args.requests, args.threads)
+    shared.close()
+
+
+if __name__ == '__main__':
+    main()
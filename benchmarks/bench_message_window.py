@@ -0,0 +1,94 @@
+"""
+Opening a 10k-message conversation: the full message list vs. a window.
+
+"before" mirrors the old /api/conversation/<id>: fetch every message and
+serialize them into one JSON body. "after" fetches the latest window and
+then scrolls back with the `before` cursor, timing the first window and
+reporting bytes per response.
+
+Usage:
+    python benchmarks/bench_message_window.py --messages 10000 --window 50
+
+Requires a running MongoDB at MONGO_URI (default mongodb://localhost:27017/).
+Writes to a scratch database which is dropped afterwards.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.models.database import Database
+
+
+def serialize(messages):
+    for msg in messages:
+        msg['_id'] = str(msg['_id'])
+        msg['conversation_id'] = str(msg.get('conversation_id'))
+    return json.dumps({'messages': messages}, default=str)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10_000)
+    parser.add_argument('--window', type=int, default=50)
+    parser.add_argument('--message-chars', type=int, default=800)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+    args = parser.parse_args()
+
+    db = Database(args.mongo_uri, create_indexes=False)
+    db.db = db.client['chatbot_window_bench']
+    db.conversations = db.db['conversations']
+    db.messages = db.db['messages']
+    db._create_indexes()
+
+    conversation_id = db.conversations.insert_one({'user_id': 'bench_user', 'title': 'bench'}).inserted_id
+    start = datetime.utcnow() - timedelta(days=30)
+    db.messages.insert_many([
+        {'conversation_id': conversation_id, 'role': 'user' if i % 2 == 0 else 'assistant',
+         'content': 'x' * args.message_chars, 'timestamp': start + timedelta(seconds=i)}
+        for i in range(args.messages)
+    ])
+
+    def full():
+        return serialize(db.get_messages(conversation_id))
+
+    def first_window():
+        cursor, _ = db.get_message_window(conversation_id, args.window)
+        return serialize(list(cursor))
+
+    try:
+        for label, handler in (('before: all messages', full), ('after: latest window', first_window)):
+            samples = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                body = handler()
+                samples.append(time.perf_counter() - started)
+            samples.sort()
+            print(f"{label:<24} {samples[len(samples) // 2] * 1000:9.2f} ms  {len(body) / 1024:9.1f} KiB")
+
+        # Scroll back through the whole conversation one window at a time
+        before = None
+        windows = 0
+        slowest = 0
+        while True:
+            started = time.perf_counter()
+            cursor, has_more = db.get_message_window(conversation_id, args.window, before=before)
+            messages = list(cursor)
+            slowest = max(slowest, time.perf_counter() - started)
+            windows += 1
+            if not has_more:
+                break
+            before = (messages[0]['timestamp'], messages[0]['_id'])
+        print(f"scrolled back through {windows} windows, slowest {slowest * 1000:.2f} ms")
+    finally:
+        db.client.drop_database('chatbot_window_bench')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
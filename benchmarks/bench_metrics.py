@@ -0,0 +1,73 @@
+"""
+Cost of the /metrics instrumentation.
+
+Times Histogram.observe() from one thread and from several threads at once,
+the contended case of a busy server, and compares it with the work it
+measures: cleaning a typical response and serializing a conversation page.
+Also times rendering /metrics with many label sets.
+
+Usage:
+    python benchmarks/bench_metrics.py --observations 200000 --threads 8
+
+Needs no external services.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.utils.format_utils import clean_response_format
+from app.utils.metrics import MetricsRegistry
+
+RESPONSE = '**Approach:** use a hash map.\n\n* Time: O(n)\n* Space: O(n)\n\n' * 30
+
+
+def per_call_us(func, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--observations', type=int, default=200000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--routes', type=int, default=20)
+    args = parser.parse_args()
+
+    registry = MetricsRegistry()
+    histogram = registry.histogram('bench_seconds', 'benchmark', ('command', 'route'))
+
+    single = per_call_us(lambda: histogram.observe(0.004, 'find', '/api/chat'), args.observations)
+    print(f"observe(), 1 thread            {single:6.2f} us")
+
+    per_thread = args.observations // args.threads
+
+    def observe_many(_):
+        for _ in range(per_thread):
+            histogram.observe(0.004, 'find', '/api/chat')
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(observe_many, range(args.threads)))
+    elapsed = time.perf_counter() - started
+    print(f"observe(), {args.threads} threads           {elapsed / (per_thread * args.threads) * 1e6:6.2f} us (wall time per call)")
+
+    page = {'conversations': [{'_id': 'x' * 24, 'title': 'A conversation title'} for _ in range(50)], 'next_cursor': None}
+    print(f"clean_response_format (2KB)    {per_call_us(lambda: clean_response_format(RESPONSE), 20000):6.2f} us")
+    print(f"json.dumps (50 conversations)  {per_call_us(lambda: json.dumps(page), 20000):6.2f} us")
+
+    for i in range(args.routes):
+        for command in ('find', 'insert', 'update', 'aggregate', 'getMore'):
+            histogram.observe(0.002, command, f'/api/route_{i}')
+    series = args.routes * 5 + 1
+    print(f"render /metrics ({series} series)  {per_call_us(registry.render, 200) / 1000:6.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Throughput of OllamaService spread over several Ollama hosts.
+
+Starts fake Ollama servers that each serve --parallel generations at once
+(the rest wait, like OLLAMA_NUM_PARALLEL), points OLLAMA_URL at 1, 2, 4...
+of them and sends --requests generations from enough threads to keep every
+host busy. Reports throughput, p50/p95 latency and how the requests were
+spread over the hosts. With least-outstanding routing throughput should grow
+about linearly with the number of hosts.
+
+Two more runs on the largest set of hosts:
+- model affinity: one extra host does not have OLLAMA_MODEL and must get no
+  generations once it has been health-checked;
+- failover: one host drops --fail-rate of its generations halfway through,
+  and every request must still succeed on another host.
+
+Usage:
+    python benchmarks/bench_ollama_hosts.py --hosts 1 2 4 --parallel 2 --requests 200
+
+Needs no external services.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fake_ollama import start_fake_ollama
+from app.utils.ollama_service import OllamaService
+
+MODEL = 'qwen2.5:latest'
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000
+
+
+def start_servers(count, args, **kwargs):
+    servers = [start_fake_ollama(first_token_delay=args.first_token_delay, tokens_per_sec=args.tokens_per_sec,
+                                 parallel=args.parallel, **kwargs)
+               for _ in range(count)]
+    return [server for server, _ in servers], [url for _, url in servers]
+
+
+def run(urls, args, health_check=False):
+    """Send args.requests generations through an OllamaService over `urls`"""
+    os.environ['OLLAMA_URL'] = ','.join(urls)
+    os.environ['OLLAMA_MODEL'] = MODEL
+    service = OllamaService()
+    if health_check:
+        service.hosts.check_all()
+    messages = service.build_messages('How does binary search work?')
+    latencies, errors = [], []
+
+    def one(_):
+        started = time.perf_counter()
+        try:
+            service.generate(messages)
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            errors.append(str(e))
+
+    threads = len(urls) * args.parallel * 2
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - started
+    return service, latencies, errors, elapsed
+
+
+def report(label, servers, latencies, errors, elapsed, baseline=None):
+    """One result row; scaling is throughput over `baseline` (one host's throughput)"""
+    throughput = len(latencies) / elapsed
+    spread = '/'.join(str(server.request_count) for server in servers)
+    scaling = f"{throughput / baseline:>6.2f}x" if baseline else f"{'':>7}"
+    print(f"{label:<22} {throughput:>8.1f} {scaling} {percentile(latencies, 50):>8.0f} "
+          f"{percentile(latencies, 95):>8.0f} {len(errors):>7}  {spread}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hosts', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--parallel', type=int, default=2, help='generations each fake host serves at once')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--first-token-delay', type=float, default=0.1)
+    parser.add_argument('--tokens-per-sec', type=float, default=400)
+    parser.add_argument('--fail-rate', type=float, default=0.3)
+    args = parser.parse_args()
+
+    print(f"{args.requests} generations, {args.parallel} at a time per host\n")
+    print(f"{'hosts':<22} {'gen/s':>8} {'scaling':>7} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}  requests per host")
+    baseline = None
+    for count in args.hosts:
+        servers, urls = start_servers(count, args)
+        _, latencies, errors, elapsed = run(urls, args)
+        baseline = baseline or len(latencies) / elapsed / count
+        report(f"{count} host{'s' if count > 1 else ''}", servers, latencies, errors, elapsed, baseline)
+        for server in servers:
+            server.shutdown()
+
+    count = max(args.hosts)
+    servers, urls = start_servers(count, args)
+    wrong, wrong_url = start_fake_ollama(models=('llama3:latest',))
+    _, latencies, errors, elapsed = run(urls + [wrong_url], args, health_check=True)
+    report(f"{count} + 1 without model", servers + [wrong], latencies, errors, elapsed)
+
+    flaky, flaky_urls = start_servers(1, args, fail_rate=args.fail_rate)
+    for server in servers + [wrong]:
+        server.request_count = 0
+    service, latencies, errors, elapsed = run(urls + flaky_urls, args)
+    report(f"{count} + 1 failing {args.fail_rate:.0%}", servers + flaky, latencies, errors, elapsed)
+    print(f"\nfailing host: {flaky[0].failed_count} generations dropped halfway, all retried on another host; "
+          f"{sum(host['failures'] for host in service.hosts.snapshot())} failures recorded")
+
+
+if __name__ == '__main__':
+    main()
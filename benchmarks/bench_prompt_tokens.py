@@ -0,0 +1,125 @@
+"""
+Prompt size and reusable prefix: the old f-string prompt vs. chat messages.
+
+Replays conversations of N turns through the context window (the last
+--window messages) and compares, per turn:
+
+- the old prompt: history, question, then the DSA instructions, all in one
+  indented f-string sent to /api/generate, and
+- the chat messages sent to /api/chat: the pre-rendered system prompt, the
+  history and the question.
+
+Reported are the estimated prompt tokens, how many of them were indentation,
+and how many leading tokens are identical to the previous prompt, which is
+the part a model server can serve from its prompt cache instead of
+evaluating again. "across users" compares the first turns of different
+conversations.
+
+Usage:
+    python benchmarks/bench_prompt_tokens.py --turns 10 --window 6
+
+Needs no external services.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.utils.context_builder import estimate_tokens
+from app.utils.prompts import build_messages
+
+INSTRUCTIONS = """
+            Focus on:
+            1. Algorithmic approach
+            2. Time and space complexity
+            3. Data structures to use
+            4. Step-by-step thought process
+            5. Do NOT provide actual code implementation
+            6. Only provide the approach and explanation
+            7. Format the response in a clean, readable way with proper markdown-style formatting (use * or - for lists, ** for bold text, and avoid HTML tags like <strong>)
+            """
+
+
+def old_prompt(user_input, history):
+    """The prompt OllamaService.build_prompt rendered before the shared prompt module"""
+    if not history:
+        return f"""
+            As a DSA expert, please explain the algorithmic approach to solve this problem:
+            {user_input}
+            {INSTRUCTIONS}"""
+    history_context = ''
+    for msg in history:
+        role = {'user': 'User', 'system': 'Context'}.get(msg['role'], 'Assistant')
+        history_context += f"{role}: {msg['content']}\n\n"
+    return f"""
+            Previous conversation context:
+            {history_context}
+
+            Current question: {user_input}
+
+            As a DSA expert, please explain the algorithmic approach to solve this problem, considering the context if relevant:
+            {INSTRUCTIONS}"""
+
+
+def serialize(messages):
+    # Roughly what a chat template turns the messages into before tokenizing
+    return ''.join(f"<|{msg['role']}|>\n{msg['content']}\n" for msg in messages)
+
+
+def shared_prefix_tokens(a, b):
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return estimate_tokens(a[:length])
+
+
+def indentation_tokens(text):
+    return estimate_tokens(''.join(re.findall(r'(?m)^[ \t]+', text)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=10)
+    parser.add_argument('--window', type=int, default=6, help='messages of history sent with each question')
+    parser.add_argument('--conversations', type=int, default=50)
+    args = parser.parse_args()
+
+    random.seed(1)
+    totals = {'old': [0, 0, 0], 'new': [0, 0, 0]}  # prompt tokens, indentation tokens, reusable prefix tokens
+    firsts = {'old': [], 'new': []}
+    for _ in range(args.conversations):
+        history = []
+        previous = {'old': '', 'new': ''}
+        for turn in range(args.turns):
+            question = f"Question {turn}: " + 'how do I find pairs summing to a target? ' * random.randint(1, 4)
+            window = history[-args.window:]
+            prompts = {'old': old_prompt(question, window), 'new': serialize(build_messages(question, window))}
+            for kind, prompt in prompts.items():
+                totals[kind][0] += estimate_tokens(prompt)
+                totals[kind][1] += indentation_tokens(prompt)
+                totals[kind][2] += shared_prefix_tokens(prompt, previous[kind])
+                previous[kind] = prompt
+                if turn == 0:
+                    firsts[kind].append(prompt)
+            history += [
+                {'role': 'user', 'content': question},
+                {'role': 'assistant', 'content': 'Use a hash map of seen values. ' * random.randint(5, 40)}
+            ]
+
+    prompts_sent = args.conversations * args.turns
+    print(f"{args.conversations} conversations x {args.turns} turns, window {args.window} messages")
+    print(f"{'':<10} {'tokens/turn':>12} {'indentation':>12} {'reusable prefix':>16} {'across users':>13}")
+    for kind, label in (('old', 'f-string'), ('new', 'messages')):
+        tokens, indentation, reusable = totals[kind]
+        across = sum(shared_prefix_tokens(a, b) for a, b in zip(firsts[kind], firsts[kind][1:])) / max(1, len(firsts[kind]) - 1)
+        print(f"{label:<10} {tokens / prompts_sent:>12.0f} {indentation / prompts_sent:>12.0f} "
+              f"{reusable / tokens:>15.0%} {across:>13.0f}")
+
+
+if __name__ == '__main__':
+    main()
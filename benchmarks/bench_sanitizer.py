@@ -0,0 +1,125 @@
+"""
+Microbenchmark of clean_response_format on large LLM responses.
+
+Compares the previous implementation (sixteen re.sub passes, reproduced
+below as legacy_clean) with the current one, on raw text, on already
+cleaned text (the cost of a redundant second call), and incrementally
+through StreamSanitizer in token-sized chunks.
+
+First checks that streamed text with comparisons ("while left < right",
+"i <= n") comes out of StreamSanitizer.feed() as it arrives instead of
+being held back until close(); exits with status 1 if it does not.
+
+Usage:
+    python benchmarks/bench_sanitizer.py --size-kb 64 256 --repeat 20
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.utils.format_utils import StreamSanitizer, clean_response_format
+
+_TAGS = r'(strong|em|b|i|u|s|strike|del|ins|mark|small|sub|sup|code|pre|span|div|p|br|hr|ol|ul|li|a|img|blockquote|h1|h2|h3|h4|h5|h6)'
+
+
+def legacy_clean(text):
+    cleaned = re.sub(r'<' + _TAGS + r'[^>]*?>', '', text, flags=re.IGNORECASE)
+    cleaned = re.sub(r'</' + _TAGS + r'>', '', cleaned, flags=re.IGNORECASE)
+    cleaned = re.sub(r'<[^>]*?>', '', cleaned)
+    cleaned = re.sub(r'\n\s*\n\s*\n+', '\n\n', cleaned)
+    cleaned = re.sub(r'[ \t]+\n', '\n', cleaned)
+    cleaned = re.sub(r'\n\s+', '\n', cleaned)
+    cleaned = re.sub(r'&nbsp;', ' ', cleaned)
+    cleaned = re.sub(r'&lt;', '<', cleaned)
+    cleaned = re.sub(r'&gt;', '>', cleaned)
+    cleaned = re.sub(r'&amp;', '&', cleaned)
+    cleaned = re.sub(r'&quot;', '"', cleaned)
+    cleaned = re.sub(r'&#39;', "'", cleaned)
+    cleaned = re.sub(r'&[a-zA-Z]+;', '', cleaned)
+    return cleaned.strip()
+
+
+def make_response(size, rng):
+    words = ['the', 'model', 'returns', 'a', 'list', 'of', 'values', 'and', 'then', 'prints', 'them.']
+    decorations = ['<strong>', '</strong>', '<em>', '</em>', '&amp;', '&quot;', '<br>', '\n\n\n', '  \n  ']
+    parts = []
+    length = 0
+    while length < size:
+        piece = rng.choice(decorations) if rng.random() < 0.08 else rng.choice(words) + ' '
+        parts.append(piece)
+        length += len(piece)
+    return ''.join(parts)
+
+
+def timed(handler, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        handler()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000
+
+
+def stream_clean(chunks):
+    return ''.join(StreamSanitizer.wrap(chunks))
+
+
+def check_comparisons():
+    """Feed comparison-heavy text token by token; each token must come out once the next one arrives"""
+    text = ("Binary search keeps two indexes: while left < right, take mid. "
+            "If a[mid] <= target, move left; for i <= n the loop ends. "
+            "Use <code>mid</code> carefully: x << 1 doubles and 3 < 5.")
+    # "a<b" is held back on purpose: it may still become a tag like "<b>"
+    tokens = [token + ' ' for token in text.split(' ')]
+    sanitizer = StreamSanitizer()
+    streamed = ''
+    failures = []
+    for i, token in enumerate(tokens):
+        streamed += sanitizer.feed(token)
+        expected = clean_response_format(''.join(tokens[:i]))
+        if len(streamed) < len(expected) and not failures:
+            failures.append(f"held back after {''.join(tokens[:i + 1])!r}: only {streamed!r} emitted")
+    streamed += sanitizer.close()
+    if streamed != clean_response_format(text):
+        failures.append(f"streamed text differs from clean_response_format: {streamed!r}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-kb', type=int, nargs='+', default=[4, 64, 256])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--chunk-chars', type=int, default=16, help='characters per streamed chunk')
+    args = parser.parse_args()
+
+    failures = check_comparisons()
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+    print("comparisons stream before close(): ok\n")
+
+    rng = random.Random(1)
+    print(f"{'size':>7} {'legacy':>9} {'current':>12} {'2nd call':>9} {'legacy 2nd':>11} {'streamed':>9}   (ms)")
+    for size_kb in args.size_kb:
+        text = make_response(size_kb * 1024, rng)
+        cleaned = clean_response_format(text)
+        chunks = [text[i:i + args.chunk_chars] for i in range(0, len(text), args.chunk_chars)]
+        assert stream_clean(chunks) == cleaned
+
+        print(f"{size_kb:>5}KB "
+              f"{timed(lambda: legacy_clean(text), args.repeat):>9.2f} "
+              f"{timed(lambda: clean_response_format(text), args.repeat):>12.2f} "
+              f"{timed(lambda: clean_response_format(cleaned), args.repeat):>9.2f} "
+              f"{timed(lambda: legacy_clean(legacy_clean(text)), args.repeat):>11.2f} "
+              f"{timed(lambda: stream_clean(chunks), args.repeat):>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+History search latency on a large corpus.
+
+Indexes synthetic messages (Zipf-distributed vocabulary, so a few terms are
+in most messages and most terms are rare) spread over users with skewed
+history sizes, then times SearchIndex.rank() for rare, common and
+multi-term queries, for a typical user and for the heaviest one. Reports
+build time and the memory the index takes.
+
+Loading the page of hits (two `$in` queries on _id) is not included; it
+does not grow with the corpus.
+
+Usage:
+    python benchmarks/bench_search.py --messages 1000000 --users 2000 --queries 200
+
+Needs no external services.
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import time
+
+import numpy as np
+from bson import ObjectId
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.utils.search_index import SearchIndex
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--vocabulary', type=int, default=50000)
+    parser.add_argument('--words', type=int, default=60, help='average words per message')
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    random.seed(1)
+    vocabulary = np.array([f'w{i}' for i in range(args.vocabulary)])
+    # Pareto-distributed history sizes: most users have little, a few have a lot
+    weights = rng.pareto(1.2, args.users) + 1
+    owners = rng.choice(args.users, size=args.messages // 20 + 1, p=weights / weights.sum())
+
+    index = SearchIndex(db=None)
+    conversations = [ObjectId() for _ in owners]
+    for conversation, owner in zip(conversations, owners):
+        index._add_conversation(conversation, f'user_{owner}')
+
+    rss_before = rss_mb()
+    build_seconds = 0.0
+    batch = 10000
+    for start in range(0, args.messages, batch):
+        count = min(batch, args.messages - start)
+        lengths = rng.poisson(args.words, count) + 1
+        words = vocabulary[np.minimum(rng.zipf(1.3, lengths.sum()) - 1, args.vocabulary - 1)]
+        texts, position = [], 0
+        for length in lengths:
+            texts.append(' '.join(words[position:position + length]))
+            position += length
+        message_conversations = rng.integers(0, len(conversations), count)
+        started = time.perf_counter()
+        for text, conversation in zip(texts, message_conversations):
+            index.add(ObjectId(), conversations[conversation], text)
+        build_seconds += time.perf_counter() - started
+    # Messages are spread evenly over conversations, so the user with most conversations has most messages
+    heaviest = f'user_{int(np.argmax(np.bincount(owners, minlength=args.users)))}'
+
+    print(f"{args.messages} messages, {args.users} users, {len(index._postings)} terms")
+    print(f"build {build_seconds:.1f}s ({args.messages / build_seconds:,.0f} messages/s), "
+          f"memory ~{rss_mb() - rss_before:,.0f} MB (max RSS growth)")
+
+    postings = sorted(index._postings.items(), key=lambda item: len(item[1]))
+    common = [term for term, _ in postings[-20:]]
+    # In 0.1% to 2% of messages: a distinctive word most users have used a few times
+    rare = [term for term, entries in postings
+            if args.messages / 1000 <= len(entries) // 3 <= args.messages / 50] or [postings[0][0]]
+    queries = {
+        'rare term': lambda: random.choice(rare),
+        'common term': lambda: random.choice(common),
+        '3 terms': lambda: ' '.join([random.choice(common), random.choice(rare), random.choice(rare)]),
+    }
+    print(f"{'query':<14} {'user':<9} {'p50 ms':>8} {'p95 ms':>8} {'matches':>9}")
+    for label, make_query in queries.items():
+        for user_label, pick_user in (('typical', lambda: f'user_{random.randrange(args.users)}'),
+                                      ('heaviest', lambda: heaviest)):
+            samples, matches = [], 0
+            for _ in range(args.queries):
+                query, user_id = make_query(), pick_user()
+                started = time.perf_counter()
+                _, total = index.rank(user_id, query, limit=20, offset=0)
+                samples.append(time.perf_counter() - started)
+                matches += total
+            print(f"{label:<14} {user_label:<9} {percentile(samples, 50):>8.2f} {percentile(samples, 95):>8.2f} "
+                  f"{matches / args.queries:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Similar-question retrieval: quality of the hashed n-gram vectors and top-k latency at 1M rows.
+
+1. Paraphrase check: a few DSA questions are embedded with thousands of
+   distractors; for each rewording the rank of its original is reported.
+2. Scale: synthetic questions (topics x phrasings x noise words) are
+   embedded into a QuestionIndex on a temporary directory, then top-k
+   latency is measured for searches over one user's questions (what the
+   app runs) and, for reference, a full scan over everyone's. Re-opening
+   the files, as on startup, is timed too.
+
+Usage:
+    python benchmarks/bench_similar_questions.py --rows 1000000 --queries 200
+
+Needs no external services.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.utils.vector_index import HashingVectorizer, QuestionIndex, owner_key
+
+PARAPHRASES = [
+    ('How do I find two numbers in an array that sum to a target?',
+     'find two numbers summing to a target in an array'),
+    ('Detect a cycle in a linked list', 'how can I check whether a linked list has a cycle?'),
+    ('What is the time complexity of merge sort?', 'merge sort time complexity'),
+    ('Explain binary search on a sorted array', 'explain how binary search works on sorted arrays'),
+    ('Longest substring without repeating characters', 'find the longest substring with no repeated characters'),
+    ('How does Dijkstra find shortest paths?', 'shortest path with Dijkstra algorithm explained'),
+]
+TOPICS = [
+    'two sum', 'binary search', 'merge sort', 'quick sort', 'heap', 'linked list cycle', 'lru cache',
+    'dijkstra shortest path', 'topological sort', 'union find', 'trie', 'segment tree', 'knapsack',
+    'longest increasing subsequence', 'edit distance', 'sliding window maximum', 'bfs on a grid',
+    'dfs on a tree', 'minimum spanning tree', 'matrix rotation', 'interval merging', 'string hashing',
+]
+PHRASINGS = [
+    'how do I solve {} efficiently', 'explain {} with an example', 'what is the complexity of {}',
+    'when should I use {}', '{} approach for large inputs', 'why does {} work',
+]
+NOISE = 'array string graph tree node edge value index target sorted unsorted pair count memory time fast'.split()
+
+
+def synthetic_questions(count, rng):
+    return [
+        random.choice(PHRASINGS).format(random.choice(TOPICS)) + ' ' + ' '.join(rng.choice(NOISE, 3))
+        for _ in range(count)
+    ]
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000
+
+
+def paraphrase_check(vectorizer, distractors):
+    corpus = [original for original, _ in PARAPHRASES] + distractors
+    vectors = vectorizer.transform_many(corpus)
+    print("Paraphrase -> rank of the original question among "
+          f"{len(corpus)} (cosine of the pair)")
+    for i, (original, rewording) in enumerate(PARAPHRASES):
+        scores = vectors @ vectorizer.transform(rewording)
+        rank = int((scores > scores[i]).sum()) + 1
+        print(f"  {rank:>4}  ({scores[i]:.2f})  {rewording}")
+
+
+def timed(func, queries):
+    samples, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(func(query))
+        samples.append(time.perf_counter() - started)
+    return samples, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(1)
+    rng = np.random.default_rng(1)
+    vectorizer = HashingVectorizer(args.dim)
+    paraphrase_check(vectorizer, synthetic_questions(5000, rng))
+
+    directory = tempfile.mkdtemp(prefix='question-index-')
+    try:
+        index = QuestionIndex(db=None, directory=directory, dim=args.dim)
+        index.writer = True
+        index._load()
+
+        embed_seconds = 0.0
+        users = [f'user_{i}' for i in range(args.users)]
+        owners = np.array([owner_key(user) for user in users])
+        for start in range(0, args.rows, 10000):
+            count = min(10000, args.rows - start)
+            questions = synthetic_questions(count, rng)
+            started = time.perf_counter()
+            vectors = vectorizer.transform_many(questions)
+            embed_seconds += time.perf_counter() - started
+            keys = rng.integers(0, 256, (count, 24), dtype=np.uint8)
+            index._append(vectors, keys, owners[rng.integers(0, args.users, count)])
+        index._write_meta()
+        print(f"\n{args.rows} rows, dim {args.dim}: embedding {embed_seconds / args.rows * 1e6:.1f} us/question, "
+              f"{index._capacity * args.dim / 1e6:.0f} MB of vectors on disk")
+
+        started = time.perf_counter()
+        reopened = QuestionIndex(db=None, directory=directory, dim=args.dim)
+        reopened._load()
+        print(f"startup: mapping the files {(time.perf_counter() - started) * 1000:.0f} ms")
+
+        queries = synthetic_questions(args.queries, rng)
+        user_samples, _ = timed(lambda q: reopened.search(q, k=args.k, user_id=random.choice(users)), queries)
+        everyone_samples, _ = timed(lambda q: reopened.search(q, k=args.k), queries)
+
+        print(f"\n{'top-' + str(args.k) + ' search':<34} {'p50 ms':>8} {'p95 ms':>8}")
+        print(f"{'one user, exact':<34} {percentile(user_samples, 50):>8.2f} {percentile(user_samples, 95):>8.2f}")
+        print(f"{'everyone, full scan':<34} {percentile(everyone_samples, 50):>8.2f} "
+              f"{percentile(everyone_samples, 95):>8.2f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Measure time-to-first-token for blocking vs. streaming chat responses.
+
+Starts a local fake Ollama server and compares how long the caller waits
+before it has any text: the blocking ChatService.get_chat_response path
+versus the first chunk of ChatService.stream_chat_response.
+
+Usage:
+    python benchmarks/bench_streaming.py --first-token-delay 0.3 --tokens-per-sec 40
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fake_ollama import start_fake_ollama
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--first-token-delay', type=float, default=0.3)
+    parser.add_argument('--tokens-per-sec', type=float, default=40.0)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    server, url = start_fake_ollama(first_token_delay=args.first_token_delay, tokens_per_sec=args.tokens_per_sec)
+    os.environ['OLLAMA_URL'] = url
+    os.environ['GEMINI_API_KEY'] = ''  # benchmark Ollama only
+
+    from app.utils.gemini_service import ChatService
+    chat_service = ChatService()
+
+    for run in range(args.runs):
+        start = time.perf_counter()
+        chat_service.get_chat_response('Explain two sum')
+        blocking = time.perf_counter() - start
+
+        start = time.perf_counter()
+        stream = chat_service.stream_chat_response('Explain two sum')
+        next(stream)
+        first_token = time.perf_counter() - start
+        for _ in stream:
+            pass
+        total = time.perf_counter() - start
+
+        print(f"run {run + 1}: blocking first text {blocking:.3f}s | "
+              f"streaming first token {first_token:.3f}s (complete {total:.3f}s)")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
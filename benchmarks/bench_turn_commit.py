@@ -0,0 +1,106 @@
+"""
+Latency a chat turn's writes add to the response, p50/p99.
+
+"before" replays the old write path: get_user (creating the user if missing), get the
+conversation, insert_one for each message, update updated_at and record the
+usage counters, all sequential. "after" is TurnWriter.commit_turn, with and
+without the write-behind queue for the bookkeeping writes. Each mode commits
+turns into existing conversations; the queue is flushed before timings are
+reported so deferred work is not silently left out.
+
+Usage:
+    python benchmarks/bench_turn_commit.py --turns 2000 --threads 8
+
+Requires a running MongoDB at MONGO_URI (default mongodb://localhost:27017/).
+Writes to a scratch database which is dropped afterwards.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.models.database import Database
+from app.utils.turn_writer import TurnWriter
+from app.utils.usage_stats import UsageStatsService
+
+RESPONSE = 'An answer of typical length. ' * 40
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--conversations', type=int, default=100)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+    args = parser.parse_args()
+
+    db = Database(args.mongo_uri, create_indexes=False)
+    db.db = db.client['chatbot_turn_bench']
+    db.users = db.db['users']
+    db.conversations = db.db['conversations']
+    db.messages = db.db['messages']
+    db._create_indexes()
+    usage_stats = UsageStatsService(db)
+
+    conversation_ids = [
+        db.create_conversation({'user_id': f'user_{i}', 'title': 'bench', 'created_at': datetime.utcnow(),
+                                'updated_at': datetime.utcnow()}).inserted_id
+        for i in range(args.conversations)
+    ]
+
+    def old_path(i):
+        user_id = f'user_{i % args.conversations}'
+        conversation_id = conversation_ids[i % args.conversations]
+        if not db.get_user(user_id):
+            db.users.update_one({'user_id': user_id}, {'$setOnInsert': {'created_at': datetime.utcnow()}},
+                                upsert=True)
+        db.get_conversation(conversation_id)
+        user_message = {'conversation_id': conversation_id, 'role': 'user', 'content': 'question',
+                        'timestamp': datetime.utcnow()}
+        db.add_message(user_message)
+        assistant_message = {'conversation_id': conversation_id, 'role': 'assistant', 'content': RESPONSE,
+                             'timestamp': datetime.utcnow()}
+        db.add_message(assistant_message)
+        db.update_conversation(conversation_id, {'updated_at': datetime.utcnow()})
+        usage_stats.record(user_id, messages=[user_message, assistant_message])
+
+    def run(label, commit, writer=None):
+        def timed(i):
+            started = time.perf_counter()
+            commit(i)
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            samples = list(pool.map(timed, range(args.turns)))
+        if writer:
+            writer.flush()
+        elapsed = time.perf_counter() - started
+        print(f"{label:<28} p50 {percentile(samples, 50):7.2f} ms  p99 {percentile(samples, 99):7.2f} ms  "
+              f"{args.turns / elapsed:8.1f} turns/s incl. flush")
+
+    try:
+        run('before: sequential writes', old_path)
+        for write_behind in (False, True):
+            writer = TurnWriter(db, usage_stats, write_behind=write_behind)
+            label = 'after: write-behind' if write_behind else 'after: one batch, inline'
+            run(label, lambda i: writer.commit_turn(
+                f'user_{i % args.conversations}', conversation_ids[i % args.conversations], 'question', RESPONSE
+            ), writer)
+            writer.close()
+    finally:
+        db.client.drop_database('chatbot_turn_bench')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Compare /api/usage computed from raw messages with the pre-aggregated counters.
+
+The "before" mode mirrors the old endpoint: fetch up to 1000 conversations,
+one messages query per conversation, then build pandas frames. The "after"
+mode reads the user's usage_daily documents and summarizes them.
+
+Usage:
+    python benchmarks/bench_usage.py --conversations 10 100 1000 --messages-per-conversation 20
+
+Requires a running MongoDB at MONGO_URI (default mongodb://localhost:27017/).
+Writes to a scratch database which is dropped afterwards.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.models.database import Database
+from app.utils.data_analysis_service import DataAnalysisService
+from app.utils.usage_stats import UsageStatsService
+
+
+def seed(db, user_id, conversations, messages_per_conversation):
+    start = datetime.utcnow() - timedelta(days=90)
+    for _ in range(conversations):
+        created_at = start + timedelta(minutes=random.randint(0, 90 * 24 * 60))
+        conversation_id = db.conversations.insert_one({
+            'user_id': user_id, 'title': 'bench', 'created_at': created_at, 'updated_at': created_at
+        }).inserted_id
+        db.messages.insert_many([
+            {
+                'conversation_id': conversation_id,
+                'role': 'user' if i % 2 == 0 else 'assistant',
+                'content': 'x' * random.randint(20, 800),
+                'timestamp': created_at + timedelta(seconds=30 * i)
+            }
+            for i in range(messages_per_conversation)
+        ])
+
+
+def timed(handler, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        handler()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--conversations', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--messages-per-conversation', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+    args = parser.parse_args()
+
+    db = Database(args.mongo_uri)
+    db.db = db.client['chatbot_usage_bench']
+    db.conversations = db.db['conversations']
+    db.messages = db.db['messages']
+    db._create_indexes()
+    analysis = DataAnalysisService()
+    usage_stats = UsageStatsService(db)
+
+    print(f"{'conversations':>13} {'messages':>9} {'before (ms)':>12} {'after (ms)':>11}")
+    try:
+        for total in args.conversations:
+            user_id = f'bench_user_{total}'
+            seed(db, user_id, total, args.messages_per_conversation)
+            usage_stats.rebuild(user_id)
+
+            def before():
+                conversations = db.get_conversations(user_id, limit=1000)
+                messages = []
+                for conv in conversations:
+                    messages.extend(db.get_messages(conv['_id']))
+                analysis.analyze_user_engagement(conversations, messages)
+                analysis.generate_time_series_analysis(conversations)
+
+            def after():
+                analysis.analyze_usage_counters(usage_stats.get_days(user_id))
+
+            print(f"{total:>13} {total * args.messages_per_conversation:>9} "
+                  f"{timed(before, args.repeat):>12.1f} {timed(after, args.repeat):>11.1f}")
+    finally:
+        db.client.drop_database('chatbot_usage_bench')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
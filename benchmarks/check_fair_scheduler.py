@@ -0,0 +1,222 @@
+"""
+Check the LLM scheduler under contention with a stub backend.
+
+The stub "generates" by sleeping for --generation seconds and counts how
+many generations run at once. Four checks:
+
+1. Fairness: one heavy user keeps --heavy-threads requests in flight while
+   --light-users users each send requests one after another. Queue wait of
+   the light users is reported with every request in one FIFO queue (all
+   under the same user) and with per-user round-robin queues. With
+   round-robin a light request waits about one generation, not the heavy
+   user's whole backlog.
+2. Limits: never more than --max-concurrency generations at once, from
+   threads and coroutines sharing the scheduler.
+3. Load shedding: a burst from one user beyond the per-user queue limit is
+   refused at once with a Retry-After, instead of queueing.
+4. Rate limit: a user's token bucket admits `burst` requests at once, then
+   `rate` per second.
+
+Usage:
+    python benchmarks/check_fair_scheduler.py --max-concurrency 4 --generation 0.05
+
+Needs no external services. Exits with status 1 if a check fails.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.utils.fair_scheduler import FairScheduler
+from app.utils.llm_errors import OverloadedError
+
+
+class StubBackend:
+    """Sleeps instead of generating; records the highest number of concurrent generations"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.running = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def _enter(self):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+
+    def _exit(self):
+        with self.lock:
+            self.running -= 1
+
+    def generate(self):
+        self._enter()
+        time.sleep(self.seconds)
+        self._exit()
+
+    async def agenerate(self):
+        self._enter()
+        await asyncio.sleep(self.seconds)
+        self._exit()
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000
+
+
+def contention(args, fair):
+    """Queue waits of the light users' requests while the heavy user saturates the scheduler"""
+    scheduler = FairScheduler(max_concurrency=args.max_concurrency, max_queue=10000, max_user_queue=10000)
+    backend = StubBackend(args.generation)
+    stop = threading.Event()
+    light_waits = []
+
+    def request(user_id):
+        started = time.perf_counter()
+        with scheduler.slot(user_id if fair else 'everyone'):
+            waited = time.perf_counter() - started
+            backend.generate()
+        return waited
+
+    def heavy():
+        while not stop.is_set():
+            request('heavy')
+
+    def light(user_id):
+        for _ in range(args.light_requests):
+            light_waits.append(request(user_id))
+            time.sleep(args.generation)
+
+    heavy_threads = [threading.Thread(target=heavy) for _ in range(args.heavy_threads)]
+    for thread in heavy_threads:
+        thread.start()
+    time.sleep(args.generation * 2)  # let the heavy user's backlog build up
+    with ThreadPoolExecutor(args.light_users) as pool:
+        list(pool.map(light, [f'light_{i}' for i in range(args.light_users)]))
+    stop.set()
+    for thread in heavy_threads:
+        thread.join()
+    return light_waits, backend.peak
+
+
+def mixed_limit(args):
+    """Peak concurrency with threads and coroutines sharing one scheduler"""
+    scheduler = FairScheduler(max_concurrency=args.max_concurrency, max_queue=10000, max_user_queue=10000)
+    backend = StubBackend(args.generation)
+
+    def thread_request(i):
+        with scheduler.slot(f'thread_{i % 5}'):
+            backend.generate()
+
+    async def coroutine_request(i):
+        async with scheduler.aslot(f'task_{i % 5}'):
+            await backend.agenerate()
+
+    async def coroutines():
+        await asyncio.gather(*(coroutine_request(i) for i in range(100)))
+
+    with ThreadPoolExecutor(32) as pool:
+        futures = [pool.submit(thread_request, i) for i in range(100)]
+        asyncio.run(coroutines())
+        for future in futures:
+            future.result()
+    return backend.peak
+
+
+def burst(args):
+    """A burst from one user: how many were queued, how many refused and how fast"""
+    scheduler = FairScheduler(max_concurrency=args.max_concurrency, max_queue=200, max_user_queue=args.user_queue)
+    backend = StubBackend(args.generation)
+    refused, refuse_seconds, retry_after = [], [], set()
+
+    def request(_):
+        started = time.perf_counter()
+        try:
+            with scheduler.slot('burst_user'):
+                backend.generate()
+        except OverloadedError as e:
+            refused.append(e.reason)
+            refuse_seconds.append(time.perf_counter() - started)
+            retry_after.add(e.retry_after)
+
+    total = args.max_concurrency + args.user_queue + 50
+    with ThreadPoolExecutor(total) as pool:
+        list(pool.map(request, range(total)))
+    return total, refused, refuse_seconds, retry_after
+
+
+def rate_limit(args):
+    scheduler = FairScheduler(user_rate=args.rate, user_burst=args.burst)
+    admitted = 0
+    started = time.monotonic()
+    while time.monotonic() - started < 1.0:
+        try:
+            scheduler.admit('chatty_user')
+            admitted += 1
+        except OverloadedError:
+            pass
+        time.sleep(0.001)
+    return admitted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-concurrency', type=int, default=4)
+    parser.add_argument('--generation', type=float, default=0.05, help='stub generation time in seconds')
+    parser.add_argument('--heavy-threads', type=int, default=40)
+    parser.add_argument('--light-users', type=int, default=8)
+    parser.add_argument('--light-requests', type=int, default=10)
+    parser.add_argument('--user-queue', type=int, default=20, help='per-user queue limit for the burst check')
+    parser.add_argument('--rate', type=float, default=5)
+    parser.add_argument('--burst', type=float, default=5)
+    args = parser.parse_args()
+    failures = []
+
+    print(f"{args.max_concurrency} slots, {args.generation * 1000:.0f} ms generations, heavy user with "
+          f"{args.heavy_threads} requests in flight, {args.light_users} light users\n")
+    print(f"{'light users queue wait':<24} {'p50 ms':>8} {'p95 ms':>8} {'peak running':>13}")
+    results = {}
+    for label, fair in (('one FIFO queue', False), ('per-user round-robin', True)):
+        waits, peak = contention(args, fair)
+        results[label] = percentile(waits, 95)
+        print(f"{label:<24} {percentile(waits, 50):>8.0f} {percentile(waits, 95):>8.0f} {peak:>13}")
+        if peak > args.max_concurrency:
+            failures.append(f"{label}: {peak} generations ran at once")
+    # A light request waits for one slot to free up, and at most one round of the other light users
+    bound = (1 + args.light_users / args.max_concurrency) * args.generation * 1000 * 2
+    if results['per-user round-robin'] > bound:
+        failures.append(f"round-robin p95 wait {results['per-user round-robin']:.0f} ms above {bound:.0f} ms")
+
+    peak = mixed_limit(args)
+    print(f"\nthreads and coroutines together: peak {peak} running (limit {args.max_concurrency})")
+    if peak > args.max_concurrency:
+        failures.append(f"threads and coroutines: {peak} generations ran at once")
+
+    total, refused, refuse_seconds, retry_after = burst(args)
+    expected = total - args.max_concurrency - args.user_queue
+    print(f"burst of {total} from one user: {len(refused)} refused ({expected} expected beyond "
+          f"{args.max_concurrency} running + {args.user_queue} queued), refused in p95 "
+          f"{percentile(refuse_seconds, 95) if refuse_seconds else 0:.2f} ms, Retry-After {sorted(retry_after)} s")
+    if len(refused) < expected or (refuse_seconds and percentile(refuse_seconds, 95) > args.generation * 1000):
+        failures.append("burst beyond the per-user queue was not refused at once")
+
+    admitted = rate_limit(args)
+    print(f"rate limit {args.rate:g}/s, burst {args.burst:g}: {admitted} admitted in 1 s of back-to-back requests")
+    if not args.burst <= admitted <= args.burst + args.rate + 1:
+        failures.append(f"token bucket admitted {admitted} requests")
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+    print("\nall checks passed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+Check that chat turns survive MongoDB outages when written behind.
+
+The collections are wrapped in a stand-in that raises ConnectionFailure on
+every call while an outage is on. Worker threads commit turns through
+TurnWriter while outages are switched on and off; a small queue forces
+spilling under load. Then, still during an outage, the writer is closed and
+a new one is started on the same spill directory, as after a restart, and
+replays the log. Finally every conversation must hold exactly the messages
+that were committed to it, none missing and none duplicated, and the usage
+counters must have counted every message once.
+
+Also reports how long commit_turn blocked the caller while MongoDB was up
+and while it was down.
+
+Usage:
+    python benchmarks/check_write_behind_outage.py --turns 2000 --threads 8
+
+Requires a running MongoDB at MONGO_URI (default mongodb://localhost:27017/),
+or pass --mongomock to run against mongomock instead. Writes to a scratch
+database which is dropped afterwards. Exits with status 1 if a message was
+lost, duplicated or miscounted.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pymongo.errors import ConnectionFailure
+
+import app.models.database as database_module
+from app.models.database import Database
+from app.utils.turn_writer import TurnWriter
+from app.utils.usage_stats import UsageStatsService
+
+
+class Outage:
+    def __init__(self):
+        self.down = False
+
+
+class FlakyCollection:
+    """Collection proxy whose calls fail while the outage is on"""
+
+    def __init__(self, collection, outage):
+        self._collection = collection
+        self._outage = outage
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            if self._outage.down:
+                raise ConnectionFailure('simulated outage')
+            return attr(*args, **kwargs)
+        return call
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000 if samples else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--queue-size', type=int, default=200)
+    parser.add_argument('--restart-turns', type=int, default=200)
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+    parser.add_argument('--mongomock', action='store_true', help='use mongomock instead of a MongoDB server')
+    args = parser.parse_args()
+
+    if args.mongomock:
+        import mongomock
+        client = mongomock.MongoClient()
+        database_module.MongoClient = lambda *a, **k: client
+
+    db = Database(args.mongo_uri, create_indexes=False)
+    db.db = db.client['chatbot_outage_check']
+    db.users = db.db['users']
+    db.conversations = db.db['conversations']
+    db.messages = db.db['messages']
+    db._create_indexes()
+    usage_stats = UsageStatsService(db)
+
+    outage = Outage()
+    for name in ('users', 'conversations', 'messages'):
+        setattr(db, name, FlakyCollection(getattr(db, name), outage))
+    usage_stats.collection = FlakyCollection(usage_stats.collection, outage)
+
+    spill_dir = tempfile.mkdtemp(prefix='write-behind-')
+    expected = {}  # conversation_id -> user messages committed to it
+    expected_lock = threading.Lock()
+    latencies = {False: [], True: []}
+
+    def commit(writer, i, conversation_id=None):
+        down = outage.down
+        started = time.perf_counter()
+        saved_id = writer.commit_turn(f'user_{i % 20}', conversation_id, f'question {i}', f'answer {i}',
+                                      title='check')
+        latencies[down].append(time.perf_counter() - started)
+        with expected_lock:
+            expected.setdefault(saved_id, []).append(f'question {i}')
+        return saved_id
+
+    def toggle_outages(stop):
+        while not stop.is_set():
+            outage.down = not outage.down
+            stop.wait(random.uniform(0.05, 0.3))
+        outage.down = False
+
+    try:
+        writer = TurnWriter(db, usage_stats, queue_size=args.queue_size, batch_size=50, spill_dir=spill_dir)
+        writer.queue.retry_delay = 0.01
+        writer.queue.replay_interval = 0.1
+
+        # New conversations first, then follow-up turns into them, with outages coming and going
+        stop = threading.Event()
+        toggler = threading.Thread(target=toggle_outages, args=(stop,))
+        toggler.start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            conversation_ids = list(pool.map(lambda i: commit(writer, i), range(args.threads * 10)))
+            list(pool.map(lambda i: commit(writer, i, conversation_ids[i % len(conversation_ids)]),
+                          range(len(conversation_ids), args.turns)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        toggler.join()
+        writer.flush()
+        stats = writer.stats()
+        print(f"{args.turns} turns in {elapsed:.2f}s, {stats['spilled']} turns spilled, "
+              f"{stats['replayed']} replayed so far")
+
+        # Restart during an outage: close() spills what it cannot apply, the next writer replays it
+        outage.down = True
+        for i in range(args.turns, args.turns + args.restart_turns):
+            commit(writer, i, conversation_ids[i % len(conversation_ids)])
+        writer.close(timeout=1)
+        outage.down = False
+        writer = TurnWriter(db, usage_stats, queue_size=args.queue_size, batch_size=50, spill_dir=spill_dir)
+        replayed = writer.replay()
+        writer.close()
+        print(f"restart: {args.restart_turns} turns committed during an outage, replay complete: {replayed}, "
+              f"spill files left: {len(os.listdir(spill_dir))}")
+
+        for down in (False, True):
+            label = 'commit_turn, MongoDB down' if down else 'commit_turn, MongoDB up'
+            print(f"{label:<28} p50 {percentile(latencies[down], 50):7.3f} ms  "
+                  f"p99 {percentile(latencies[down], 99):7.3f} ms  ({len(latencies[down])} turns)")
+
+        lost = duplicated = 0
+        for conversation_id, questions in expected.items():
+            saved = [m['content'] for m in db.messages.find({'conversation_id': conversation_id, 'role': 'user'})]
+            lost += len(set(questions) - set(saved))
+            duplicated += len(saved) - len(set(saved))
+        missing_conversations = sum(1 for conversation_id in expected if not db.get_conversation(conversation_id))
+        total = sum(len(questions) for questions in expected.values())
+        print(f"{total} turns committed: {lost} lost, {duplicated} duplicated, "
+              f"{missing_conversations} conversations missing")
+
+        # A batch that failed halfway through its counter updates is retried; each turn must count once
+        counted = sum(day['messages'] for user in range(20) for day in usage_stats.get_days(f'user_{user}'))
+        print(f"usage counters: {counted} messages counted, {2 * total} saved")
+
+        if lost or duplicated or missing_conversations or counted != 2 * total:
+            sys.exit(1)
+    finally:
+        outage.down = False
+        shutil.rmtree(spill_dir, ignore_errors=True)
+        db.client.drop_database('chatbot_outage_check')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+A local stand-in for the Ollama HTTP API, used by the benchmarks.
+
+Implements POST /api/chat and POST /api/generate (streaming NDJSON and
+non-streaming) and GET /api/tags. Latency before the first token, the token
+rate and the one-off model load time are configurable so streaming,
+concurrency and warm-up behaviour can be measured without a GPU. Like
+OLLAMA_NUM_PARALLEL, `parallel` caps the generations served at once (the
+rest wait), and `fail_rate` makes that share of generations drop the
+connection halfway through, as a crashing node would.
+
+Run standalone:
+    python benchmarks/fake_ollama.py --port 11435 --first-token-delay 0.3 --tokens-per-sec 40
+
+or start it in-process with start_fake_ollama().
+"""
+import argparse
+import contextlib
+import json
+import random
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_TEXT = (
+    "**Approach:** Use a hash map to store each value's index while scanning the array once. "
+    "For every element, check whether target minus the element is already in the map. "
+    "**Time complexity:** O(n). **Space complexity:** O(n)."
+)
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # keep benchmark output readable
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send_json(200, {'models': [{'name': name} for name in self.server.models]})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if self.path not in ('/api/chat', '/api/generate'):
+            self._send_json(404, {'error': 'not found'})
+            return
+        chat = self.path == '/api/chat'
+        # Rough prompt size (about four characters per token) for the eval stats
+        if chat:
+            prompt_chars = sum(len(msg.get('content') or '') for msg in request.get('messages', []))
+        else:
+            prompt_chars = len(request.get('prompt') or '')
+        prompt_eval_count = max(1, prompt_chars // 4)
+
+        with self.server.lock:
+            self.server.request_count += 1
+            if not self.server.loaded:
+                # The first request pays for loading the model, like a cold Ollama
+                time.sleep(self.server.load_delay)
+                self.server.loaded = True
+        if chat and not request.get('messages'):
+            # An empty chat only loads the model
+            self._send_json(200, {'model': request.get('model'), **self._text(chat, ''), 'done': True,
+                                  'done_reason': 'load'})
+            return
+
+        with self.server.slots:
+            self._generate(request, chat, prompt_eval_count)
+
+    def _generate(self, request, chat, prompt_eval_count):
+        tokens = self.server.tokens
+        time.sleep(self.server.first_token_delay)
+        token_interval = 1.0 / self.server.tokens_per_sec if self.server.tokens_per_sec else 0
+        fail = random.random() < self.server.fail_rate
+
+        if not request.get('stream', True):
+            time.sleep(token_interval * len(tokens))
+            if fail:
+                self._drop()
+                return
+            self._send_json(200, {
+                'model': request.get('model'),
+                **self._text(chat, ''.join(tokens)),
+                'done': True,
+                'prompt_eval_count': prompt_eval_count,
+                'eval_count': len(tokens),
+                'eval_duration': int(token_interval * len(tokens) * 1e9)
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i, token in enumerate(tokens):
+            if fail and i == len(tokens) // 2:
+                self._drop()
+                return
+            self._write_chunk({'model': request.get('model'), **self._text(chat, token), 'done': False})
+            time.sleep(token_interval)
+        self._write_chunk({
+            'model': request.get('model'),
+            **self._text(chat, ''),
+            'done': True,
+            'prompt_eval_count': prompt_eval_count,
+            'eval_count': len(tokens),
+            'eval_duration': int(token_interval * len(tokens) * 1e9)
+        })
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _drop(self):
+        """Close the connection without finishing the response"""
+        with self.server.lock:
+            self.server.failed_count += 1
+        self.close_connection = True
+        self.connection.shutdown(socket.SHUT_RDWR)
+
+    @staticmethod
+    def _text(chat, text):
+        # /api/chat wraps generated text in an assistant message, /api/generate does not
+        return {'message': {'role': 'assistant', 'content': text}} if chat else {'response': text}
+
+    def _write_chunk(self, payload):
+        data = json.dumps(payload).encode() + b'\n'
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # accept bursts of concurrent benchmark clients
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections is expected during benchmarks
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_fake_ollama(port=0, first_token_delay=0.3, tokens_per_sec=40.0, text=DEFAULT_TEXT,
+                      models=('qwen2.5:latest',), load_delay=0.0, parallel=None, fail_rate=0.0):
+    """Start a fake Ollama server in a daemon thread and return (server, base_url)"""
+    server = FakeOllamaServer(('127.0.0.1', port), FakeOllamaHandler)
+    server.first_token_delay = first_token_delay
+    server.tokens_per_sec = tokens_per_sec
+    server.tokens = [word + ' ' for word in text.split(' ')]
+    server.models = list(models)
+    server.request_count = 0
+    server.load_delay = load_delay
+    server.loaded = False
+    server.lock = threading.Lock()
+    server.slots = threading.BoundedSemaphore(parallel) if parallel else contextlib.nullcontext()
+    server.fail_rate = fail_rate
+    server.failed_count = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--first-token-delay', type=float, default=0.3)
+    parser.add_argument('--tokens-per-sec', type=float, default=40.0)
+    parser.add_argument('--load-delay', type=float, default=0.0, help='seconds the first request waits for the model')
+    parser.add_argument('--parallel', type=int, default=None, help='generations served at once (default: no limit)')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of generations dropped halfway')
+    args = parser.parse_args()
+
+    server, url = start_fake_ollama(args.port, args.first_token_delay, args.tokens_per_sec,
+                                    load_delay=args.load_delay, parallel=args.parallel, fail_rate=args.fail_rate)
+    print(f"Fake Ollama listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
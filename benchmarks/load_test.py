@@ -0,0 +1,314 @@
+"""
+Load test of the HTTP routes against a fake Ollama and a throwaway database.
+
+Starts the fake Ollama server (configurable first-token delay and token
+rate), a database (mongomock in-process, or an ephemeral mongod on a
+temporary directory), seeds users, conversations and messages, and serves
+the app over real HTTP with the threaded Flask server or the ASGI front end.
+Each scenario is then driven at every concurrency level:
+
+    chat           POST /api/chat, continuing a seeded conversation
+    conversations  GET /api/conversations, first page
+    conversation   GET /api/conversation/<id>, latest message window
+    usage          GET /api/usage with the chosen analytics engine
+
+Throughput and p50/p95/p99 latency per scenario and level are printed and
+written to a JSON file. With --compare, the run is checked against an
+earlier result file and the script exits with status 1 when a scenario's p95
+latency or throughput got worse by more than --tolerance.
+
+Usage:
+    python benchmarks/load_test.py --concurrency 1 8 32 --requests 400 --output results.json
+    python benchmarks/load_test.py --db mongod --server asgi --output after.json --compare before.json
+
+mongomock needs `pip install mongomock` and does not implement every
+aggregation operator, so use --db mongod for the columnar and mongo
+analytics engines. --db mongod needs the mongod binary on PATH.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fake_ollama import start_fake_ollama
+
+SCENARIOS = ('chat', 'conversations', 'conversation', 'usage')
+FAKE_MODEL = 'qwen2.5:latest'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(check, timeout=30, what='service'):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except Exception:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{what} did not start within {timeout}s")
+
+
+def start_mongod():
+    """Start mongod on a temporary directory; returns (process, uri, data_dir)"""
+    binary = shutil.which('mongod')
+    if not binary:
+        sys.exit('mongod not found on PATH; use --db mongomock instead')
+    data_dir = tempfile.mkdtemp(prefix='load-test-mongod-')
+    port = free_port()
+    process = subprocess.Popen(
+        [binary, '--dbpath', data_dir, '--port', str(port), '--bind_ip', '127.0.0.1', '--quiet'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    uri = f'mongodb://127.0.0.1:{port}/'
+    from pymongo import MongoClient
+    wait_for(lambda: MongoClient(uri, serverSelectionTimeoutMS=500).admin.command('ping'), what='mongod')
+    return process, uri, data_dir
+
+
+def use_mongomock():
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit('mongomock is not installed (pip install mongomock); or use --db mongod')
+    import app.models.database as database_module
+    client = mongomock.MongoClient()
+    database_module.MongoClient = lambda *args, **kwargs: client
+
+
+def seed(flask_app, users, conversations_per_user, messages_per_conversation):
+    """Write the history the read scenarios page through; returns {user_id: [conversation ids]}"""
+    db = flask_app.config['DATABASE']
+    start = datetime.utcnow() - timedelta(days=60)
+    owned = {}
+    for u in range(users):
+        user_id = f'load_user_{u}'
+        db.ensure_user(user_id, start)
+        owned[user_id] = []
+        for _ in range(conversations_per_user):
+            created_at = start + timedelta(minutes=random.randint(0, 60 * 24 * 60))
+            conversation_id = db.create_conversation({
+                'user_id': user_id, 'title': 'load test', 'created_at': created_at, 'updated_at': created_at
+            }).inserted_id
+            db.add_messages([
+                {
+                    'conversation_id': conversation_id,
+                    'role': 'user' if i % 2 == 0 else 'assistant',
+                    'content': 'x' * random.randint(20, 600),
+                    'timestamp': created_at + timedelta(seconds=30 * i)
+                }
+                for i in range(messages_per_conversation)
+            ])
+            owned[user_id].append(conversation_id)
+    flask_app.config['USAGE_STATS'].rebuild()
+    return owned
+
+
+def serve(flask_app, server):
+    """Serve the app in a daemon thread; returns the base URL"""
+    port = free_port()
+    if server == 'asgi':
+        import uvicorn
+        from app.asgi import AsgiChatApp
+        config = uvicorn.Config(AsgiChatApp(flask_app), host='127.0.0.1', port=port, log_level='warning')
+        threading.Thread(target=uvicorn.Server(config).run, daemon=True).start()
+    else:
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass  # keep benchmark output readable
+
+        http_server = make_server('127.0.0.1', port, flask_app, threaded=True, request_handler=QuietHandler)
+        http_server.socket.listen(1024)
+        threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{port}'
+    # Ready means the model was warmed up, so the first chat requests do not measure the load
+    wait_for(lambda: requests.get(base_url + '/health/ready', timeout=1).ok, what='app server readiness')
+    return base_url
+
+
+def make_request(scenario, owned, args):
+    """(method, path, json body) for one request of a scenario"""
+    user_id = random.choice(list(owned))
+    if scenario == 'chat':
+        return 'POST', '/api/chat', {
+            'message': f'question {random.random()}',
+            'user_id': user_id,
+            'conversation_id': str(random.choice(owned[user_id]))
+        }
+    if scenario == 'conversations':
+        return 'GET', f'/api/conversations?user_id={user_id}&limit=20', None
+    if scenario == 'conversation':
+        return 'GET', f'/api/conversation/{random.choice(owned[user_id])}?user_id={user_id}', None
+    return 'GET', f'/api/usage?user_id={user_id}&engine={args.engine}', None
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000 if samples else None
+
+
+def run_level(base_url, scenario, concurrency, owned, args):
+    local = threading.local()
+
+    def one(_):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        method, path, body = make_request(scenario, owned, args)
+        started = time.perf_counter()
+        try:
+            response = local.session.request(method, base_url + path, json=body, timeout=args.timeout)
+            response.content  # read the whole (possibly streamed) body
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(min(args.warmup, args.requests))))
+        started = time.perf_counter()
+        samples = list(pool.map(one, range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies = [latency for latency, ok in samples if ok]
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'errors': sum(1 for _, ok in samples if not ok),
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'mean': sum(latencies) / len(latencies) * 1000 if latencies else None,
+            'max': max(latencies) * 1000 if latencies else None
+        }
+    }
+
+
+def compare(results, baseline_path, tolerance):
+    """Print the change against a baseline run; returns the regressions found"""
+    with open(baseline_path) as f:
+        baseline = {(r['scenario'], r['concurrency']): r for r in json.load(f)['results']}
+    regressions = []
+    print(f"\nCompared with {baseline_path} (tolerance {tolerance:.0%}):")
+    for result in results:
+        before = baseline.get((result['scenario'], result['concurrency']))
+        if not before or not before['latency_ms']['p95'] or not result['latency_ms']['p95']:
+            continue
+        p95_change = result['latency_ms']['p95'] / before['latency_ms']['p95'] - 1
+        rps_change = result['throughput_rps'] / before['throughput_rps'] - 1 if before['throughput_rps'] else 0
+        regressed = p95_change > tolerance or rps_change < -tolerance
+        if regressed:
+            regressions.append(result)
+        print(f"{result['scenario']:<14} c={result['concurrency']:<4} p95 {p95_change:+7.1%}  "
+              f"throughput {rps_change:+7.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=400, help='requests per scenario and concurrency level')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--db', choices=('mongomock', 'mongod'), default='mongomock')
+    parser.add_argument('--server', choices=('flask', 'asgi'), default='flask')
+    parser.add_argument('--engine', default='counters', help='analytics engine for the usage scenario')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--conversations-per-user', type=int, default=20)
+    parser.add_argument('--messages-per-conversation', type=int, default=20)
+    parser.add_argument('--first-token-delay', type=float, default=0.05, help='fake Ollama latency in seconds')
+    parser.add_argument('--tokens-per-sec', type=float, default=500)
+    parser.add_argument('--output', default='load_test_results.json')
+    parser.add_argument('--compare', metavar='BASELINE', help='earlier result file to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    _, ollama_url = start_fake_ollama(first_token_delay=args.first_token_delay, tokens_per_sec=args.tokens_per_sec,
+                                      models=(FAKE_MODEL,))
+    os.environ['OLLAMA_URL'] = ollama_url
+    # The model the fake serves, not the one in .env, so the warm-up succeeds and /health/ready turns 200
+    os.environ['OLLAMA_MODEL'] = FAKE_MODEL
+    os.environ['GEMINI_API_KEY'] = ''
+    # Every chat is a new question; cached answers would only measure the cache
+    os.environ['RESPONSE_CACHE_ENABLED'] = 'false'
+
+    mongod = data_dir = spill_dir = index_dir = flask_app = None
+    try:
+        if args.db == 'mongod':
+            mongod, os.environ['MONGO_URI'], data_dir = start_mongod()
+        else:
+            use_mongomock()
+        spill_dir = tempfile.mkdtemp(prefix='load-test-spill-')
+        os.environ['WRITE_BEHIND_SPILL_DIR'] = spill_dir
+        # A fresh question index, so the run neither reads nor writes instance/questions
+        index_dir = tempfile.mkdtemp(prefix='load-test-questions-')
+        os.environ['QUESTION_INDEX_DIR'] = index_dir
+
+        from app import create_app
+        flask_app = create_app()
+        owned = seed(flask_app, args.users, args.conversations_per_user, args.messages_per_conversation)
+        base_url = serve(flask_app, args.server)
+
+        results = []
+        print(f"{'scenario':<14} {'conc':>4} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                result = run_level(base_url, scenario, concurrency, owned, args)
+                results.append(result)
+                latency = result['latency_ms']
+                print(f"{scenario:<14} {concurrency:>4} {result['throughput_rps']:>9.1f} "
+                      f"{latency['p50'] or 0:>9.2f} {latency['p95'] or 0:>9.2f} {latency['p99'] or 0:>9.2f} "
+                      f"{result['errors']:>7}")
+
+        report = {
+            'created_at': datetime.utcnow().isoformat(),
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+            'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                            'cpus': os.cpu_count()},
+            'results': results
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+        if args.compare and compare(results, args.compare, args.tolerance):
+            sys.exit(1)
+    finally:
+        if flask_app:
+            flask_app.config['TURN_WRITER'].close()
+            if flask_app.config['QUESTION_INDEX']:
+                flask_app.config['QUESTION_INDEX'].stop()
+        if mongod:
+            mongod.terminate()
+            mongod.wait(timeout=30)
+        for directory in (data_dir, spill_dir, index_dir):
+            if directory:
+                shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
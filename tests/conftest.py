@@ -0,0 +1,31 @@
+import os
+import sys
+
+import mongomock
+import pytest
+from mongomock import aggregate
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import app.models.database as database_module
+from app.models.database import Database
+
+# mongomock lists $strLenCP as a string operator but does not implement it; the analytics pipelines use it
+_handle_string_operator = aggregate._Parser._handle_string_operator
+
+
+def _string_operator(parser, operator, values):
+    if operator == '$strLenCP':
+        return len(parser.parse(values))
+    return _handle_string_operator(parser, operator, values)
+
+
+aggregate._Parser._handle_string_operator = _string_operator
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """A Database on a fresh in-memory mongomock client"""
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(database_module, 'MongoClient', lambda *args, **kwargs: client)
+    return Database()
@@ -0,0 +1,78 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.utils.data_analysis_service import ActivityColumns, DataAnalysisService
+from app.utils.mongo_analysis_service import MongoAnalysisService
+from app.utils.usage_stats import UsageStatsService
+
+SAMPLE_TEXT = ['', 'ok', 'Short answer.', 'Ünïcödé ✓ text', 'x' * 500]
+
+
+def seed(db, user_id, conversations, messages_per_conversation, rng):
+    start = datetime(2026, 9, 1)
+    for _ in range(conversations):
+        created_at = start + timedelta(minutes=rng.randint(0, 30 * 24 * 60))
+        conversation_id = db.conversations.insert_one({
+            'user_id': user_id, 'title': 'test', 'created_at': created_at, 'updated_at': created_at
+        }).inserted_id
+        messages = [
+            {
+                'conversation_id': conversation_id,
+                'role': rng.choice(['user', 'assistant']),
+                'content': rng.choice(SAMPLE_TEXT + ['y' * rng.randint(1, 2000)]),
+                'timestamp': created_at + timedelta(seconds=30 * i)
+            }
+            for i in range(messages_per_conversation)
+        ]
+        if messages:
+            db.messages.insert_many(messages)
+
+
+def reports(db, user_id):
+    """engagement and time_series of each engine, as /api/usage would compute them"""
+    analysis = DataAnalysisService()
+    conversations = db.get_conversations(user_id, limit=0)
+    messages = []
+    for conv in conversations:
+        messages.extend(db.get_messages(conv['_id']))
+    mongo_analysis = MongoAnalysisService(db)
+    usage_stats = UsageStatsService(db)
+    usage_stats.rebuild(user_id)
+    results = {
+        'pandas': {
+            'engagement': analysis.analyze_user_engagement(conversations, messages),
+            'time_series': analysis.generate_time_series_analysis(conversations)
+        },
+        'mongo': {
+            'engagement': mongo_analysis.analyze_user_engagement(user_id),
+            'time_series': mongo_analysis.generate_time_series_analysis(user_id)
+        },
+        'columnar': analysis.analyze_columns(ActivityColumns.load(db, user_id)),
+        'counters': analysis.analyze_usage_counters(usage_stats.get_days(user_id))
+    }
+    return {name: {key: report[key] for key in ('engagement', 'time_series')} for name, report in results.items()}
+
+
+# The largest history is past the 1000 conversations the pandas engine used to stop at
+@pytest.mark.parametrize('conversations, messages_per_conversation', [(1, 1), (40, 6), (1001, 1)])
+def test_engines_agree(db, conversations, messages_per_conversation):
+    seed(db, 'alice', conversations, messages_per_conversation, random.Random(conversations))
+    # Another user's history must not leak into the report
+    seed(db, 'bob', 5, 3, random.Random(0))
+
+    results = reports(db, 'alice')
+    for name in ('mongo', 'columnar', 'counters'):
+        assert results[name] == results['pandas'], name
+    assert results['pandas']['engagement']['conversations']['total_conversations'] == conversations
+    assert results['pandas']['engagement']['messages']['total_messages'] == conversations * messages_per_conversation
+
+
+def test_engines_agree_on_a_user_without_messages(db):
+    seed(db, 'carol', 3, 0, random.Random(1))
+
+    results = reports(db, 'carol')
+    for name in ('mongo', 'columnar', 'counters'):
+        assert results[name]['engagement'] == results['pandas']['engagement'], name
+    assert results['pandas']['engagement']['messages']['total_messages'] == 0
@@ -0,0 +1,152 @@
+import glob
+import os
+import threading
+from datetime import datetime
+
+import pytest
+from bson import ObjectId, json_util
+from pymongo.errors import ConnectionFailure
+
+from app.utils.turn_writer import TurnWriter
+from app.utils.usage_stats import UsageStatsService
+
+
+@pytest.fixture
+def usage_stats(db):
+    return UsageStatsService(db)
+
+
+def make_writer(db, usage_stats, spill_dir, **kwargs):
+    writer = TurnWriter(db, usage_stats, spill_dir=str(spill_dir), **kwargs)
+    writer.queue.retry_delay = 0
+    writer.queue.replay_interval = 0.05
+    return writer
+
+
+def saved_questions(db, conversation_id):
+    return [m['content'] for m in db.messages.find({'conversation_id': conversation_id, 'role': 'user'})]
+
+
+def counted_messages(usage_stats, user_id):
+    return sum(day['messages'] for day in usage_stats.get_days(user_id))
+
+
+def spilled_ops(spill_dir):
+    ops = []
+    for path in glob.glob(os.path.join(str(spill_dir), '*.log')):
+        with open(path, encoding='utf-8') as f:
+            ops += [json_util.loads(line) for line in f if line.strip()]
+    return ops
+
+
+def test_full_queue_spills_whole_turns(db, usage_stats, tmp_path):
+    writer = make_writer(db, usage_stats, tmp_path, queue_size=1, batch_size=1)
+    conversation_id = writer.commit_turn('alice', None, 'question 0', 'answer 0', title='t')
+    writer.flush()
+
+    # Hold the worker inside its next batch, so the one-slot queue fills up
+    gate = threading.Event()
+    entered = threading.Event()
+    save_messages = db.save_messages
+
+    def blocked_save(messages):
+        entered.set()
+        gate.wait(5)
+        save_messages(messages)
+
+    db.save_messages = blocked_save
+    writer.commit_turn('alice', conversation_id, 'question 1', 'answer 1')
+    assert entered.wait(5)
+    for i in range(2, 6):
+        writer.commit_turn('alice', conversation_id, f'question {i}', f'answer {i}')
+
+    ops = spilled_ops(tmp_path)
+    assert len(ops) == 3
+    for op in ops:
+        # Each spilled line is a whole turn: both messages and the bookkeeping together
+        assert op['op'] == 'turn'
+        assert [m['role'] for m in op['messages']] == ['user', 'assistant']
+        assert op['touch_conversation'] == conversation_id
+
+    gate.set()
+    writer.flush()
+    assert writer.replay()
+    writer.close()
+
+    assert sorted(saved_questions(db, conversation_id)) == [f'question {i}' for i in range(6)]
+    assert counted_messages(usage_stats, 'alice') == 12
+    assert not glob.glob(os.path.join(str(tmp_path), '*.log'))
+
+
+def test_turns_spilled_during_an_outage_are_replayed_after_a_restart(db, usage_stats, tmp_path):
+    writer = make_writer(db, usage_stats, tmp_path)
+    existing = writer.commit_turn('bob', None, 'question 0', 'answer 0', title='t')
+    writer.flush()
+
+    save_conversations, save_messages = db.save_conversations, db.save_messages
+
+    def down(*args):
+        raise ConnectionFailure('down')
+
+    db.save_conversations = db.save_messages = down
+    writer.queue._healthy = False
+    created = writer.commit_turn('bob', None, 'question 1', 'answer 1', title='t')
+    writer.commit_turn('bob', created, 'question 2', 'answer 2')
+    writer.commit_turn('bob', existing, 'question 3', 'answer 3')
+    writer.flush()
+    assert writer.pending_conversation(created) is not None
+    writer.close()
+    assert len(spilled_ops(tmp_path)) == 3
+
+    db.save_conversations, db.save_messages = save_conversations, save_messages
+    restarted = make_writer(db, usage_stats, tmp_path)
+    assert restarted.replay()
+    restarted.close()
+
+    assert db.get_conversation(created)['user_id'] == 'bob'
+    assert sorted(saved_questions(db, created)) == ['question 1', 'question 2']
+    assert sorted(saved_questions(db, existing)) == ['question 0', 'question 3']
+    assert counted_messages(usage_stats, 'bob') == 8
+    assert not os.listdir(str(tmp_path))
+
+
+def test_batch_retried_after_a_partial_failure_is_counted_once(db, usage_stats, tmp_path):
+    writer = make_writer(db, usage_stats, tmp_path)
+    record_batch = usage_stats.record_batch
+    failures = []
+
+    def fail_after_recording(entries):
+        record_batch(entries)
+        if not failures:
+            failures.append(True)
+            raise ConnectionFailure('connection lost after the update was applied')
+
+    usage_stats.record_batch = fail_after_recording
+    conversation_id = writer.commit_turn('carol', None, 'question', 'answer', title='t')
+    writer.flush()
+    writer.close()
+
+    assert failures
+    assert writer.stats()['batches'] == 1
+    assert saved_questions(db, conversation_id) == ['question']
+    assert counted_messages(usage_stats, 'carol') == 2
+    assert sum(day['conversations'] for day in usage_stats.get_days('carol')) == 1
+
+
+def test_usage_counts_each_entry_once_however_it_is_grouped(usage_stats):
+    now = datetime.utcnow()
+
+    def entry(content):
+        return ('dave', [now], [{'_id': ObjectId(), 'role': 'user', 'content': content, 'timestamp': now}])
+
+    first, second, third = entry('a'), entry('bb'), entry('ccc')
+    usage_stats.record_batch([first, second])
+    usage_stats.record_batch([first, second])
+    # Regrouped as on a replay: one entry seen before, one new
+    usage_stats.record_batch([second, third])
+
+    [day] = usage_stats.get_days('dave')
+    assert day['messages'] == 3
+    assert day['conversations'] == 3
+    assert day['content_length'] == 6
+    assert 'counted' not in day